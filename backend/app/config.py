@@ -45,6 +45,148 @@ class Settings(BaseSettings):
     scraper_allowed_domains: Optional[str] = None
     scraper_blocked_domains: Optional[str] = None
     scraper_respect_robots: bool = True
+
+    # Scraper browser pool (warm contexts; size is also the scrape concurrency cap)
+    scraper_pool_size: int = 4
+    scraper_pool_queue_timeout_seconds: float = 30.0
+    scraper_pool_max_uses: int = 50
+
+    # Scraper engines: "http", "browser" or "auto" (HTTP first, Playwright for JS-rendered pages)
+    scraper_default_engine: str = "auto"
+    scraper_http_timeout_seconds: float = 15.0
+    scraper_http_max_connections: int = 100
+    scraper_http_max_bytes: int = 5 * 1024 * 1024
+    scraper_http_min_text_chars: int = 200
+    scraper_engine_memory_max_entries: int = 4096
+    scraper_engine_memory_ttl_seconds: float = 6 * 3600
+
+    # Scraper page readiness: "dom_stable" (MutationObserver quiet period) or "networkidle"
+    scraper_wait_strategy: str = "dom_stable"
+    scraper_dom_quiet_ms: int = 500
+    scraper_readiness_cap_ms: int = 10000
+
+    # Scraper page cache (on disk; stale entries with an ETag/Last-Modified are revalidated)
+    scraper_cache_enabled: bool = True
+    scraper_cache_dir: Optional[str] = None  # Defaults to ~/.cache/omnidev/scrape-cache; must be private to this user
+    scraper_cache_max_bytes: int = 256 * 1024 * 1024
+    scraper_cache_ttl_seconds: float = 300.0
+
+    # Scraper request blocking (Playwright resource types and ad/tracker hosts, comma-separated)
+    scraper_block_resources: str = "image,media,font"
+    scraper_block_domains: Optional[str] = (
+        "doubleclick.net,googlesyndication.com,googleadservices.com,google-analytics.com,"
+        "googletagmanager.com,adservice.google.com,amazon-adsystem.com,facebook.net,"
+        "scorecardresearch.com,quantserve.com,criteo.com,taboola.com,outbrain.com,"
+        "hotjar.com,segment.io,mixpanel.com"
+    )
+    scraper_allow_images_for_screenshots: bool = True
+
+    # Site crawls (/api/scraper/crawl)
+    crawl_default_concurrency: int = 4
+    crawl_max_concurrency: int = 16
+    crawl_per_host_concurrency: int = 2
+    crawl_per_host_delay_ms: int = 250
+    crawl_max_depth: int = 5
+    crawl_max_pages: int = 500
+    crawl_max_seeds: int = 20
+    crawl_max_frontier: int = 10000
+
+    # robots.txt cache (per scheme + host; failed fetches cached for the error TTL)
+    scraper_robots_cache_max_entries: int = 1024
+    scraper_robots_default_ttl_seconds: float = 3600.0
+    scraper_robots_min_ttl_seconds: float = 60.0
+    scraper_robots_max_ttl_seconds: float = 86400.0
+    scraper_robots_error_ttl_seconds: float = 120.0
+    scraper_robots_fetch_timeout_seconds: float = 5.0
+    scraper_max_crawl_delay_seconds: float = 10.0
+
+    # Chat prompt assembly
+    chat_history_token_budget: int = 16000
+    chat_history_keep_recent: int = 6
+
+    # Server-side chat sessions
+    chat_session_max_sessions: int = 1000
+    chat_session_max_bytes: int = 64 * 1024 * 1024
+    chat_session_idle_seconds: int = 3600
+    chat_session_db_path: Optional[str] = None
+
+    # Server-Sent Events
+    sse_heartbeat_seconds: float = 15.0
+
+    # WebSocket frame coalescing (0 ms sends one frame per upstream chunk)
+    ws_coalesce_ms: int = 20
+    ws_coalesce_bytes: int = 2048
+    ws_max_streams: int = 4
+
+    # Admission control for server-key OpenAI calls
+    ai_concurrency_initial: int = 8
+    ai_concurrency_min: int = 1
+    ai_concurrency_max: int = 64
+    ai_queue_max: int = 200
+    ai_queue_max_per_user: int = 20
+    ai_queue_timeout_seconds: float = 30.0
+    ai_latency_target_ms: int = 15000
+
+    # Batch chat
+    ai_batch_default_concurrency: int = 4
+    ai_batch_max_concurrency: int = 16
+
+    # Model routing for chat (tiers ordered fast < cheap < capable)
+    model_router_enabled: bool = True
+    model_tier_fast: str = "gpt-5-nano"
+    model_tier_cheap: str = "gpt-5-mini"
+    model_tier_capable: str = "gpt-5"
+    model_tier_fast_max_tokens: int = 1024
+    model_tier_cheap_max_tokens: int = 4096
+    model_tier_capable_max_tokens: int = 8192
+    # Reasoning tokens count against max tokens; keep the fast tier from spending its cap thinking
+    model_tier_fast_reasoning_effort: Optional[str] = "minimal"
+    model_tier_cheap_reasoning_effort: Optional[str] = None
+    model_tier_capable_reasoning_effort: Optional[str] = None
+    model_router_short_prompt_chars: int = 200
+    model_router_long_prompt_chars: int = 2000
+    model_router_long_history_turns: int = 12
+    model_router_capable_keywords: Optional[str] = (
+        "source code,codebase,code review,compile,debug,traceback,stack trace,refactor,algorithm,architecture,terraform,kubernetes,sql,optimize"
+    )
+    model_router_latency_target_ms: int = 10000  # Time to first token
+    model_router_latency_ttl_seconds: float = 300.0
+
+    # Vision image preprocessing (longest edge in pixels; format is webp or jpeg)
+    vision_max_edge: int = 1536
+    vision_max_edge_ocr: int = 2048
+    vision_output_format: str = "webp"
+    vision_webp_quality: int = 80
+    vision_jpeg_quality: int = 85
+    vision_preprocess_workers: int = 2
+    vision_max_upload_bytes: int = 20 * 1024 * 1024
+    vision_max_image_pixels: int = 40_000_000
+
+    # Batch vision (/api/vision/batch)
+    vision_batch_default_concurrency: int = 4
+    vision_batch_max_concurrency: int = 16
+    vision_batch_max_upload_bytes: int = 200 * 1024 * 1024
+
+    # Vision result cache (perceptual-hash matches within N of 64 bits)
+    vision_cache_enabled: bool = True
+    vision_cache_max_entries: int = 2048
+    vision_cache_max_bytes: int = 16 * 1024 * 1024
+    vision_cache_max_distance: int = 4
+    vision_cache_shared: bool = False
+
+    # Request deadlines (clients may shorten them with X-Request-Timeout)
+    ai_request_timeout_seconds: float = 120.0
+    vision_request_timeout_seconds: float = 90.0
+    scraper_request_timeout_seconds: float = 60.0
+
+    # OpenAI upstream resilience
+    openai_timeout_seconds: float = 120.0
+    openai_max_retries: int = 2
+    openai_backoff_base_ms: int = 250
+    openai_backoff_max_ms: int = 4000
+    openai_hedge_enabled: bool = False
+    openai_breaker_failure_threshold: int = 5
+    openai_breaker_reset_seconds: float = 30.0
     
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -3,14 +3,20 @@ OmniDev - FastAPI Application Entry Point
 Modern full-stack application with AI and DevOps capabilities
 """
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 
 from app.config import get_settings
 from app.routers import ai, devops, vision, location, storage, scraper, auth, analytics
 from app.routers import monitoring
 from app.middleware.security import SecurityMiddleware
+from app.middleware.upload_limit import UploadLimitMiddleware
+from app.services.admission import AdmissionRejected
+from app.services.cancellation import RequestCancelled
+from app.services.scraper_service import scraper_service
+from app.services.serialization import FastJSONResponse
 
 
 settings = get_settings()
@@ -26,6 +32,7 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     print(f"👋 {settings.app_name} shutting down...")
+    await scraper_service.cleanup()
 
 
 app = FastAPI(
@@ -45,10 +52,22 @@ app = FastAPI(
     """,
     version=settings.app_version,
     lifespan=lifespan,
+    default_response_class=FastJSONResponse,
     docs_url="/docs",
     redoc_url="/redoc"
 )
 
+# Innermost middleware: it still cuts off oversized uploads before the
+# route buffers them, and CORS (outside it) adds headers to its 413s so
+# browsers can read the size-limit message
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        "/api/vision/": settings.vision_max_upload_bytes,
+        "/api/vision/batch": settings.vision_batch_max_upload_bytes,
+    },
+)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -65,6 +84,24 @@ app.add_middleware(
 app.add_middleware(SecurityMiddleware)
 
 
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """Shed load with 429 + Retry-After instead of queueing indefinitely"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": exc.reason, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(RequestCancelled)
+async def request_cancelled_handler(request: Request, exc: RequestCancelled):
+    """504 when the deadline passed; 499 (never read) when the client went away"""
+    if exc.reason == "deadline":
+        return JSONResponse(status_code=504, content={"detail": "Request deadline exceeded"})
+    return JSONResponse(status_code=499, content={"detail": "Client disconnected"})
+
+
 # Include routers
 app.include_router(ai.router, prefix="/api/ai", tags=["AI & Chat"])
 app.include_router(devops.router, prefix="/api/devops", tags=["DevOps Agent"])
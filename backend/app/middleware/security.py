@@ -10,6 +10,8 @@ from starlette.responses import Response
 from app.config import get_settings
 from app.services.auth_service import decode_jwt, get_user_id, verify_api_key
 from app.services.metrics import record
+from app.services.cancellation import set_request_deadline
+from app.services.request_context import current_user_id
 
 
 settings = get_settings()
@@ -74,6 +76,7 @@ class SecurityMiddleware(BaseHTTPMiddleware):
             user_id = get_user_id(payload)
             request.state.user_id = user_id
             request.state.user_role = payload.get("role")
+            current_user_id.set(user_id)
         except HTTPException as exc:
             return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
 
@@ -93,6 +96,7 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         except HTTPException as exc:
             return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
 
+        set_request_deadline(request)
         response = await call_next(request)
         record(path, response.status_code)
         return response
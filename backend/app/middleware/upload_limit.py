@@ -0,0 +1,84 @@
+"""
+OmniDev - Upload Size Limit
+Rejects oversized request bodies while they stream in, before they are buffered
+"""
+
+from typing import Dict, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.services.serialization import dumps_bytes
+
+
+class UploadLimitMiddleware:
+    """
+    Pure ASGI middleware enforcing maximum body sizes per path prefix.
+
+    `limits` maps path prefixes to byte limits; the longest matching prefix wins.
+
+    A Content-Length above the limit is rejected before any of the body is read.
+    Chunked or under-declared bodies are counted as they stream; once the limit
+    is crossed a 413 is sent, the app sees a client disconnect, and anything
+    it tries to send afterwards is dropped.
+    """
+
+    def __init__(self, app: ASGIApp, limits: Dict[str, int]):
+        self.app = app
+        self.limits = sorted(limits.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def limit_for(self, path: str) -> Optional[int]:
+        for prefix, max_bytes in self.limits:
+            if path.startswith(prefix):
+                return max_bytes
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        max_bytes = self.limit_for(scope["path"]) if scope["type"] == "http" else None
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        try:
+            declared = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            declared = 0
+        if declared > max_bytes:
+            await self._reject(send, max_bytes)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    rejected = True
+                    await self._reject(send, max_bytes)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # Usually ClientDisconnect from the cut-off body; the 413 is already sent
+            if not rejected:
+                raise
+
+    async def _reject(self, send: Send, max_bytes: int) -> None:
+        body = dumps_bytes({"detail": f"Upload exceeds the {max_bytes / (1024 * 1024):g} MB limit"})
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -3,13 +3,27 @@ OmniDev - AI Router
 Endpoints for AI chat functionality with user-configurable API keys
 """
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, AsyncGenerator, Dict, List, Optional, Set
 from openai import AsyncOpenAI
+import asyncio
+import contextlib
 import json
 
 from app.services.openai_service import openai_service
+from app.services.admission import AdmissionRejected, admission_controller
+from app.services.request_context import current_user_id
+from app.services.upstream import upstream_policy
+from app.services.batch_chat import BatchPrompt, batch_chat_service
+from app.services.prompts import record_usage
+from app.services.session_store import session_store
+from app.services.streaming import coalesce_chunks, format_sse, sse_comment, stream_with_idle
+from app.services.metrics import record_stream
+from app.services.serialization import dumps, dumps_bytes
+from app.services.cancellation import run_cancellable
+from app.services.model_router import model_router
 from app.config import get_settings
 from app.services.auth_service import decode_jwt, get_user_id, verify_api_key
 
@@ -26,73 +40,343 @@ class ChatRequest(BaseModel):
     message: str
     history: Optional[List[ChatMessage]] = None
     api_key: Optional[str] = None  # User-provided API key
+    session_id: Optional[str] = None  # Server-side history replaces `history`
 
 
 class ChatResponse(BaseModel):
     response: str
     status: str = "success"
+    metadata: Optional[Dict[str, Any]] = None
+    session_id: Optional[str] = None
 
 
-def get_system_prompt() -> str:
-    """Get the system prompt for the AI assistant"""
-    return """You are OmniDev AI Assistant, a powerful and knowledgeable AI powered by OpenAI GPT-5 Mini.
-    
-You help users with:
-- Technical questions and coding assistance
-- Cloud computing concepts (AWS, GCP, Azure)
-- DevOps practices and tools
-- Web scraping and browser automation
-- General knowledge and research
-- Image analysis and vision tasks
+class BatchChatItem(BaseModel):
+    id: Optional[str] = None  # Echoed back in the item's result
+    message: str
+    history: Optional[List[ChatMessage]] = None
+
+
+class BatchChatRequest(BaseModel):
+    items: List[BatchChatItem]
+    concurrency: Optional[int] = None
+    token_budget: Optional[int] = None
 
-Be concise, accurate, and friendly. Format responses with markdown when helpful.
-If you don't know something, say so honestly."""
+
+class SessionResponse(BaseModel):
+    session_id: str
+    turns: int = 0
+    history: Optional[List[ChatMessage]] = None
 
 
-async def chat_with_key(message: str, history: Optional[List[dict]], api_key: str) -> str:
+async def chat_with_key(
+    message: str,
+    history: Optional[List[dict]],
+    api_key: str,
+    metadata: Optional[dict] = None,
+) -> str:
     """Chat using a user-provided API key"""
     try:
         client = AsyncOpenAI(api_key=api_key)
-        messages = [{"role": "system", "content": get_system_prompt()}]
-        
-        if history:
-            for msg in history:
-                role = "user" if msg.get("role") == "user" else "assistant"
-                messages.append({"role": role, "content": msg.get("content", "")})
-        
-        messages.append({"role": "user", "content": message})
+        messages = openai_service.build_messages(message, history, metadata)
+        route = openai_service.route(message, history, metadata)
         
         response = await client.chat.completions.create(
-            model="gpt-5-mini",
+            model=route.model,
             messages=messages,
-            max_completion_tokens=8192,
+            max_completion_tokens=route.max_completion_tokens,
         )
+        record_usage("chat", response.usage, metadata)
         
         return response.choices[0].message.content
     except Exception as e:
         return f"❌ Error with your API key: {str(e)}"
 
 
+async def chat_stream_with_key(
+    message: str,
+    history: Optional[List[dict]],
+    api_key: str,
+    metadata: Optional[dict] = None,
+) -> AsyncGenerator[str, None]:
+    """Stream a chat response using a user-provided API key"""
+    try:
+        client = AsyncOpenAI(api_key=api_key)
+        messages = openai_service.build_messages(message, history, metadata)
+        route = openai_service.route(message, history, metadata)
+        
+        stream = await client.chat.completions.create(
+            model=route.model,
+            messages=messages,
+            max_completion_tokens=route.max_completion_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        
+        async with stream:
+            async for chunk in stream:
+                if not chunk.choices:
+                    record_usage("chat_stream", chunk.usage, metadata)
+                elif chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+    except Exception as e:
+        yield f"❌ Error with your API key: {str(e)}"
+
+
+def open_chat_stream(
+    message: str,
+    history: Optional[List[dict]],
+    api_key: Optional[str],
+    metadata: Optional[dict] = None,
+) -> AsyncGenerator[str, None]:
+    """Stream with the user's key if given, otherwise with the server key"""
+    if api_key:
+        return chat_stream_with_key(message, history, api_key, metadata)
+    return openai_service.chat_stream(message, history, metadata)
+
+
+def is_error_reply(response: str) -> bool:
+    """Error and configuration messages are returned as text; keep them out of sessions"""
+    return response.startswith(("❌", "⚠️"))
+
+
+async def load_session(session_id: str, user_id: str):
+    """Fetch a session owned by the user or raise 404"""
+    session = await session_store.get(session_id, user_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+
+async def resolve_history(request: ChatRequest, user_id: str):
+    """Return (session, history) from the request's session or its inline history"""
+    if request.session_id:
+        session = await load_session(request.session_id, user_id)
+        return session, session.history()
+    if request.history:
+        return None, [{"role": msg.role, "content": msg.content} for msg in request.history]
+    return None, None
+
+
+@router.post("/sessions", response_model=SessionResponse)
+async def create_session(http_request: Request):
+    """Create a server-side conversation session"""
+    session = await session_store.create(http_request.state.user_id)
+    return SessionResponse(session_id=session.session_id)
+
+
+@router.get("/sessions/{session_id}", response_model=SessionResponse)
+async def get_session(session_id: str, http_request: Request):
+    """Get a session and its stored history"""
+    session = await load_session(session_id, http_request.state.user_id)
+    return SessionResponse(
+        session_id=session.session_id,
+        turns=len(session.turns),
+        history=[ChatMessage(**msg) for msg in session.history()],
+    )
+
+
+@router.delete("/sessions/{session_id}")
+async def delete_session(session_id: str, http_request: Request):
+    """Delete a session"""
+    if not await session_store.delete(session_id, http_request.state.user_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"status": "deleted", "session_id": session_id}
+
+
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """
     Send a message to the AI and get a response
     
     - **message**: The user's message
     - **history**: Optional previous conversation history
     - **api_key**: Optional user-provided OpenAI API key
+    - **session_id**: Optional server-side session; its stored history is used instead of `history`
     """
-    history = None
-    if request.history:
-        history = [{"role": msg.role, "content": msg.content} for msg in request.history]
+    session, history = await resolve_history(request, http_request.state.user_id)
     
+    metadata: Dict[str, Any] = {}
     # Use user-provided key if available
     if request.api_key:
-        response = await chat_with_key(request.message, history, request.api_key)
+        work = chat_with_key(request.message, history, request.api_key, metadata)
     else:
-        response = await openai_service.chat(request.message, history)
+        work = openai_service.chat(request.message, history, metadata)
+    response = await run_cancellable(http_request, work)
     
-    return ChatResponse(response=response)
+    if session is not None and not is_error_reply(response):
+        await session_store.append(session, ("user", request.message), ("assistant", response))
+    
+    return ChatResponse(
+        response=response,
+        metadata=metadata or None,
+        session_id=session.session_id if session else None,
+    )
+
+
+@router.post("/chat/sse")
+async def chat_sse(request: ChatRequest, http_request: Request):
+    """
+    Stream an AI response as Server-Sent Events
+    
+    Takes the same body as `/chat`. Emits `chunk` events with `{"content": ...}`,
+    then a single `done` event with metadata. Heartbeat comments are sent while
+    the model is thinking, and the upstream request stops when the client disconnects.
+    """
+    session, history = await resolve_history(request, http_request.state.user_id)
+    
+    metadata: Dict[str, Any] = {}
+    if session is not None:
+        metadata["session_id"] = session.session_id
+    
+    async def event_stream():
+        reply: List[str] = []
+        upstream = open_chat_stream(request.message, history, request.api_key, metadata)
+        # Tell proxies the stream is alive before the first token arrives
+        yield sse_comment("stream-open")
+        try:
+            async for chunk in stream_with_idle(upstream, settings.sse_heartbeat_seconds):
+                if chunk is None:
+                    if await http_request.is_disconnected():
+                        return
+                    yield sse_comment()
+                    continue
+                reply.append(chunk)
+                yield format_sse("chunk", {"content": chunk})
+        except AdmissionRejected as exc:
+            # Headers are already sent, so the 429 travels as an error event
+            yield format_sse("error", {"content": exc.reason, "retry_after": exc.retry_after})
+            return
+        
+        response = "".join(reply)
+        if session is not None and not is_error_reply(response):
+            await session_store.append(session, ("user", request.message), ("assistant", response))
+        yield format_sse("done", {"metadata": metadata})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+def to_batch_prompt(item: BatchChatItem, index: int) -> BatchPrompt:
+    history = [{"role": msg.role, "content": msg.content} for msg in item.history] if item.history else None
+    return BatchPrompt(id=item.id or str(index), message=item.message, history=history)
+
+
+async def iter_ndjson_prompts(body: bytes):
+    """Parse prompts from an NDJSON body one line at a time"""
+    index = 0
+    for line in body.splitlines():
+        if line.strip():
+            yield to_batch_prompt(BatchChatItem.model_validate_json(line), index)
+            index += 1
+
+
+async def iter_list_prompts(items: List[BatchChatItem]):
+    for index, item in enumerate(items):
+        yield to_batch_prompt(item, index)
+
+
+@router.post("/chat/batch")
+async def chat_batch(
+    http_request: Request,
+    concurrency: Optional[int] = None,
+    token_budget: Optional[int] = None,
+):
+    """
+    Run many independent prompts and stream results as NDJSON in completion order
+    
+    Body is either JSON `{"items": [{"id", "message", "history"}], "concurrency", "token_budget"}`
+    or an `application/x-ndjson` stream with one item per line (options as query parameters).
+    Each output line is a `result` tagged with the item's `id` and a `status` of
+    success, error, skipped (token budget exhausted) or cancelled; a `summary` line ends the stream.
+    Cancel a running batch with `DELETE /chat/batch/{batch_id}` (id in the `X-Batch-Id` header).
+    """
+    # The body is read up front: once the response streams, Starlette listens on
+    # receive() for disconnects and would race an incremental body reader.
+    raw_body = await http_request.body()
+    content_type = http_request.headers.get("content-type", "")
+    if "ndjson" in content_type:
+        prompts = iter_ndjson_prompts(raw_body)
+    else:
+        try:
+            body = BatchChatRequest.model_validate_json(raw_body)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        concurrency = concurrency or body.concurrency
+        token_budget = token_budget if token_budget is not None else body.token_budget
+        prompts = iter_list_prompts(body.items)
+    
+    job = batch_chat_service.create_job(http_request.state.user_id, concurrency, token_budget)
+    
+    async def result_lines():
+        async for result in batch_chat_service.run(job, prompts):
+            yield dumps_bytes(result) + b"\n"
+    
+    return StreamingResponse(
+        result_lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": job.batch_id, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.delete("/chat/batch/{batch_id}")
+async def cancel_chat_batch(batch_id: str, http_request: Request):
+    """Cancel a running batch; unfinished items are reported as cancelled"""
+    if not batch_chat_service.cancel(batch_id, http_request.state.user_id):
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return {"status": "cancelled", "batch_id": batch_id}
+
+
+async def run_ws_stream(
+    send,
+    user_id: str,
+    stream_id: str,
+    request_data: Dict[str, Any],
+    coalesce_ms: int,
+    coalesce_bytes: int,
+) -> None:
+    """Run one generation on a chat WebSocket, tagging every frame with its stream id"""
+    message = request_data.get("message", "")
+    history = request_data.get("history", [])
+    api_key = request_data.get("api_key")
+    metadata: Dict[str, Any] = {}
+    
+    session = None
+    session_id = request_data.get("session_id")
+    if session_id:
+        session = await session_store.get(session_id, user_id)
+        if session is None:
+            await send({"type": "error", "stream_id": stream_id, "content": "Session not found"})
+            return
+        history = session.history()
+        metadata["session_id"] = session.session_id
+    reply: List[str] = []
+    
+    # Use user key or fallback to service
+    upstream = open_chat_stream(message, history, api_key, metadata)
+    stream_stats: Dict[str, int] = {}
+    try:
+        async for text in coalesce_chunks(upstream, coalesce_ms / 1000, coalesce_bytes, stats=stream_stats):
+            reply.append(text)
+            await send({"type": "chunk", "stream_id": stream_id, "content": text})
+    except AdmissionRejected as exc:
+        await send({"type": "error", "stream_id": stream_id, "content": exc.reason, "retry_after": exc.retry_after})
+        return
+    record_stream("/api/ai/chat/stream", stream_stats["frames"], stream_stats["chunks"])
+    metadata["frames"] = stream_stats["frames"]
+    
+    response = "".join(reply)
+    if session is not None and not is_error_reply(response):
+        await session_store.append(session, ("user", message), ("assistant", response))
+    
+    # Send completion signal
+    await send({"type": "done", "stream_id": stream_id, "metadata": metadata})
 
 
 @router.websocket("/chat/stream")
@@ -101,7 +385,17 @@ async def chat_stream(websocket: WebSocket):
     WebSocket endpoint for streaming AI responses
     
     Send JSON: {"message": "your message", "history": [...], "api_key": "optional"}
+    or {"message": "your message", "session_id": "..."} to use server-side history
     Receive chunked text responses
+    
+    Several generations can run at once: add a "stream_id" to each message and every
+    chunk/done/error frame carries it back. Send {"type": "cancel", "stream_id": "..."}
+    to abort a generation; the server answers with a "cancelled" frame. Messages without
+    a stream_id use "default". At most `ws_max_streams` generations run per connection.
+    
+    Chunks are coalesced into frames of up to `coalesce_bytes` or every `coalesce_ms`.
+    Send {"type": "config", "coalesce_ms": 0} to get one frame per upstream chunk;
+    the server replies with the values in effect.
     """
     token = websocket.query_params.get("token", "")
     api_key = websocket.query_params.get("api_key", "")
@@ -119,57 +413,86 @@ async def chat_stream(websocket: WebSocket):
         return
 
     await websocket.accept()
+    current_user_id.set(user_id)
+    coalesce_ms = settings.ws_coalesce_ms
+    coalesce_bytes = settings.ws_coalesce_bytes
+    streams: Dict[str, asyncio.Task] = {}
+    # Cancelled tasks that may still be closing their upstream stream
+    stopping: Set[asyncio.Task] = set()
+    send_lock = asyncio.Lock()
+    
+    async def send(frame: Dict[str, Any]) -> None:
+        async with send_lock:
+            await websocket.send_text(dumps(frame))
+    
+    async def run_guarded(stream_id: str, request_data: Dict[str, Any]) -> None:
+        try:
+            await run_ws_stream(send, user_id, stream_id, request_data, coalesce_ms, coalesce_bytes)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            with contextlib.suppress(Exception):
+                await send({"type": "error", "stream_id": stream_id, "content": str(e)})
+        finally:
+            # After a cancel the id may already belong to a newer stream; leave that one tracked
+            if streams.get(stream_id) is asyncio.current_task():
+                del streams[stream_id]
     
     try:
         while True:
             # Receive message from client
             data = await websocket.receive_text()
             request_data = json.loads(data)
+            frame_type = request_data.get("type", "start")
             
-            message = request_data.get("message", "")
-            history = request_data.get("history", [])
-            api_key = request_data.get("api_key")
+            if frame_type == "config":
+                coalesce_ms = min(max(int(request_data.get("coalesce_ms", coalesce_ms)), 0), 250)
+                coalesce_bytes = min(max(int(request_data.get("coalesce_bytes", coalesce_bytes)), 1), 65536)
+                await send({
+                    "type": "config",
+                    "coalesce_ms": coalesce_ms,
+                    "coalesce_bytes": coalesce_bytes,
+                    "max_streams": settings.ws_max_streams,
+                })
+                continue
             
-            # Use user key or fallback to service
-            if api_key:
-                client = AsyncOpenAI(api_key=api_key)
-                messages = [{"role": "system", "content": get_system_prompt()}]
-                for msg in history:
-                    messages.append({"role": msg.get("role", "user"), "content": msg.get("content", "")})
-                messages.append({"role": "user", "content": message})
-                
-                stream = await client.chat.completions.create(
-                    model="gpt-5-mini",
-                    messages=messages,
-                    max_completion_tokens=8192,
-                    stream=True,
-                )
-                
-                async for chunk in stream:
-                    if chunk.choices[0].delta.content:
-                        await websocket.send_text(json.dumps({
-                            "type": "chunk",
-                            "content": chunk.choices[0].delta.content
-                        }))
-            else:
-                async for chunk in openai_service.chat_stream(message, history):
-                    await websocket.send_text(json.dumps({
-                        "type": "chunk",
-                        "content": chunk
-                    }))
+            stream_id = str(request_data.get("stream_id") or "default")
+            if frame_type == "cancel":
+                task = streams.pop(stream_id, None)
+                if task is not None:
+                    # Cancelling the task closes the upstream OpenAI stream
+                    task.cancel()
+                    stopping.add(task)
+                    task.add_done_callback(stopping.discard)
+                    await send({"type": "cancelled", "stream_id": stream_id})
+                else:
+                    await send({"type": "error", "stream_id": stream_id, "content": "Unknown stream"})
+                continue
             
-            # Send completion signal
-            await websocket.send_text(json.dumps({
-                "type": "done"
-            }))
+            if stream_id in streams:
+                await send({"type": "error", "stream_id": stream_id, "content": "Stream already running"})
+                continue
+            if len(streams) >= settings.ws_max_streams:
+                await send({
+                    "type": "error",
+                    "stream_id": stream_id,
+                    "content": f"Too many concurrent streams (max {settings.ws_max_streams})",
+                })
+                continue
+            streams[stream_id] = asyncio.create_task(run_guarded(stream_id, request_data))
             
     except WebSocketDisconnect:
         pass
     except Exception as e:
-        await websocket.send_text(json.dumps({
+        await websocket.send_text(dumps({
             "type": "error",
             "content": str(e)
         }))
+    finally:
+        tasks = [*streams.values(), *stopping]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 @router.get("/status")
@@ -177,7 +500,11 @@ async def ai_status():
     """Check AI service status"""
     return {
         "service": "OpenAI",
-        "model": "gpt-5-mini",
+        "models": model_router.active_models(),
         "status": "configured" if openai_service.client else "not configured",
-        "capabilities": ["chat", "streaming", "vision", "user-api-key"]
+        "capabilities": ["chat", "streaming", "multiplexed-streams", "sse", "batch", "vision", "user-api-key", "sessions", "model-routing"],
+        "sessions": session_store.get_stats(),
+        "admission": admission_controller.get_stats(),
+        "upstream": upstream_policy.get_stats(),
+        "model_router": model_router.get_stats(),
     }
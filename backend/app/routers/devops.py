@@ -9,8 +9,11 @@ from typing import Optional
 import json
 import boto3
 
+from app.services.admission import AdmissionRejected
+from app.services.serialization import FastJSONResponse, dumps
 from app.services.devops_agent import devops_agent, DevOpsAgent
 from app.services.auth_service import decode_jwt, get_user_id, verify_api_key
+from app.services.request_context import current_user_id
 
 router = APIRouter()
 
@@ -74,14 +77,15 @@ async def process_command(request: CommandRequest):
 @router.get("/ec2/instances")
 async def list_ec2_instances():
     """List all EC2 instances"""
-    return devops_agent.list_ec2_instances()
+    # Inventories are built from plain dicts; skip the generic encoder walk
+    return FastJSONResponse(devops_agent.list_ec2_instances())
 
 
 @router.post("/ec2/instances")
 async def list_ec2_instances_with_creds(request: ActionRequest):
     """List all EC2 instances with optional user credentials"""
     agent = get_agent(request)
-    return agent.list_ec2_instances()
+    return FastJSONResponse(agent.list_ec2_instances())
 
 
 @router.post("/ec2/launch")
@@ -125,20 +129,20 @@ async def terminate_ec2_instance(request: ActionRequest):
 @router.get("/s3/buckets")
 async def list_s3_buckets():
     """List all S3 buckets"""
-    return devops_agent.list_s3_buckets()
+    return FastJSONResponse(devops_agent.list_s3_buckets())
 
 
 @router.post("/s3/buckets")
 async def list_s3_buckets_with_creds(request: ActionRequest):
     """List all S3 buckets with optional user credentials"""
     agent = get_agent(request)
-    return agent.list_s3_buckets()
+    return FastJSONResponse(agent.list_s3_buckets())
 
 
 @router.get("/s3/objects/{bucket_name}")
 async def list_s3_objects(bucket_name: str, prefix: str = ""):
     """List objects in an S3 bucket"""
-    return devops_agent.list_s3_objects(bucket_name, prefix)
+    return FastJSONResponse(devops_agent.list_s3_objects(bucket_name, prefix))
 
 
 @router.websocket("/agent")
@@ -165,9 +169,10 @@ async def devops_agent_ws(websocket: WebSocket):
         return
 
     await websocket.accept()
+    current_user_id.set(user_id)
     
     # Send welcome message
-    await websocket.send_text(json.dumps({
+    await websocket.send_text(dumps({
         "type": "welcome",
         "message": "👋 DevOps Agent connected! How can I help you manage your cloud infrastructure?",
         "capabilities": devops_agent.get_capabilities()
@@ -194,9 +199,17 @@ async def devops_agent_ws(websocket: WebSocket):
                 agent = devops_agent
             
             # Process the command
-            result = await agent.process_command(command)
+            try:
+                result = await agent.process_command(command)
+            except AdmissionRejected as exc:
+                await websocket.send_text(dumps({
+                    "type": "error",
+                    "content": exc.reason,
+                    "retry_after": exc.retry_after
+                }))
+                continue
             
-            await websocket.send_text(json.dumps({
+            await websocket.send_text(dumps({
                 "type": "response",
                 "content": result.get("response", ""),
                 "actions": result.get("actions", []),
@@ -206,7 +219,7 @@ async def devops_agent_ws(websocket: WebSocket):
     except WebSocketDisconnect:
         pass
     except Exception as e:
-        await websocket.send_text(json.dumps({
+        await websocket.send_text(dumps({
             "type": "error",
             "content": str(e)
         }))
@@ -3,14 +3,22 @@ OmniDev - Web Scraper Router
 API endpoints for web scraping with Playwright
 """
 
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+import re
 
-from app.services.scraper_service import scraper_service
+from app.services.admission import AdmissionRejected
+from app.services.cancellation import RequestCancelled, run_cancellable
+from app.config import get_settings
+from app.services.crawler import crawl_service
+from app.services.serialization import FastJSONResponse, dumps_bytes
+from app.services.scraper_service import ScrapeResult, scraper_service
 
 
 router = APIRouter()
+settings = get_settings()
 
 
 class ScrapeRequest(BaseModel):
@@ -19,6 +27,12 @@ class ScrapeRequest(BaseModel):
     wait_time_ms: int = 2000
     capture_screenshot: bool = False
     extract_selector: Optional[str] = None
+    block_resources: Optional[List[str]] = None
+    block_domains: Optional[List[str]] = None
+    engine: Optional[Literal["http", "browser", "auto"]] = None
+    wait_strategy: Optional[Literal["dom_stable", "networkidle"]] = None
+    quiet_ms: Optional[int] = Field(None, ge=0, le=10000)
+    max_age: Optional[int] = Field(None, ge=0)
 
 
 class ScrapeResponse(BaseModel):
@@ -32,6 +46,28 @@ class ScrapeResponse(BaseModel):
     error: Optional[str] = None
     engine: str
     load_time_ms: int
+    blocked_requests: int = 0
+    bytes_saved: int = 0
+    ready_reason: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    cache_status: Optional[str] = None
+    final_url: Optional[str] = None
+
+
+class CrawlRequest(BaseModel):
+    """Request model for a multi-page crawl"""
+    seeds: List[str] = Field(..., min_length=1)
+    max_depth: int = Field(2, ge=0)
+    max_pages: int = Field(50, ge=1)
+    include: List[str] = []
+    exclude: List[str] = []
+    same_host: bool = True
+    concurrency: Optional[int] = Field(None, ge=1)
+    per_host_concurrency: Optional[int] = Field(None, ge=1)
+    per_host_delay_ms: Optional[int] = Field(None, ge=0)
+    engine: Optional[Literal["http", "browser", "auto"]] = None
+    include_html: bool = False
 
 
 class ScreenshotRequest(BaseModel):
@@ -42,72 +78,134 @@ class ScreenshotRequest(BaseModel):
 class StatusResponse(BaseModel):
     """Response model for scraper status"""
     playwright: dict
+    pool: Optional[dict] = None
+    robots: Optional[dict] = None
+    http_engine: Optional[dict] = None
+    page_cache: Optional[dict] = None
 
 
-@router.post("/scrape", response_model=ScrapeResponse)
-async def scrape_url(request: ScrapeRequest):
+def scrape_response(result: ScrapeResult) -> FastJSONResponse:
     """
-    Scrape a URL using Playwright
+    Serialize a ScrapeResult without re-validating it
+
+    The result is built by our own service and already matches ScrapeResponse;
+    re-validating whole-page HTML and base64 screenshots is pure overhead.
+    """
+    return FastJSONResponse(vars(result))
+
+
+@router.post("/scrape", response_model=None, responses={200: {"model": ScrapeResponse}})
+async def scrape_url(request: ScrapeRequest, http_request: Request):
+    """
+    Scrape a URL over plain HTTP or with Playwright
     
     - **url**: The URL to scrape
-    - **wait_time_ms**: Time to wait for page to load (default: 2000ms)
+    - **wait_time_ms**: Settle time after network idle, `networkidle` strategy only (default: 2000ms)
     - **capture_screenshot**: Whether to capture a screenshot (base64)
     - **extract_selector**: CSS selector to extract specific content
+    - **block_resources**: Resource types to block (`image`, `media`, `font`, `stylesheet`, `script`, ...),
+      replacing the server default; `[]` loads everything
+    - **block_domains**: Extra hosts to block on top of the server's ad/tracker list
+    - **engine**: `http` (plain fetch, no JavaScript), `browser` (Playwright) or `auto`
+      (HTTP first, Playwright when the page looks JS-rendered); defaults to the server setting
+    - **wait_strategy**: `dom_stable` (ready once the DOM stops changing) or `networkidle`
+      (network idle plus `wait_time_ms`); defaults to the server setting
+    - **quiet_ms**: How long the DOM must stay unchanged for `dom_stable`
+    - **max_age**: Seconds a cached copy may be served as-is (default: server cache TTL);
+      older copies are revalidated with the origin, `0` always revalidates
     """
+    # Unset options fall back to the server's configured defaults
+    options = request.model_dump(include={"block_resources", "block_domains", "engine", "wait_strategy", "quiet_ms", "max_age"}, exclude_none=True)
     try:
-        result = await scraper_service.scrape(
+        result = await run_cancellable(http_request, scraper_service.scrape(
             url=request.url,
             wait_time_ms=request.wait_time_ms,
             capture_screenshot=request.capture_screenshot,
             extract_selector=request.extract_selector,
-        )
+            **options,
+        ))
         
-        return ScrapeResponse(
-            success=result.success,
-            url=result.url,
-            title=result.title,
-            html=result.html,
-            text=result.text,
-            screenshot=result.screenshot,
-            error=result.error,
-            engine=result.engine,
-            load_time_ms=result.load_time_ms,
-        )
+        return scrape_response(result)
+    except (RequestCancelled, AdmissionRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/screenshot", response_model=ScrapeResponse)
-async def take_screenshot(request: ScreenshotRequest):
+@router.post("/screenshot", response_model=None, responses={200: {"model": ScrapeResponse}})
+async def take_screenshot(request: ScreenshotRequest, http_request: Request):
     """
     Take a screenshot of a URL
     
     - **url**: The URL to screenshot
     """
     try:
-        result = await scraper_service.take_screenshot(url=request.url)
+        result = await run_cancellable(http_request, scraper_service.take_screenshot(url=request.url))
         
-        return ScrapeResponse(
-            success=result.success,
-            url=result.url,
-            title=result.title,
-            html=result.html,
-            text=result.text,
-            screenshot=result.screenshot,
-            error=result.error,
-            engine=result.engine,
-            load_time_ms=result.load_time_ms,
-        )
+        return scrape_response(result)
+    except (RequestCancelled, AdmissionRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def compile_patterns(patterns: List[str], field: str) -> List[re.Pattern]:
+    try:
+        return [re.compile(pattern) for pattern in patterns]
+    except re.error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {field} pattern: {e}")
+
+
+@router.post("/crawl")
+async def crawl_site(request: CrawlRequest):
+    """
+    Crawl a site and stream one NDJSON line per page as pages finish
+    
+    - **seeds**: Start URLs
+    - **max_depth** / **max_pages**: Link hops from a seed and pages in total (capped by the server)
+    - **include** / **exclude**: Regexes matched against discovered URLs
+    - **same_host**: Only follow links to the seeds' hosts (default: true)
+    - **concurrency**, **per_host_concurrency**, **per_host_delay_ms**: Politeness limits
+    - **engine**: Scraper engine for every page (`http`, `browser` or `auto`)
+    - **include_html**: Add each page's HTML to its line
+    
+    Each `page` line has the URL, depth, status, title, text and `links_found`;
+    a `summary` line ends the stream.
+    """
+    if len(request.seeds) > settings.crawl_max_seeds:
+        raise HTTPException(status_code=400, detail=f"At most {settings.crawl_max_seeds} seeds are allowed")
+    include = compile_patterns(request.include, "include")
+    exclude = compile_patterns(request.exclude, "exclude")
+    
+    async def result_lines():
+        async for result in crawl_service.run(
+            request.seeds,
+            max_depth=request.max_depth,
+            max_pages=request.max_pages,
+            include=include,
+            exclude=exclude,
+            same_host=request.same_host,
+            concurrency=request.concurrency,
+            per_host_concurrency=request.per_host_concurrency,
+            per_host_delay_ms=request.per_host_delay_ms,
+            engine=request.engine,
+            include_html=request.include_html,
+        ):
+            yield dumps_bytes(result) + b"\n"
+    
+    return StreamingResponse(
+        result_lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/status", response_model=StatusResponse)
 async def get_scraper_status():
     """
     Get the status of Playwright scraper engine
     
-    Returns information about Playwright availability
+    Returns information about Playwright availability and browser pool usage
     """
     status = scraper_service.get_status()
     return StatusResponse(**status)
@@ -10,6 +10,7 @@ from typing import Optional
 import io
 
 from app.services.devops_agent import devops_agent
+from app.services.serialization import FastJSONResponse
 from app.config import get_settings
 
 settings = get_settings()
@@ -24,7 +25,7 @@ class UploadRequest(BaseModel):
 @router.get("/buckets")
 async def list_buckets():
     """List all S3 buckets"""
-    return devops_agent.list_s3_buckets()
+    return FastJSONResponse(devops_agent.list_s3_buckets())
 
 
 @router.get("/buckets/{bucket_name}/objects")
@@ -35,7 +36,7 @@ async def list_objects(bucket_name: str, prefix: str = ""):
     - **bucket_name**: Name of the S3 bucket
     - **prefix**: Optional prefix to filter objects
     """
-    return devops_agent.list_s3_objects(bucket_name, prefix)
+    return FastJSONResponse(devops_agent.list_s3_objects(bucket_name, prefix))
 
 
 @router.post("/upload")
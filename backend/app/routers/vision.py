@@ -3,24 +3,106 @@ OmniDev - Vision Router
 Endpoints for image analysis and vision features using OpenAI GPT-5 Mini Vision
 """
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import Any, Dict, List, Literal, Optional
+import zipfile
 
+from app.config import get_settings
+from app.services.admission import AdmissionRejected
+from app.services.batch_vision import batch_vision_service, iter_uploads, iter_zip
+from app.services.cancellation import run_cancellable
 from app.services.openai_service import openai_service
+from app.services.prompts import prompt_registry
+from app.services.serialization import dumps_bytes
+from app.services.streaming import JSONArrayItemParser, format_sse, sse_comment, stream_with_idle
+from app.services.vision_cache import vision_cache
 
 router = APIRouter()
+settings = get_settings()
 
 
 class AnalysisResponse(BaseModel):
     analysis: str
     status: str = "success"
+    cache_status: str = "miss"
+
+
+class DetectedObject(BaseModel):
+    object: str
+    confidence: Literal["high", "medium", "low"]
+    location: str
+
+
+class AnalyzeAllResult(BaseModel):
+    description: Optional[str] = None
+    text: Optional[str] = None
+    objects: Optional[List[DetectedObject]] = None
+
+
+class AnalyzeAllResponse(AnalyzeAllResult):
+    tasks: List[str]
+    status: str = "success"
+    error: Optional[str] = None
+    cache_status: str = "miss"
+
+
+# Task name -> (result field, JSON schema of the field)
+ANALYZE_ALL_TASKS: Dict[str, tuple] = {
+    "describe": ("description", {"type": "string"}),
+    "extract_text": ("text", {"type": "string"}),
+    "identify_objects": ("objects", {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "object": {"type": "string"},
+                "confidence": {"type": "string", "enum": ["high", "medium", "low"]},
+                "location": {"type": "string"},
+            },
+            "required": ["object", "confidence", "location"],
+            "additionalProperties": False,
+        },
+    }),
+}
+
+
+def parse_tasks(tasks: str) -> List[str]:
+    """Split a comma-separated task list, dropping duplicates and rejecting unknown names"""
+    names = list(dict.fromkeys(name.strip() for name in tasks.split(",") if name.strip()))
+    unknown = [name for name in names if name not in ANALYZE_ALL_TASKS]
+    if not names or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid tasks: {', '.join(unknown) or 'none given'}. Allowed: {', '.join(ANALYZE_ALL_TASKS)}",
+        )
+    return names
+
+
+def analyze_all_format(tasks: List[str]) -> Dict[str, Any]:
+    """Strict JSON schema containing only the requested tasks' fields"""
+    properties = dict(ANALYZE_ALL_TASKS[name] for name in tasks)
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "image_analysis",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": properties,
+                "required": list(properties),
+                "additionalProperties": False,
+            },
+        },
+    }
 
 
 @router.post("/analyze", response_model=AnalysisResponse)
 async def analyze_image(
+    request: Request,
     file: UploadFile = File(...),
-    prompt: Optional[str] = Form("Describe this image in detail. Include objects, colors, setting, and any text visible."),
+    prompt: Optional[str] = Form(prompt_registry.get("vision.analyze").static),
     api_key: Optional[str] = Form(None)
 ):
     """
@@ -37,59 +119,234 @@ async def analyze_image(
             detail=f"Invalid file type. Allowed: {', '.join(allowed_types)}"
         )
     
-    # Read file content
-    image_data = await file.read()
+    # Analyze with OpenAI; the spooled upload is decoded from disk, never read whole into memory
+    result, cache_status = await run_cancellable(request, vision_cache.analyze(file.file, prompt, api_key=api_key))
     
-    # Analyze with OpenAI
-    result = await openai_service.analyze_image(image_data, prompt, api_key=api_key)
-    
-    return AnalysisResponse(analysis=result)
+    return AnalysisResponse(analysis=result, cache_status=cache_status)
 
 
 @router.post("/describe")
-async def describe_image(file: UploadFile = File(...), api_key: Optional[str] = Form(None)):
+async def describe_image(request: Request, file: UploadFile = File(...), api_key: Optional[str] = Form(None)):
     """Get a detailed description of an image"""
-    image_data = await file.read()
-    result = await openai_service.analyze_image(
-        image_data, 
-        "Provide a comprehensive description of this image including:\n"
-        "1. Main subjects and objects\n"
-        "2. Colors and visual style\n"
-        "3. Setting and context\n"
-        "4. Any text visible\n"
-        "5. Overall mood or tone",
-        api_key=api_key
-    )
-    return {"description": result}
+    result, cache_status = await run_cancellable(request, vision_cache.analyze(
+        file.file,
+        prompt_registry.get("vision.describe").static,
+        api_key=api_key,
+        task="describe",
+    ))
+    return {"description": result, "cache_status": cache_status}
 
 
 @router.post("/extract-text")
-async def extract_text(file: UploadFile = File(...), api_key: Optional[str] = Form(None)):
+async def extract_text(request: Request, file: UploadFile = File(...), api_key: Optional[str] = Form(None)):
     """Extract text (OCR) from an image"""
-    image_data = await file.read()
-    result = await openai_service.analyze_image(
-        image_data,
-        "Extract and transcribe ALL text visible in this image. "
-        "Format the text clearly, preserving structure where possible. "
-        "If no text is visible, say 'No text detected'.",
-        api_key=api_key
-    )
-    return {"text": result}
+    result, cache_status = await run_cancellable(request, vision_cache.analyze(
+        file.file,
+        prompt_registry.get("vision.extract_text").static,
+        api_key=api_key,
+        task="ocr",
+    ))
+    return {"text": result, "cache_status": cache_status}
 
 
 @router.post("/identify-objects")
-async def identify_objects(file: UploadFile = File(...), api_key: Optional[str] = Form(None)):
+async def identify_objects(request: Request, file: UploadFile = File(...), api_key: Optional[str] = Form(None)):
     """Identify and list objects in an image"""
-    image_data = await file.read()
-    result = await openai_service.analyze_image(
-        image_data,
-        "Identify all objects in this image. Return as a JSON-formatted list with:\n"
-        "- object: name of the object\n"
-        "- confidence: high/medium/low\n"
-        "- location: general position (top-left, center, etc.)",
-        api_key=api_key
+    result, cache_status = await run_cancellable(request, vision_cache.analyze(
+        file.file,
+        prompt_registry.get("vision.identify_objects").static,
+        api_key=api_key,
+        task="objects",
+    ))
+    return {"objects": result, "cache_status": cache_status}
+
+
+@router.post("/analyze-all", response_model=AnalyzeAllResponse)
+async def analyze_all(
+    request: Request,
+    file: UploadFile = File(...),
+    tasks: str = Form("describe,extract_text,identify_objects"),
+    api_key: Optional[str] = Form(None),
+):
+    """
+    Run several analyses of one image in a single structured-output request
+    
+    - **file**: Image file (JPEG, PNG, WebP)
+    - **tasks**: Comma-separated subset of `describe`, `extract_text`, `identify_objects`
+    
+    Returns `description`, `text` and `objects` for the requested tasks.
+    """
+    names = parse_tasks(tasks)
+    result, cache_status = await run_cancellable(request, vision_cache.analyze(
+        file.file,
+        prompt_registry.get("vision.analyze_all").static,
+        api_key=api_key,
+        # Text extraction needs the larger OCR resolution
+        task="ocr" if "extract_text" in names else "describe",
+        response_format=analyze_all_format(names),
+    ))
+    if result.startswith(("❌", "⚠️")):
+        return AnalyzeAllResponse(tasks=names, status="error", error=result, cache_status=cache_status)
+    try:
+        parsed = AnalyzeAllResult.model_validate_json(result)
+    except ValidationError:
+        raise HTTPException(status_code=502, detail="Vision model returned malformed structured output")
+    return AnalyzeAllResponse(**parsed.model_dump(), tasks=names, cache_status=cache_status)
+
+
+def vision_sse(
+    request: Request,
+    file: UploadFile,
+    prompt: str,
+    api_key: Optional[str],
+    task: str,
+    objects: bool = False,
+) -> StreamingResponse:
+    """
+    Stream an analysis as Server-Sent Events
+    
+    Emits `chunk` events with `{"content": ...}` as the model writes. With `objects`,
+    each detected object is also sent as an `object` event (`{"index", "object"}`)
+    as soon as its JSON record is complete. A `done` event with the cache status ends
+    the stream, or an `error` event (`{"content"}`) if the analysis failed; chunks
+    sent before a failure are a partial answer.
+    """
+    status: Dict[str, Any] = {}
+    parser = JSONArrayItemParser() if objects else None
+    
+    async def event_stream():
+        upstream = vision_cache.analyze_stream(file.file, prompt, api_key=api_key, task=task, status=status)
+        count = 0
+        # Tell proxies the stream is alive while the image is being preprocessed
+        yield sse_comment("stream-open")
+        try:
+            async for chunk in stream_with_idle(upstream, settings.sse_heartbeat_seconds):
+                if chunk is None:
+                    if await request.is_disconnected():
+                        return
+                    yield sse_comment()
+                    continue
+                yield format_sse("chunk", {"content": chunk})
+                for item in parser.feed(chunk) if parser else ():
+                    yield format_sse("object", {"index": count, "object": item})
+                    count += 1
+        except AdmissionRejected as exc:
+            # Headers are already sent, so the 429 travels as an error event
+            yield format_sse("error", {"content": exc.reason, "retry_after": exc.retry_after})
+            return
+        if "error" in status:
+            yield format_sse("error", {"content": status["error"]})
+            return
+        
+        done: Dict[str, Any] = {"cache_status": status.get("cache_status", "bypass")}
+        if parser:
+            done["objects"] = count
+        yield format_sse("done", done)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@router.post("/analyze/sse")
+async def analyze_image_sse(
+    request: Request,
+    file: UploadFile = File(...),
+    prompt: Optional[str] = Form(prompt_registry.get("vision.analyze").static),
+    api_key: Optional[str] = Form(None)
+):
+    """Stream an image analysis as Server-Sent Events (same form fields as `/analyze`)"""
+    allowed_types = ["image/jpeg", "image/png", "image/webp", "image/gif"]
+    if file.content_type not in allowed_types:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Invalid file type. Allowed: {', '.join(allowed_types)}"
+        )
+    return vision_sse(request, file, prompt, api_key, task="analyze")
+
+
+@router.post("/describe/sse")
+async def describe_image_sse(request: Request, file: UploadFile = File(...), api_key: Optional[str] = Form(None)):
+    """Stream a detailed description of an image as Server-Sent Events"""
+    return vision_sse(request, file, prompt_registry.get("vision.describe").static, api_key, task="describe")
+
+
+@router.post("/extract-text/sse")
+async def extract_text_sse(request: Request, file: UploadFile = File(...), api_key: Optional[str] = Form(None)):
+    """Stream text extracted (OCR) from an image as Server-Sent Events"""
+    return vision_sse(request, file, prompt_registry.get("vision.extract_text").static, api_key, task="ocr")
+
+
+@router.post("/identify-objects/sse")
+async def identify_objects_sse(request: Request, file: UploadFile = File(...), api_key: Optional[str] = Form(None)):
+    """Stream identified objects as Server-Sent Events, one `object` event per completed record"""
+    return vision_sse(
+        request,
+        file,
+        prompt_registry.get("vision.identify_objects").static,
+        api_key,
+        task="objects",
+        objects=True,
+    )
+
+
+# Batch task name -> (prompt template, preprocessing task)
+BATCH_TASKS = {
+    "describe": ("vision.describe", "describe"),
+    "extract_text": ("vision.extract_text", "ocr"),
+    "identify_objects": ("vision.identify_objects", "objects"),
+}
+
+
+@router.post("/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    task: str = Form("extract_text"),
+    concurrency: Optional[int] = Form(None),
+    api_key: Optional[str] = Form(None),
+):
+    """
+    Run one task over many images and stream results as NDJSON in completion order
+    
+    - **files**: Several images, or a single `.zip` archive of images
+    - **task**: `describe`, `extract_text` (default) or `identify_objects`
+    - **concurrency**: Parallel vision calls (capped by the server)
+    
+    Each output line is a `result` with the image's `index`, `filename` and a `status`
+    of success, error or duplicate (byte-identical to the image at `duplicate_of`;
+    copies of a failed image are errors that also carry `duplicate_of`); a `summary`
+    line ends the stream.
+    """
+    if task not in BATCH_TASKS:
+        raise HTTPException(status_code=400, detail=f"Invalid task. Allowed: {', '.join(BATCH_TASKS)}")
+    template, preprocess_task = BATCH_TASKS[task]
+    
+    if len(files) == 1 and zipfile.is_zipfile(files[0].file):
+        images = iter_zip(files[0].file)
+    else:
+        images = iter_uploads(files)
+    
+    async def result_lines():
+        async for result in batch_vision_service.run(
+            images,
+            prompt_registry.get(template).static,
+            preprocess_task,
+            api_key=api_key,
+            concurrency=concurrency,
+        ):
+            yield dumps_bytes(result) + b"\n"
+    
+    return StreamingResponse(
+        result_lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    return {"objects": result}
 
 
 @router.get("/status")
@@ -99,5 +356,6 @@ async def vision_status():
         "service": "OpenAI Vision",
         "model": "gpt-5-mini",
         "status": "configured" if openai_service.client else "not configured",
-        "capabilities": ["image-analysis", "ocr", "object-detection", "custom-prompts"]
+        "capabilities": ["image-analysis", "ocr", "object-detection", "custom-prompts", "result-cache", "analyze-all", "batch", "streaming"],
+        "cache": vision_cache.get_stats(),
     }
@@ -0,0 +1,187 @@
+"""
+OmniDev - Admission Control
+Per-user fair queueing and adaptive concurrency for upstream AI calls
+"""
+
+import asyncio
+import heapq
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.config import get_settings
+from app.services.request_context import current_user_id
+
+settings = get_settings()
+
+
+class AdmissionRejected(Exception):
+    """Raised when the admission queue is full; surfaced to clients as HTTP 429"""
+
+    def __init__(self, retry_after: int, reason: str = "Upstream capacity exhausted, retry later"):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Gate for upstream calls with a weighted fair queue and an AIMD concurrency limit.
+
+    Waiting requests are ordered by start-time fair queueing: each user's next
+    request is tagged one 1/weight step after their previous one, so a user with
+    a burst of requests cannot starve others. The concurrency limit grows by
+    1/limit after every call that finishes within the latency target and is
+    multiplied down when calls are slow or the upstream answers 429.
+    """
+
+    def __init__(
+        self,
+        initial_limit: Optional[int] = None,
+        min_limit: Optional[int] = None,
+        max_limit: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        max_queue_per_user: Optional[int] = None,
+        latency_target_ms: Optional[int] = None,
+        queue_timeout_seconds: Optional[float] = None,
+    ):
+        self.min_limit = min_limit or settings.ai_concurrency_min
+        self.max_limit = max_limit or settings.ai_concurrency_max
+        self.limit = float(initial_limit or settings.ai_concurrency_initial)
+        self.max_queue = max_queue if max_queue is not None else settings.ai_queue_max
+        self.max_queue_per_user = max_queue_per_user if max_queue_per_user is not None else settings.ai_queue_max_per_user
+        self.latency_target = (latency_target_ms or settings.ai_latency_target_ms) / 1000
+        self.queue_timeout = queue_timeout_seconds or settings.ai_queue_timeout_seconds
+
+        self.in_flight = 0
+        self.queued = 0
+        self._heap: List[Tuple[float, int, str, asyncio.Future]] = []
+        self._queued_per_user: Dict[str, int] = {}
+        self._last_tag: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = 0
+        self._last_decrease = 0.0
+        self._avg_latency = self.latency_target
+        self.rejected = 0
+        self.throttled = 0
+        self.weights: Dict[str, float] = {}
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str] = None, observe_latency: bool = True) -> AsyncIterator[None]:
+        """
+        Hold one unit of upstream concurrency for the duration of the block
+
+        Args:
+            user_id: Queue owner; defaults to the authenticated user of the request
+            observe_latency: Feed the block's duration into the limit; disable for streams
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait exceeds the queue timeout
+        """
+        user_id = user_id or current_user_id.get() or "anonymous"
+        await self._acquire(user_id)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - start if observe_latency else None)
+
+    def observe_error(self, exc: BaseException) -> None:
+        """Back off when the upstream rejected a call with 429"""
+        if getattr(exc, "status_code", None) != 429:
+            return
+        self.throttled += 1
+        now = time.monotonic()
+        # One decrease per latency window, so a burst of 429s halves the limit once
+        if now - self._last_decrease >= self.latency_target:
+            self._last_decrease = now
+            self.limit = max(float(self.min_limit), self.limit / 2)
+
+    async def _acquire(self, user_id: str) -> None:
+        if not self.queued and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return
+
+        queued_for_user = self._queued_per_user.get(user_id, 0)
+        if self.queued >= self.max_queue or queued_for_user >= self.max_queue_per_user:
+            self.rejected += 1
+            raise AdmissionRejected(self._retry_after())
+
+        weight = self.weights.get(user_id, 1.0)
+        tag = max(self._virtual_time, self._last_tag.get(user_id, 0.0)) + 1.0 / weight
+        self._last_tag[user_id] = tag
+        self._seq += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (tag, self._seq, user_id, future))
+        self._queued_per_user[user_id] = queued_for_user + 1
+        self.queued += 1
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(user_id, future)
+            self.rejected += 1
+            raise AdmissionRejected(self._retry_after())
+        except asyncio.CancelledError:
+            self._abandon(user_id, future)
+            raise
+
+    def _abandon(self, user_id: str, future: asyncio.Future) -> None:
+        if future.done():
+            # The slot was granted while we were giving up; hand it back
+            self._release(None)
+            return
+        # Leave the entry in the heap; _dispatch skips cancelled futures
+        future.cancel()
+        self._dequeued(user_id)
+
+    def _dequeued(self, user_id: str) -> None:
+        self.queued -= 1
+        remaining = self._queued_per_user.get(user_id, 1) - 1
+        if remaining:
+            self._queued_per_user[user_id] = remaining
+        else:
+            self._queued_per_user.pop(user_id, None)
+
+    def _release(self, latency: Optional[float]) -> None:
+        self.in_flight -= 1
+        if latency is not None:
+            self._avg_latency = 0.8 * self._avg_latency + 0.2 * latency
+            if latency > self.latency_target:
+                self.limit = max(float(self.min_limit), self.limit * 0.9)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._heap and self.in_flight < int(self.limit):
+            tag, _, user_id, future = heapq.heappop(self._heap)
+            if future.cancelled():
+                continue
+            self._dequeued(user_id)
+            self._virtual_time = tag
+            self.in_flight += 1
+            future.set_result(None)
+        if not self._heap:
+            # Idle: forget old tags so returning users start fresh
+            self._last_tag.clear()
+
+    def _retry_after(self) -> int:
+        waves = (self.queued + 1) / max(1, int(self.limit))
+        return max(1, math.ceil(waves * self._avg_latency))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "queued_users": len(self._queued_per_user),
+            "rejected": self.rejected,
+            "throttled": self.throttled,
+            "avg_latency_ms": round(self._avg_latency * 1000, 1),
+        }
+
+
+# Singleton instance
+admission_controller = AdmissionController()
@@ -0,0 +1,160 @@
+"""
+OmniDev - Batch Chat Service
+Runs many independent chat prompts with bounded concurrency and a shared token budget
+"""
+
+import asyncio
+import contextlib
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional
+
+from app.config import get_settings
+from app.services.admission import AdmissionRejected
+from app.services.openai_service import openai_service
+from app.services.prompt_budget import prompt_assembler
+
+settings = get_settings()
+
+
+@dataclass
+class BatchPrompt:
+    """One prompt of a batch; `id` is the caller's tag echoed in its result"""
+    id: str
+    message: str
+    history: Optional[List[Dict]] = None
+
+
+@dataclass
+class BatchJob:
+    """Book-keeping for a running batch"""
+    batch_id: str
+    user_id: str
+    concurrency: int
+    token_budget: Optional[int]
+    tokens_used: int = 0
+    submitted: int = 0
+    counts: Dict[str, int] = field(default_factory=lambda: {"success": 0, "error": 0, "skipped": 0, "cancelled": 0})
+    cancelled: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "type": "summary",
+            "batch_id": self.batch_id,
+            "submitted": self.submitted,
+            **self.counts,
+            "tokens_used": self.tokens_used,
+            "token_budget": self.token_budget,
+        }
+
+
+class BatchChatService:
+    """Executes batches and keeps a registry so they can be cancelled by id"""
+
+    def __init__(self):
+        self._jobs: Dict[str, BatchJob] = {}
+
+    def create_job(self, user_id: str, concurrency: Optional[int] = None, token_budget: Optional[int] = None) -> BatchJob:
+        limit = settings.ai_batch_max_concurrency
+        concurrency = min(max(concurrency or settings.ai_batch_default_concurrency, 1), limit)
+        job = BatchJob(batch_id=uuid.uuid4().hex, user_id=user_id, concurrency=concurrency, token_budget=token_budget)
+        self._jobs[job.batch_id] = job
+        return job
+
+    def cancel(self, batch_id: str, user_id: str) -> bool:
+        job = self._jobs.get(batch_id)
+        if job is None or job.user_id != user_id:
+            return False
+        job.cancelled.set()
+        return True
+
+    async def run(self, job: BatchJob, prompts: AsyncIterator[BatchPrompt]) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Run prompts and yield one result dict per prompt in completion order
+
+        Prompts are pulled from `prompts` lazily as concurrency frees up, so a
+        malformed item only fails the remainder of the batch. A summary dict is
+        yielded last. Closing the generator cancels everything still running.
+        """
+        results: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(job.concurrency)
+        tasks: set = set()
+        feeding_done = object()
+
+        async def execute(prompt: BatchPrompt) -> Dict[str, Any]:
+            metadata: Dict[str, Any] = {}
+            try:
+                response = await openai_service.chat(prompt.message, prompt.history, metadata)
+            except AdmissionRejected as exc:
+                return self._result(job, prompt, "error", error=exc.reason, retry_after=exc.retry_after)
+            job.tokens_used += metadata.get("prompt_tokens", 0) + prompt_assembler.counter.count(response)
+            if response.startswith(("❌", "⚠️")):
+                return self._result(job, prompt, "error", error=response)
+            return self._result(job, prompt, "success", response=response, metadata=metadata)
+
+        def on_done(task: asyncio.Task, prompt: BatchPrompt) -> None:
+            # Runs even for tasks cancelled before they started, so permits never leak
+            tasks.discard(task)
+            semaphore.release()
+            if task.cancelled():
+                results.put_nowait(self._result(job, prompt, "cancelled"))
+            elif task.exception() is not None:
+                results.put_nowait(self._result(job, prompt, "error", error=str(task.exception())))
+            else:
+                results.put_nowait(task.result())
+
+        async def feed():
+            try:
+                async for prompt in prompts:
+                    job.submitted += 1
+                    await semaphore.acquire()
+                    if job.cancelled.is_set():
+                        semaphore.release()
+                        results.put_nowait(self._result(job, prompt, "cancelled"))
+                        continue
+                    if job.token_budget is not None and job.tokens_used >= job.token_budget:
+                        semaphore.release()
+                        results.put_nowait(self._result(job, prompt, "skipped", error="Batch token budget exhausted"))
+                        continue
+                    task = asyncio.create_task(execute(prompt))
+                    tasks.add(task)
+                    task.add_done_callback(lambda t, p=prompt: on_done(t, p))
+            except Exception as exc:
+                results.put_nowait({"type": "error", "error": f"Invalid batch input: {exc}"})
+            finally:
+                while tasks:
+                    await asyncio.wait(set(tasks))
+                results.put_nowait(feeding_done)
+
+        async def watch_cancel():
+            await job.cancelled.wait()
+            for task in list(tasks):
+                task.cancel()
+
+        feeder = asyncio.create_task(feed())
+        watcher = asyncio.create_task(watch_cancel())
+        try:
+            while True:
+                item = await results.get()
+                if item is feeding_done:
+                    break
+                yield item
+            yield job.summary()
+        finally:
+            job.cancelled.set()
+            for task in [feeder, watcher, *tasks]:
+                task.cancel()
+            for task in [feeder, watcher]:
+                with contextlib.suppress(BaseException):
+                    await task
+            self._jobs.pop(job.batch_id, None)
+
+    def _result(self, job: BatchJob, prompt: BatchPrompt, status: str, **fields) -> Dict[str, Any]:
+        job.counts[status] += 1
+        result = {"type": "result", "id": prompt.id, "status": status}
+        result.update({key: value for key, value in fields.items() if value is not None})
+        return result
+
+
+# Singleton instance
+batch_chat_service = BatchChatService()
@@ -0,0 +1,189 @@
+"""
+OmniDev - Batch Vision Service
+Runs one vision task over many uploaded images or the images inside a ZIP archive
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import zipfile
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, BinaryIO, Dict, Iterator, Optional
+
+from app.config import get_settings
+from app.services.vision_cache import vision_cache
+
+settings = get_settings()
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff")
+
+
+@dataclass
+class BatchImage:
+    """One image of a batch; `read` loads its bytes and is called lazily, off the event loop"""
+    index: int
+    filename: str
+    read: Any
+
+
+class BatchRejected(ValueError):
+    """Raised when an archive or file list cannot be processed at all"""
+
+
+def iter_uploads(files) -> Iterator[BatchImage]:
+    """Images from a list of UploadFiles"""
+    for index, upload in enumerate(files):
+        def read(source: BinaryIO = upload.file) -> bytes:
+            source.seek(0)
+            return source.read()
+        yield BatchImage(index, upload.filename or f"image-{index}", read)
+
+
+def iter_zip(source: BinaryIO) -> Iterator[BatchImage]:
+    """
+    Images from a ZIP archive, one member at a time
+
+    Only the central directory is read up front; each member is decompressed
+    when its turn comes. Directories, non-image names and members larger than
+    the per-image upload limit are skipped.
+
+    Raises:
+        BatchRejected: If the source is not a ZIP archive
+    """
+    try:
+        archive = zipfile.ZipFile(source)
+    except zipfile.BadZipFile as exc:
+        raise BatchRejected(f"Invalid ZIP archive: {exc}") from exc
+    index = 0
+    for info in archive.infolist():
+        if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        if info.file_size > settings.vision_max_upload_bytes:
+            continue
+
+        def read(info: zipfile.ZipInfo = info) -> bytes:
+            with archive.open(info) as member:
+                # file_size comes from the archive; never trust it for the read itself
+                data = member.read(settings.vision_max_upload_bytes + 1)
+            if len(data) > settings.vision_max_upload_bytes:
+                raise BatchRejected("Image exceeds the upload size limit")
+            return data
+
+        yield BatchImage(index, info.filename, read)
+        index += 1
+
+
+class BatchVisionService:
+    """Preprocesses on the shared worker pool and calls the model with bounded concurrency"""
+
+    async def run(
+        self,
+        images: Iterator[BatchImage],
+        prompt: str,
+        task: str,
+        api_key: Optional[str] = None,
+        concurrency: Optional[int] = None,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Analyze every image and yield one result dict per image in completion order
+
+        Byte-identical images are analyzed once; the copies are reported with
+        `duplicate_of` pointing at the first, as `duplicate` with its result or,
+        if the first failed, as `error` with its error. A summary dict is yielded last.
+        Closing the generator cancels everything still running.
+        """
+        limit = min(max(concurrency or settings.vision_batch_default_concurrency, 1), settings.vision_batch_max_concurrency)
+        semaphore = asyncio.Semaphore(limit)
+        results: asyncio.Queue = asyncio.Queue()
+        seen: Dict[bytes, BatchImage] = {}
+        pending: Dict[bytes, asyncio.Future] = {}
+        tasks: set = set()
+        counts = {"images": 0, "success": 0, "error": 0, "duplicate": 0}
+        feeding_done = object()
+        loop = asyncio.get_running_loop()
+
+        def result(image: BatchImage, status: str, **fields) -> Dict[str, Any]:
+            counts[status] += 1
+            line = {"type": "result", "index": image.index, "filename": image.filename, "status": status}
+            line.update({key: value for key, value in fields.items() if value is not None})
+            return line
+
+        async def analyze(image: BatchImage, data: bytes, future: asyncio.Future) -> None:
+            try:
+                text, cache_status = await vision_cache.analyze(data, prompt, api_key=api_key, task=task)
+            except Exception as exc:
+                text, cache_status = f"❌ {exc}", "bypass"
+            future.set_result(text)
+            del data
+            if text.startswith(("❌", "⚠️")):
+                results.put_nowait(result(image, "error", error=text))
+            else:
+                results.put_nowait(result(image, "success", result=text, cache_status=cache_status))
+
+        async def report_duplicate(image: BatchImage, original: BatchImage, future: asyncio.Future) -> None:
+            text = await asyncio.shield(future)
+            # A copy of a failed image failed too; don't pass the error off as a result
+            if text.startswith(("❌", "⚠️")):
+                results.put_nowait(result(image, "error", duplicate_of=original.index, error=text))
+            else:
+                results.put_nowait(result(image, "duplicate", duplicate_of=original.index, result=text))
+
+        def on_done(task: asyncio.Task, permit: bool) -> None:
+            tasks.discard(task)
+            if permit:
+                semaphore.release()
+
+        def start(coro, permit: bool = True) -> None:
+            task = asyncio.create_task(coro)
+            tasks.add(task)
+            task.add_done_callback(lambda t: on_done(t, permit))
+
+        async def feed() -> None:
+            try:
+                while True:
+                    # Hold a permit before reading, so at most `limit` images are in memory
+                    await semaphore.acquire()
+                    image = await loop.run_in_executor(None, next, images, None)
+                    if image is None:
+                        semaphore.release()
+                        break
+                    counts["images"] += 1
+                    try:
+                        data = await loop.run_in_executor(None, image.read)
+                    except Exception as exc:
+                        semaphore.release()
+                        results.put_nowait(result(image, "error", error=f"❌ {exc}"))
+                        continue
+                    digest = hashlib.blake2b(data, digest_size=16).digest()
+                    if digest in seen:
+                        # Copies only wait for the original's result; they need no permit
+                        semaphore.release()
+                        start(report_duplicate(image, seen[digest], pending[digest]), permit=False)
+                        continue
+                    seen[digest] = image
+                    pending[digest] = loop.create_future()
+                    start(analyze(image, data, pending[digest]))
+            except Exception as exc:
+                results.put_nowait({"type": "error", "error": f"Invalid batch input: {exc}"})
+            finally:
+                while tasks:
+                    await asyncio.wait(set(tasks))
+                results.put_nowait(feeding_done)
+
+        feeder = asyncio.create_task(feed())
+        try:
+            while True:
+                item = await results.get()
+                if item is feeding_done:
+                    break
+                yield item
+            yield {"type": "summary", **counts}
+        finally:
+            for task in [feeder, *tasks]:
+                task.cancel()
+            with contextlib.suppress(BaseException):
+                await feeder
+
+
+# Singleton instance
+batch_vision_service = BatchVisionService()
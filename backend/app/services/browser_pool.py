@@ -0,0 +1,221 @@
+"""
+OmniDev - Browser Context Pool
+Pre-warmed Playwright contexts and pages leased to one scrape at a time
+"""
+
+import asyncio
+import contextlib
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+
+from app.config import get_settings
+from app.services.admission import AdmissionRejected
+from app.services.request_context import remaining_time
+
+settings = get_settings()
+
+USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+)
+
+STEALTH_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+    Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4, 5]});
+    Object.defineProperty(navigator, 'languages', {get: () => ['en-US', 'en']});
+    window.chrome = {runtime: {}};
+"""
+
+
+class PooledPage:
+    """A browser context with its one page, reused across scrapes"""
+
+    def __init__(self, context: Any, page: Any):
+        self.context = context
+        self.page = page
+        self.uses = 0
+        # Origins of documents loaded since the last reset (pages, popups, frames, redirects)
+        self.origins: Set[str] = set()
+        context.on("request", self._track)
+
+    def _track(self, request: Any) -> None:
+        if request.resource_type == "document":
+            parts = urlsplit(request.url)
+            if parts.scheme in ("http", "https"):
+                self.origins.add(f"{parts.scheme}://{parts.netloc}")
+
+    async def reset(self) -> None:
+        """
+        Drop per-site state so the next lease starts clean
+
+        A fresh tab replaces the used one (discarding sessionStorage and page
+        routes), then cookies, permissions and every storage type (localStorage,
+        IndexedDB, Cache Storage, service workers) of the visited origins are
+        cleared through CDP. Any failure propagates, so the context is recycled
+        instead of being reused with leftover state.
+        """
+        page = await self.context.new_page()
+        for old in list(self.context.pages):
+            if old is not page:
+                await old.close()
+        self.page = page
+        await self.context.unroute_all(behavior="ignoreErrors")
+        origins, self.origins = self.origins, set()
+        if origins:
+            cdp = await self.context.new_cdp_session(page)
+            try:
+                for origin in origins:
+                    await cdp.send("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+            finally:
+                await cdp.detach()
+        await self.context.clear_cookies()
+        await self.context.clear_permissions()
+
+    async def close(self) -> None:
+        with contextlib.suppress(Exception):
+            await self.context.close()
+
+
+class BrowserPool:
+    """
+    Fixed-size pool of stealth browser contexts, each with a warm page.
+
+    A semaphore caps concurrent scrapes at the pool size; callers that cannot get
+    a context within the queue timeout are rejected with AdmissionRejected (429).
+    Contexts are reset between leases and replaced after `max_uses` leases, or
+    right away when a scrape fails or is cancelled mid-navigation.
+    """
+
+    def __init__(
+        self,
+        browser_factory: Callable[[], Awaitable[Any]],
+        size: Optional[int] = None,
+        queue_timeout_seconds: Optional[float] = None,
+        max_uses: Optional[int] = None,
+    ):
+        self._browser_factory = browser_factory
+        self.size = size or settings.scraper_pool_size
+        self.queue_timeout = queue_timeout_seconds or settings.scraper_pool_queue_timeout_seconds
+        self.max_uses = max_uses or settings.scraper_pool_max_uses
+        self._semaphore = asyncio.Semaphore(self.size)
+        self._idle: List[PooledPage] = []
+        self._warm_lock = asyncio.Lock()
+        self._warmed = False
+        self._waits: Deque[float] = deque(maxlen=200)
+        self._avg_hold = 1.0
+        self.in_use = 0
+        self.waiting = 0
+        self.leases = 0
+        self.rejected = 0
+        self.created = 0
+        self.recycled = 0
+
+    async def _create(self) -> PooledPage:
+        browser = await self._browser_factory()
+        context = await browser.new_context(
+            viewport={"width": 1920, "height": 1080},
+            user_agent=USER_AGENT,
+            java_script_enabled=True,
+        )
+        try:
+            await context.add_init_script(STEALTH_SCRIPT)
+            page = await context.new_page()
+        except BaseException:
+            with contextlib.suppress(Exception):
+                await context.close()
+            raise
+        self.created += 1
+        return PooledPage(context, page)
+
+    async def warm(self) -> None:
+        """Create every idle context up front so no lease pays for context setup"""
+        async with self._warm_lock:
+            if self._warmed:
+                return
+            missing = self.size - len(self._idle) - self.in_use
+            created = await asyncio.gather(*(self._create() for _ in range(missing)), return_exceptions=True)
+            self._idle.extend(slot for slot in created if isinstance(slot, PooledPage))
+            for error in created:
+                if isinstance(error, BaseException):
+                    raise error
+            self._warmed = True
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[Any]:
+        """
+        Hold one warm page for the duration of the block
+
+        Raises:
+            AdmissionRejected: If no context frees up within the queue timeout
+        """
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=remaining_time(self.queue_timeout))
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise AdmissionRejected(self._retry_after(), reason="All scraper browser contexts are busy, retry later")
+        finally:
+            self.waiting -= 1
+        self._waits.append(time.monotonic() - start)
+
+        held_from = time.monotonic()
+        self.in_use += 1
+        self.leases += 1
+        slot: Optional[PooledPage] = None
+        reusable = False
+        try:
+            if not self._warmed:
+                await self.warm()
+            slot = self._idle.pop() if self._idle else await self._create()
+            slot.uses += 1
+            yield slot.page
+            reusable = slot.uses < self.max_uses
+        finally:
+            try:
+                if slot is not None:
+                    await self._give_back(slot, reusable)
+            finally:
+                self.in_use -= 1
+                self._avg_hold = 0.8 * self._avg_hold + 0.2 * (time.monotonic() - held_from)
+                self._semaphore.release()
+
+    async def _give_back(self, slot: PooledPage, reusable: bool) -> None:
+        if reusable:
+            try:
+                await slot.reset()
+                self._idle.append(slot)
+                return
+            except Exception:
+                pass
+        # Failed, cancelled or worn-out contexts are replaced by a fresh one on demand
+        self.recycled += 1
+        await slot.close()
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil((self.waiting + 1) / self.size * self._avg_hold))
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        self._warmed = False
+        await asyncio.gather(*(slot.close() for slot in idle))
+
+    def get_stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "utilization": round(self.in_use / self.size, 2),
+            "leases": self.leases,
+            "rejected": self.rejected,
+            "contexts_created": self.created,
+            "contexts_recycled": self.recycled,
+            "avg_wait_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "p95_wait_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+        }
@@ -0,0 +1,108 @@
+"""
+OmniDev - Request Cancellation
+Cancels long-running work when the request deadline passes or the client disconnects
+"""
+
+import asyncio
+import contextlib
+import time
+from typing import Awaitable, Dict, Optional, TypeVar
+
+from fastapi import Request
+
+from app.config import get_settings
+from app.services.metrics import record_cancellation
+from app.services.request_context import request_deadline
+
+settings = get_settings()
+
+T = TypeVar("T")
+
+DEADLINE_HEADER = "X-Request-Timeout"
+
+# Typical duration per route, used to estimate the work a cancellation saved
+_avg_duration: Dict[str, float] = {}
+
+
+class RequestCancelled(Exception):
+    """Raised when work is abandoned; `reason` is "deadline" or "disconnect\""""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Request cancelled ({reason})")
+        self.reason = reason
+
+
+def default_timeout_for(path: str) -> Optional[float]:
+    """Per-route default deadline in seconds; batch and crawl jobs run as long as their items need"""
+    if path.endswith(("/batch", "/crawl")) or "/batch/" in path:
+        return None
+    if path.startswith("/api/ai/"):
+        return settings.ai_request_timeout_seconds
+    if path.startswith("/api/vision/"):
+        return settings.vision_request_timeout_seconds
+    if path.startswith("/api/scraper/"):
+        return settings.scraper_request_timeout_seconds
+    return None
+
+
+def set_request_deadline(request: Request) -> None:
+    """
+    Start the deadline clock for a request
+
+    Clients may shorten the route default with an `X-Request-Timeout` header
+    (seconds); they cannot extend it.
+    """
+    timeout = default_timeout_for(request.url.path)
+    header = request.headers.get(DEADLINE_HEADER)
+    if header:
+        try:
+            requested = float(header)
+        except ValueError:
+            requested = None
+        if requested is not None and requested > 0:
+            timeout = min(timeout, requested) if timeout else requested
+    if timeout:
+        request_deadline.set(time.monotonic() + timeout)
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    # After the body has been read the only message left is http.disconnect
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_cancellable(request: Request, work: Awaitable[T]) -> T:
+    """
+    Await `work`, cancelling it cooperatively on deadline or client disconnect
+
+    Raises:
+        RequestCancelled: If the work was abandoned
+    """
+    route = request.url.path
+    started = time.monotonic()
+    deadline = request_deadline.get()
+    timeout = max(0.0, deadline - started) if deadline is not None else None
+
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.create_task(_wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({task, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+
+    if task in done:
+        elapsed = time.monotonic() - started
+        previous = _avg_duration.get(route, elapsed)
+        _avg_duration[route] = 0.8 * previous + 0.2 * elapsed
+        return task.result()
+
+    task.cancel()
+    with contextlib.suppress(BaseException):
+        await task
+    elapsed = time.monotonic() - started
+    reason = "disconnect" if watcher in done else "deadline"
+    saved = max(0.0, _avg_duration.get(route, elapsed) - elapsed)
+    record_cancellation(route, reason, saved)
+    raise RequestCancelled(reason)
@@ -0,0 +1,240 @@
+"""
+OmniDev - Crawl Service
+Multi-page crawls with a prioritized frontier, URL dedupe and per-host politeness
+"""
+
+import asyncio
+import contextlib
+import heapq
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Dict, List, Optional, Pattern, Sequence, Set, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from app.config import get_settings
+from app.services.admission import AdmissionRejected
+from app.services.scraper_service import ScrapeResult, scraper_service
+from app.services.urls import canonicalize_url
+
+settings = get_settings()
+
+# Links to these are files, not pages worth rendering
+SKIPPED_EXTENSIONS = (
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".svg", ".ico", ".pdf", ".zip", ".gz", ".tar",
+    ".mp3", ".mp4", ".avi", ".mov", ".webm", ".woff", ".woff2", ".ttf", ".css", ".js", ".xml", ".json",
+)
+
+
+def extract_links(html: str, page_url: str) -> List[str]:
+    """Canonical URLs of the followable links in a page (honours <base href> and rel=nofollow)"""
+    soup = BeautifulSoup(html, "lxml", parse_only=SoupStrainer(["a", "base"]))
+    base_tag = soup.find("base", href=True)
+    base = urljoin(page_url, base_tag["href"]) if base_tag else page_url
+    links = []
+    for anchor in soup.find_all("a", href=True):
+        if "nofollow" in (anchor.get("rel") or []):
+            continue
+        url = canonicalize_url(anchor["href"], base)
+        if url and not urlsplit(url).path.lower().endswith(SKIPPED_EXTENSIONS):
+            links.append(url)
+    return links
+
+
+@dataclass
+class HostState:
+    """Politeness bookkeeping and the queued URLs of one host"""
+    active: int = 0
+    next_at: float = 0.0
+    queue: List[Tuple[int, int, str]] = field(default_factory=list)  # Heap of (depth, seq, url)
+
+
+class CrawlService:
+    """Schedules scrapes from a frontier; every fetch goes through the shared scraper (and its browser pool)"""
+
+    async def run(
+        self,
+        seeds: Sequence[str],
+        max_depth: int = 2,
+        max_pages: int = 50,
+        include: Sequence[Pattern] = (),
+        exclude: Sequence[Pattern] = (),
+        same_host: bool = True,
+        concurrency: Optional[int] = None,
+        per_host_concurrency: Optional[int] = None,
+        per_host_delay_ms: Optional[int] = None,
+        engine: Optional[str] = None,
+        include_html: bool = False,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Crawl from `seeds` and yield one result dict per page in completion order
+
+        The frontier is ordered by depth, so shallow pages are fetched first.
+        Links are canonicalized and each URL is fetched at most once. Hosts get
+        at most `per_host_concurrency` pages in flight and `per_host_delay_ms`
+        between request starts, on top of any robots.txt Crawl-delay. A summary
+        dict is yielded last; closing the generator cancels the crawl.
+
+        Args:
+            seeds: Start URLs (depth 0)
+            max_depth: Link hops to follow from a seed
+            max_pages: Pages to fetch in total
+            include: Regexes a discovered URL must match one of (empty allows all)
+            exclude: Regexes that rule a discovered URL out
+            same_host: Only follow links to the seeds' hosts
+            concurrency: Pages in flight across all hosts
+            per_host_concurrency: Pages in flight per host
+            per_host_delay_ms: Minimum gap between request starts to one host
+            engine: Scraper engine for every page ("http", "browser" or "auto")
+            include_html: Add each page's HTML to its result
+        """
+        limit = min(max(concurrency or settings.crawl_default_concurrency, 1), settings.crawl_max_concurrency)
+        per_host = max(1, per_host_concurrency or settings.crawl_per_host_concurrency)
+        delay = (per_host_delay_ms if per_host_delay_ms is not None else settings.crawl_per_host_delay_ms) / 1000
+        max_depth = min(max(max_depth, 0), settings.crawl_max_depth)
+        max_pages = min(max(max_pages, 1), settings.crawl_max_pages)
+
+        # Each host keeps its own queue; `ready` holds the queue heads of hosts
+        # with a free slot, so picking the next URL never scans busy hosts.
+        # Entries go stale when a host fills up or its head changes and are
+        # skipped when popped.
+        ready: List[Tuple[int, int, str]] = []
+        seen: Set[str] = set()
+        hosts: Dict[str, HostState] = {}
+        tasks: Dict[asyncio.Task, Tuple[str, int]] = {}
+        counts = {"pages": 0, "success": 0, "error": 0, "filtered": 0}
+        queued = 0
+        seq = 0
+
+        def offer(host: str) -> None:
+            state = hosts[host]
+            if state.queue and state.active < per_host:
+                depth, order, _ = state.queue[0]
+                heapq.heappush(ready, (depth, order, host))
+
+        def enqueue(depth: int, url: str) -> None:
+            nonlocal queued, seq
+            host = urlsplit(url).netloc
+            state = hosts.setdefault(host, HostState())
+            heapq.heappush(state.queue, (depth, seq, url))
+            seq += 1
+            queued += 1
+            if state.queue[0][2] == url:
+                offer(host)
+
+        allowed_hosts = set()
+        for seed in seeds:
+            url = canonicalize_url(seed)
+            if url and url not in seen:
+                seen.add(url)
+                allowed_hosts.add(urlsplit(url).netloc)
+                enqueue(0, url)
+
+        def wanted(url: str) -> bool:
+            if same_host and urlsplit(url).netloc not in allowed_hosts:
+                return False
+            if include and not any(pattern.search(url) for pattern in include):
+                return False
+            return not any(pattern.search(url) for pattern in exclude)
+
+        def next_ready() -> Optional[Tuple[int, str]]:
+            """Shallowest queued URL whose host has a free slot"""
+            nonlocal queued
+            while ready:
+                _, order, host = heapq.heappop(ready)
+                state = hosts[host]
+                if not state.queue or state.queue[0][1] != order or state.active >= per_host:
+                    continue
+                depth, _, url = heapq.heappop(state.queue)
+                queued -= 1
+                return depth, url
+            return None
+
+        async def fetch(url: str) -> ScrapeResult:
+            host = hosts[urlsplit(url).netloc]
+            now = time.monotonic()
+            start_at = max(now, host.next_at)
+            host.next_at = start_at + delay
+            if start_at > now:
+                await asyncio.sleep(start_at - now)
+            options = {"engine": engine} if engine else {}
+            for attempt in range(3):
+                try:
+                    return await scraper_service.scrape(url=url, **options)
+                except AdmissionRejected as exc:
+                    # The shared browser pool is busy with other requests; back off and retry
+                    if attempt == 2:
+                        return ScrapeResult(success=False, url=url, title="", html="", text="", error=exc.reason)
+                    await asyncio.sleep(exc.retry_after)
+
+        try:
+            while queued or tasks:
+                while len(tasks) < limit and counts["pages"] < max_pages:
+                    picked = next_ready()
+                    if picked is None:
+                        break
+                    depth, url = picked
+                    host = urlsplit(url).netloc
+                    counts["pages"] += 1
+                    hosts[host].active += 1
+                    offer(host)
+                    tasks[asyncio.create_task(fetch(url))] = (url, depth)
+                if not tasks:
+                    break
+
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    url, depth = tasks.pop(task)
+                    host = urlsplit(url).netloc
+                    hosts[host].active -= 1
+                    offer(host)
+                    try:
+                        result = task.result()
+                    except Exception as exc:
+                        result = ScrapeResult(success=False, url=url, title="", html="", text="", error=str(exc))
+
+                    links: List[str] = []
+                    if result.success and depth < max_depth and result.html:
+                        # Relative links resolve against where redirects landed (/docs -> /docs/)
+                        base = canonicalize_url(result.final_url) if result.final_url else None
+                        if base:
+                            seen.add(base)
+                        # Link parsing is CPU-bound; keep it off the event loop
+                        links = await asyncio.to_thread(extract_links, result.html, base or url)
+                        for link in links:
+                            if link in seen or len(seen) >= settings.crawl_max_frontier:
+                                continue
+                            seen.add(link)
+                            if not wanted(link):
+                                counts["filtered"] += 1
+                                continue
+                            enqueue(depth + 1, link)
+
+                    counts["success" if result.success else "error"] += 1
+                    line = {
+                        "type": "page",
+                        "url": url,
+                        "depth": depth,
+                        "status": "success" if result.success else "error",
+                        "title": result.title,
+                        "text": result.text,
+                        "engine": result.engine,
+                        "load_time_ms": result.load_time_ms,
+                        "links_found": len(links),
+                    }
+                    if result.error:
+                        line["error"] = result.error
+                    if include_html:
+                        line["html"] = result.html
+                    yield line
+            yield {"type": "summary", **counts, "unvisited": queued}
+        finally:
+            for task in tasks:
+                task.cancel()
+            with contextlib.suppress(BaseException):
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Singleton instance
+crawl_service = CrawlService()
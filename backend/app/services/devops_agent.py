@@ -10,6 +10,9 @@ from typing import Dict, Any, List, Optional
 from openai import AsyncOpenAI
 
 from app.config import get_settings
+from app.services.admission import admission_controller
+from app.services.prompts import prompt_registry, record_usage
+from app.services.upstream import upstream_policy
 
 settings = get_settings()
 
@@ -26,35 +29,6 @@ class DevOpsAgent:
     - Infrastructure troubleshooting
     """
     
-    SYSTEM_PROMPT = """You are OmniDev DevOps Agent, an AI-powered cloud infrastructure assistant.
-
-Your capabilities:
-1. **EC2 Management**: List, launch, stop, start, terminate instances
-2. **S3 Operations**: List buckets, manage objects
-3. **Cost Analysis**: Estimate costs, find savings
-4. **Security**: Check for vulnerabilities, audit permissions
-5. **Troubleshooting**: Diagnose issues, suggest fixes
-
-When the user asks you to perform an action:
-1. Understand their intent
-2. Use the available tools to execute the action
-3. Provide clear, formatted results
-
-Available AWS operations you can request:
-- list_ec2_instances: Get all EC2 instances
-- describe_ec2_instance(instance_id): Get details of specific instance
-- launch_ec2_instance(ami_id, instance_type): Launch new instance
-- stop_ec2_instance(instance_id): Stop an instance
-- start_ec2_instance(instance_id): Start a stopped instance
-- terminate_ec2_instance(instance_id): Terminate an instance
-- list_s3_buckets: Get all S3 buckets
-- list_s3_objects(bucket_name): List objects in a bucket
-- get_cost_estimate: Get current month's estimated costs
-
-Format your responses nicely with markdown. Use tables, bullet points, and code blocks when appropriate.
-If credentials aren't configured, explain how to set them up.
-Always confirm destructive actions before executing."""
-    
     def __init__(self, aws_access_key: str = None, aws_secret_key: str = None, aws_region: str = None):
         self.client = None
         self.model = "gpt-5-mini"
@@ -69,7 +43,8 @@ Always confirm destructive actions before executing."""
         """Configure AI model and AWS clients"""
         # Configure OpenAI
         if settings.openai_api_key:
-            self.client = AsyncOpenAI(api_key=settings.openai_api_key)
+            # Retries are handled by upstream_policy
+            self.client = AsyncOpenAI(api_key=settings.openai_api_key, max_retries=0)
         
         # Configure AWS clients - prefer user-provided credentials
         aws_key = self._user_aws_key or settings.aws_access_key_id
@@ -246,39 +221,32 @@ Always confirm destructive actions before executing."""
         # Build context with current AWS state
         context = self._build_context()
         
-        # Create the prompt
-        user_prompt = f"""User request: {user_message}
-
-Current AWS Context:
-{json.dumps(context, indent=2)}
-
-Based on the user's request and the current context:
-1. Explain what you understand they want
-2. List any actions you would take
-3. Provide the results or explain what steps are needed
-
-If AWS credentials aren't configured, explain how to set them up."""
+        # Static instructions live in the system prompt; the live context and request go last
+        template = prompt_registry.get("devops")
+        user_prompt = template.render(context=json.dumps(context, indent=2), request=user_message)
         
-        try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self.SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_completion_tokens=4096,
-            )
+        async with admission_controller.slot():
+            try:
+                response = await upstream_policy.call(lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": template.static},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    max_completion_tokens=4096,
+                ), latency_key=(self.model, "full"))
+                record_usage("devops", response.usage)
             
-            return {
-                "response": response.choices[0].message.content,
-                "context": context,
-                "actions": self._extract_suggested_actions(user_message)
-            }
-        except Exception as e:
-            return {
-                "response": f"❌ Error processing command: {str(e)}",
-                "actions": []
-            }
+                return {
+                    "response": response.choices[0].message.content,
+                    "context": context,
+                    "actions": self._extract_suggested_actions(user_message)
+                }
+            except Exception as e:
+                return {
+                    "response": f"❌ Error processing command: {str(e)}",
+                    "actions": []
+                }
     
     def _build_context(self) -> Dict[str, Any]:
         """Build current AWS context for the AI"""
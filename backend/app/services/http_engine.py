@@ -0,0 +1,216 @@
+"""
+OmniDev - HTTP Scrape Engine
+Plain pooled HTTP fetches for static pages, with heuristics for when a real browser is needed
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from bs4 import BeautifulSoup
+
+from app.config import get_settings
+from app.services.browser_pool import USER_AGENT
+from app.services.request_context import remaining_time
+
+settings = get_settings()
+
+ENGINES = ("http", "browser", "auto")
+
+# Statuses that usually mean a bot wall or rate limit a browser may get past
+ESCALATE_STATUS_CODES = {403, 429, 503}
+
+# Mount points of client-rendered apps (React, Next.js, Vue, Nuxt, Gatsby)
+APP_SHELL_IDS = ("root", "app", "__next", "__nuxt", "___gatsby")
+
+
+def browser_needed(
+    soup: BeautifulSoup,
+    text: str,
+    extract_selector: Optional[str],
+    selected: Any,
+) -> Optional[str]:
+    """Why a fetched page looks JS-rendered, or None when the HTTP result is usable"""
+    if extract_selector and selected is None:
+        return "extract_selector not found"
+    for shell_id in APP_SHELL_IDS:
+        mount = soup.find(id=shell_id)
+        if mount is not None and not mount.get_text(strip=True):
+            return "javascript app shell"
+    if len(text) < settings.scraper_http_min_text_chars:
+        return "noscript shell" if soup.find("noscript") is not None else "empty body"
+    return None
+
+
+def failed(url: str, error: str) -> Dict[str, Any]:
+    return {"success": False, "url": url, "title": "", "html": "", "text": "", "error": error, "engine": "http"}
+
+
+class EngineMemory:
+    """Per-domain record of which engine worked last, bounded LRU with TTL"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def get(self, domain: str) -> Optional[str]:
+        entry = self._entries.get(domain)
+        if entry is None:
+            return None
+        engine, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[domain]
+            return None
+        self._entries.move_to_end(domain)
+        return engine
+
+    def remember(self, domain: str, engine: str) -> None:
+        self._entries[domain] = (engine, time.monotonic() + self.ttl)
+        self._entries.move_to_end(domain)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for engine, _ in self._entries.values():
+            counts[engine] = counts.get(engine, 0) + 1
+        return counts
+
+
+class HttpEngine:
+    """
+    Scrapes with a pooled async HTTP client instead of a browser page.
+
+    `fetch` returns the result together with the reason, if any, that the page
+    should be rendered by Playwright instead (JS app shell, empty body, missing
+    `extract_selector`, bot-wall status). `auto` scrapes use that reason to
+    escalate, and the engine that worked is remembered per domain.
+    """
+
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
+        self._client = client
+        self.memory = EngineMemory(
+            settings.scraper_engine_memory_max_entries,
+            settings.scraper_engine_memory_ttl_seconds,
+        )
+        self.fetches = 0
+        self.escalations = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=settings.scraper_http_max_connections,
+                    max_keepalive_connections=settings.scraper_http_max_connections,
+                ),
+                headers={
+                    "User-Agent": USER_AGENT,
+                    "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.8",
+                    "Accept-Language": "en-US,en;q=0.9",
+                },
+            )
+        return self._client
+
+    async def fetch(self, url: str, extract_selector: Optional[str] = None) -> Tuple[Dict[str, Any], Optional[str]]:
+        """
+        Fetch and extract a page over plain HTTP
+
+        Args:
+            url: URL to fetch
+            extract_selector: CSS selector to extract specific content
+
+        Returns:
+            (ScrapeResult fields, reason to use the browser instead or None)
+        """
+        start_time = time.time()
+        self.fetches += 1
+        timeout = remaining_time(settings.scraper_http_timeout_seconds)
+        try:
+            async with self._get_client().stream("GET", url, timeout=timeout) as response:
+                body = bytearray()
+                async for chunk in response.aiter_bytes():
+                    body += chunk
+                    if len(body) > settings.scraper_http_max_bytes:
+                        raise ValueError("Response exceeds the HTTP engine size limit")
+        except (httpx.HTTPError, ValueError) as e:
+            error = str(e) or type(e).__name__
+            return failed(url, error), error
+
+        content_type = response.headers.get("content-type", "")
+        if response.status_code >= 400:
+            error = f"HTTP {response.status_code}"
+            reason = error if response.status_code in ESCALATE_STATUS_CODES or response.status_code >= 500 else None
+            return failed(url, error), reason
+        if "html" not in content_type and content_type:
+            return failed(url, f"Unsupported content type {content_type}"), "not html"
+
+        html = body.decode(response.encoding or "utf-8", errors="replace")
+        soup = BeautifulSoup(html, "lxml")
+        title = soup.title.get_text(strip=True) if soup.title else ""
+        selected = None
+        if extract_selector:
+            try:
+                selected = soup.select_one(extract_selector)
+            except Exception:
+                # Playwright-only selector syntax (text=, >>) that soupsieve cannot parse
+                selected = None
+        page_text = soup.get_text(separator="\n", strip=True)
+        reason = browser_needed(soup, page_text, extract_selector, selected)
+
+        if selected is not None:
+            html = selected.decode_contents()
+            text = selected.get_text(separator="\n", strip=True)
+        else:
+            text = page_text
+        return {
+            "success": True,
+            "url": url,
+            "title": title,
+            "html": html,
+            "text": text,
+            "engine": "http",
+            "load_time_ms": int((time.time() - start_time) * 1000),
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "final_url": str(response.url),
+        }, reason
+
+    async def revalidate(self, url: str, etag: Optional[str], last_modified: Optional[str]) -> Optional[bool]:
+        """
+        Ask the origin whether a cached copy is still current
+
+        Sends a conditional GET and never reads a changed body.
+
+        Returns:
+            True on 304 Not Modified, False when the page changed, None if the check failed
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        timeout = remaining_time(settings.scraper_http_timeout_seconds)
+        try:
+            async with self._get_client().stream("GET", url, headers=headers, timeout=timeout) as response:
+                return response.status_code == 304
+        except httpx.HTTPError:
+            return None
+
+    async def close(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "fetches": self.fetches,
+            "escalations": self.escalations,
+            "domains": self.memory.counts(),
+        }
+
+
+# Singleton instance
+http_engine = HttpEngine()
@@ -0,0 +1,235 @@
+"""
+OmniDev - Image Preprocessing
+Sniffs, orients, downscales and re-encodes uploads before they are sent to the vision model
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Optional, Union
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from app.config import get_settings
+from app.services.metrics import record_image_preprocess
+
+settings = get_settings()
+
+# Read size for incremental base64 encoding; a multiple of 3 so chunks concatenate cleanly
+BASE64_CHUNK = 3 * 64 * 1024
+
+# Formats the vision API accepts as-is
+SUPPORTED_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+class ImageRejected(ValueError):
+    """Raised when an upload is not an image Pillow can decode"""
+
+
+@dataclass
+class PreprocessedImage:
+    """An upload ready to send: encoded bytes plus what was done to it"""
+    data: bytes
+    media_type: str
+    source_format: str
+    width: int
+    height: int
+    original_bytes: int
+    elapsed_ms: float
+    base64_data: str = ""
+    phash: Optional[int] = None
+    tone: Optional[int] = None
+    digest: str = ""
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+    def data_url(self) -> str:
+        return f"data:{self.media_type};base64,{self.base64_data}"
+
+
+def dhash(image: Image.Image, size: int = 8) -> int:
+    """64-bit difference hash: compares neighbouring pixels of a tiny grayscale copy"""
+    pixels = list(image.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR).getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def mean_tone(image: Image.Image) -> int:
+    """Average colour quantised to 3 bits per channel; separates images dHash cannot (e.g. flat fills)"""
+    red, green, blue = image.convert("RGB").resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+    return (red >> 5) << 6 | (green >> 5) << 3 | (blue >> 5)
+
+
+def max_edge_for(task: str) -> int:
+    """OCR keeps more pixels than general description so small text stays legible"""
+    if task == "ocr":
+        return settings.vision_max_edge_ocr
+    return settings.vision_max_edge
+
+
+def _source_size(source: Union[bytes, BinaryIO]) -> int:
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    source.seek(0, io.SEEK_END)
+    size = source.tell()
+    source.seek(0)
+    return size
+
+
+def _read_all(source: Union[bytes, BinaryIO]) -> bytes:
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    source.seek(0)
+    return source.read()
+
+
+def encode_base64(source: Union[bytes, BinaryIO], chunk_size: int = BASE64_CHUNK) -> str:
+    """Base64-encode in chunks (a multiple of 3 bytes) so no second full-size byte copy is made"""
+    if isinstance(source, (bytes, bytearray)):
+        view = memoryview(source)
+        chunks = (view[offset:offset + chunk_size] for offset in range(0, len(view), chunk_size))
+    else:
+        source.seek(0)
+        chunks = iter(lambda: source.read(chunk_size), b"")
+    return "".join(base64.b64encode(chunk).decode("ascii") for chunk in chunks)
+
+
+def preprocess_image(source: Union[bytes, BinaryIO], task: str = "analyze") -> PreprocessedImage:
+    """
+    Prepare an upload for the vision model (blocking; run it in a worker thread)
+
+    `source` is the upload's bytes or a seekable file, such as the spooled
+    temporary file behind an UploadFile; files are decoded straight from disk.
+    The real format is sniffed, EXIF orientation is applied, the longest edge
+    is capped for the task, perceptual and exact hashes are taken and the
+    result is re-encoded. The original is kept when it is already a supported format,
+    needs no changes and would not get smaller. Images Pillow recognises but
+    cannot decode (e.g. truncated files) are passed through unchanged,
+    without a hash.
+
+    Raises:
+        ImageRejected: If the source is not a decodable image or has too many pixels
+    """
+    start = time.perf_counter()
+    original_bytes = _source_size(source)
+    try:
+        image = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as exc:
+        raise ImageRejected(f"Unsupported or corrupt image: {exc}") from exc
+    source_format = image.format or "UNKNOWN"
+    if image.width * image.height > settings.vision_max_image_pixels:
+        raise ImageRejected(f"Image is too large ({image.width}x{image.height} pixels)")
+
+    header_size = image.size
+    max_edge = max_edge_for(task)
+    if source_format == "JPEG":
+        # Let the JPEG decoder downscale by 2/4/8 while decoding, never below max_edge
+        image.draft("RGB", (max_edge, max_edge))
+    try:
+        image.load()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+        if source_format not in SUPPORTED_FORMATS:
+            raise ImageRejected(f"Unsupported or corrupt image: {exc}") from exc
+        # Recognised but not decodable here (e.g. truncated); let the model try the original
+        return PreprocessedImage(
+            data=_read_all(source),
+            media_type=SUPPORTED_FORMATS[source_format],
+            source_format=source_format,
+            width=image.width,
+            height=image.height,
+            original_bytes=original_bytes,
+            elapsed_ms=(time.perf_counter() - start) * 1000,
+            base64_data=encode_base64(source),
+        )
+
+    # Animated images: the first frame is what the model would look at anyway
+    image.seek(0)
+    oriented = ImageOps.exif_transpose(image)
+    # A draft-mode JPEG decode has already been downscaled
+    changed = oriented is not image or image.size != header_size
+    image = oriented
+
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        changed = True
+    phash = dhash(image)
+    tone = mean_tone(image)
+
+    output_format = settings.vision_output_format.upper()
+    if output_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    buffer = io.BytesIO()
+    if output_format == "JPEG":
+        image.save(buffer, "JPEG", quality=settings.vision_jpeg_quality, optimize=True)
+    else:
+        output_format = "WEBP"
+        image.save(buffer, "WEBP", quality=settings.vision_webp_quality, method=4)
+    data = buffer.getvalue()
+    buffer.close()
+    width, height = image.size
+    image.close()
+    media_type = SUPPORTED_FORMATS[output_format]
+
+    if not changed and source_format in SUPPORTED_FORMATS and original_bytes <= len(data):
+        data, media_type = _read_all(source), SUPPORTED_FORMATS[source_format]
+
+    return PreprocessedImage(
+        data=data,
+        media_type=media_type,
+        source_format=source_format,
+        width=width,
+        height=height,
+        original_bytes=original_bytes,
+        elapsed_ms=(time.perf_counter() - start) * 1000,
+        base64_data=encode_base64(data),
+        phash=phash,
+        tone=tone,
+        digest=hashlib.blake2b(data, digest_size=16).hexdigest(),
+    )
+
+
+class ImagePreprocessor:
+    """Runs preprocessing on a small thread pool so decoding never blocks the event loop"""
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or settings.vision_preprocess_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="vision-preprocess",
+        )
+
+    async def prepare(self, image_data: Union[bytes, BinaryIO], task: str = "analyze") -> PreprocessedImage:
+        """
+        Preprocess an upload off the event loop
+
+        Args:
+            image_data: Raw upload bytes or a seekable file holding them
+            task: "analyze", "describe", "objects" or "ocr"; picks the size cap
+
+        Returns:
+            The encoded image with its media type and base64 payload
+
+        Raises:
+            ImageRejected: If the bytes are not a decodable image
+        """
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._executor, preprocess_image, image_data, task)
+        record_image_preprocess(result.original_bytes, len(result.data), result.elapsed_ms)
+        return result
+
+
+# Singleton instance
+image_preprocessor = ImagePreprocessor()
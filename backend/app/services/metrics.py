@@ -4,6 +4,10 @@ from typing import Dict
 
 request_counts: Dict[str, int] = defaultdict(int)
 status_counts: Dict[int, int] = defaultdict(int)
+stream_counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {"responses": 0, "frames": 0, "chunks": 0})
+prompt_cache_counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+image_preprocess_counts: Dict[str, float] = {"images": 0, "bytes_in": 0, "bytes_out": 0, "time_ms": 0.0}
+cancellation_counts: Dict[str, Dict[str, float]] = defaultdict(lambda: {"deadline": 0, "disconnect": 0, "time_saved_ms": 0.0})
 
 
 def record(path: str, status_code: int) -> None:
@@ -11,8 +15,48 @@ def record(path: str, status_code: int) -> None:
     status_counts[status_code] += 1
 
 
+def record_stream(route: str, frames: int, chunks: int) -> None:
+    counts = stream_counts[route]
+    counts["responses"] += 1
+    counts["frames"] += frames
+    counts["chunks"] += chunks
+
+
+def record_cancellation(route: str, reason: str, saved_seconds: float) -> None:
+    counts = cancellation_counts[route]
+    counts[reason] += 1
+    counts["time_saved_ms"] += round(saved_seconds * 1000, 1)
+
+
+def record_prompt_cache(route: str, prompt_tokens: int, cached_tokens: int) -> None:
+    counts = prompt_cache_counts[route]
+    counts["requests"] += 1
+    counts["prompt_tokens"] += prompt_tokens
+    counts["cached_tokens"] += cached_tokens
+
+
+def record_image_preprocess(bytes_in: int, bytes_out: int, elapsed_ms: float) -> None:
+    image_preprocess_counts["images"] += 1
+    image_preprocess_counts["bytes_in"] += bytes_in
+    image_preprocess_counts["bytes_out"] += bytes_out
+    image_preprocess_counts["time_ms"] += round(elapsed_ms, 2)
+
+
 def snapshot() -> dict:
     return {
         "requests": dict(request_counts),
         "statuses": {str(k): v for k, v in status_counts.items()},
+        "streams": {
+            route: {**counts, "frames_per_response": round(counts["frames"] / counts["responses"], 2)}
+            for route, counts in stream_counts.items()
+        },
+        "prompt_cache": {
+            route: {**counts, "hit_rate": round(counts["cached_tokens"] / counts["prompt_tokens"], 3) if counts["prompt_tokens"] else 0.0}
+            for route, counts in prompt_cache_counts.items()
+        },
+        "image_preprocess": {
+            **image_preprocess_counts,
+            "bytes_saved": image_preprocess_counts["bytes_in"] - image_preprocess_counts["bytes_out"],
+        },
+        "cancellations": {route: dict(counts) for route, counts in cancellation_counts.items()},
     }
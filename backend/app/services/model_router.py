@@ -0,0 +1,192 @@
+"""
+OmniDev - Model Router
+Sends each chat request to a fast, cheap or capable model tier
+"""
+
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import get_settings
+
+settings = get_settings()
+
+# Ordered from quickest to most capable
+TIERS = ("fast", "cheap", "capable")
+
+# What every chat request used before routing existed; served when the router is disabled
+DEFAULT_MODEL = "gpt-5-mini"
+DEFAULT_MAX_TOKENS = 8192
+
+
+@dataclass
+class ModelRoute:
+    """Routing decision for one request"""
+    tier: str
+    model: str
+    max_completion_tokens: int
+    reason: str
+    reasoning_effort: Optional[str] = None
+
+    def metadata(self) -> Dict[str, Any]:
+        return {"model": self.model, "model_tier": self.tier, "route_reason": self.reason}
+
+    def completion_options(self) -> Dict[str, Any]:
+        """Model, output cap and reasoning effort for chat.completions.create"""
+        options: Dict[str, Any] = {"model": self.model, "max_completion_tokens": self.max_completion_tokens}
+        if self.reasoning_effort:
+            options["reasoning_effort"] = self.reasoning_effort
+        return options
+
+
+def _split(value: Optional[str]) -> List[str]:
+    if not value:
+        return []
+    return [item.strip().lower() for item in value.split(",") if item.strip()]
+
+
+def _compile_keywords(keywords: List[str]) -> Optional["re.Pattern[str]"]:
+    """Match keywords as whole words (or plurals) so "sql" never fires inside "mysqldump" text"""
+    if not keywords:
+        return None
+    alternatives = "|".join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alternatives})s?\b")
+
+
+class ModelRouter:
+    """
+    Classifies requests with cheap rules and tracks per-model latency.
+
+    The default classifier looks at prompt length, history size and keywords;
+    pass `classifier` to plug in a different one. When the chosen tier's model
+    is observed to be slower than the latency target (time to first token),
+    the router falls back to the most capable quicker tier that meets it.
+    Latency readings expire after `latency_ttl_seconds`, so a downgraded model
+    gets probe traffic again and is routed to once it has recovered.
+    """
+
+    def __init__(
+        self,
+        classifier: Optional[Callable[[str, Optional[List[Dict]]], str]] = None,
+        latency_target_ms: Optional[int] = None,
+        latency_ttl_seconds: Optional[float] = None,
+    ):
+        self.enabled = settings.model_router_enabled
+        self.models = {
+            "fast": settings.model_tier_fast,
+            "cheap": settings.model_tier_cheap,
+            "capable": settings.model_tier_capable,
+        }
+        self.max_tokens = {
+            "fast": settings.model_tier_fast_max_tokens,
+            "cheap": settings.model_tier_cheap_max_tokens,
+            "capable": settings.model_tier_capable_max_tokens,
+        }
+        self.reasoning_effort = {
+            "fast": settings.model_tier_fast_reasoning_effort,
+            "cheap": settings.model_tier_cheap_reasoning_effort,
+            "capable": settings.model_tier_capable_reasoning_effort,
+        }
+        self.keywords = _split(settings.model_router_capable_keywords)
+        self._keyword_pattern = _compile_keywords(self.keywords)
+        self.latency_target = (latency_target_ms or settings.model_router_latency_target_ms) / 1000
+        self.latency_ttl = (
+            latency_ttl_seconds if latency_ttl_seconds is not None else settings.model_router_latency_ttl_seconds
+        )
+        self.classifier = classifier or self.classify
+        # model -> (EWMA of time to first token, monotonic time of the last sample)
+        self._latency: Dict[str, Tuple[float, float]] = {}
+        self._samples: Dict[str, int] = {}
+        self.routed = {tier: 0 for tier in TIERS}
+        self.downgraded = 0
+
+    def classify(self, message: str, history: Optional[List[Dict]] = None) -> str:
+        """Pick a tier from prompt length, history size and keyword rules"""
+        text = message.lower()
+        turns = len(history or [])
+        if self._keyword_pattern is not None and self._keyword_pattern.search(text):
+            return "capable"
+        if len(message) >= settings.model_router_long_prompt_chars or turns >= settings.model_router_long_history_turns:
+            return "capable"
+        if len(message) <= settings.model_router_short_prompt_chars and turns <= 2:
+            return "fast"
+        return "cheap"
+
+    def route(self, message: str, history: Optional[List[Dict]] = None) -> ModelRoute:
+        """
+        Choose the model and output cap for a request
+
+        Args:
+            message: User's message
+            history: Conversation history sent with it
+
+        Returns:
+            The routing decision
+        """
+        if not self.enabled:
+            return ModelRoute("default", DEFAULT_MODEL, DEFAULT_MAX_TOKENS, "router disabled")
+
+        tier = self.classifier(message, history)
+        reason = "classified"
+        if not self._meets_target(tier):
+            # Walk towards quicker tiers; keep the original if none is quick enough
+            for candidate in reversed(TIERS[:TIERS.index(tier)]):
+                if self._meets_target(candidate):
+                    tier, reason = candidate, "latency target"
+                    self.downgraded += 1
+                    break
+        self.routed[tier] += 1
+        return ModelRoute(tier, self.models[tier], self.max_tokens[tier], reason, self.reasoning_effort[tier])
+
+    def observe(self, model: str, seconds: float) -> None:
+        """Record how long `model` took to produce its first token"""
+        previous = self._current_latency(model)
+        self._latency[model] = (seconds if previous is None else 0.8 * previous + 0.2 * seconds, time.monotonic())
+        self._samples[model] = self._samples.get(model, 0) + 1
+
+    def timer(self, route: ModelRoute) -> Callable[[], None]:
+        """Start timing a request; call the returned function when the first token arrives"""
+        start = time.monotonic()
+        return lambda: self.observe(route.model, time.monotonic() - start)
+
+    def _current_latency(self, model: str) -> Optional[float]:
+        entry = self._latency.get(model)
+        if entry is None or time.monotonic() - entry[1] > self.latency_ttl:
+            return None
+        return entry[0]
+
+    def _meets_target(self, tier: str) -> bool:
+        # Models without recent samples are given the benefit of the doubt, which probes slow ones again
+        latency = self._current_latency(self.models[tier])
+        return latency is None or latency <= self.latency_target
+
+    def active_models(self) -> Dict[str, str]:
+        """Model served by each tier, or the single default when routing is off"""
+        if not self.enabled:
+            return {"default": DEFAULT_MODEL}
+        return {tier: self.models[tier] for tier in TIERS}
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "tiers": {
+                tier: {
+                    "model": self.models[tier],
+                    "max_completion_tokens": self.max_tokens[tier],
+                    "reasoning_effort": self.reasoning_effort[tier],
+                }
+                for tier in TIERS
+            },
+            "routed": dict(self.routed),
+            "downgraded": self.downgraded,
+            "latency_ms": {
+                model: {"avg": round(latency * 1000, 1), "samples": self._samples[model]}
+                for model, (latency, _) in self._latency.items()
+            },
+            "latency_target_ms": round(self.latency_target * 1000),
+        }
+
+
+# Singleton instance
+model_router = ModelRouter()
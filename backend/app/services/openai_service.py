@@ -4,10 +4,16 @@ Provides chat functionality powered by OpenAI GPT-5 Mini
 """
 
 from openai import AsyncOpenAI
-from typing import AsyncGenerator, Optional, List, Dict
-import base64
+from typing import AsyncGenerator, BinaryIO, Optional, List, Dict, Any, Union
+from contextlib import nullcontext
 
 from app.config import get_settings
+from app.services.admission import admission_controller
+from app.services.image_preprocess import ImageRejected, PreprocessedImage, image_preprocessor
+from app.services.model_router import ModelRoute, model_router
+from app.services.prompt_budget import prompt_assembler
+from app.services.prompts import prompt_registry, record_usage
+from app.services.upstream import upstream_policy
 
 settings = get_settings()
 
@@ -25,30 +31,69 @@ class OpenAIService:
     def _configure(self):
         """Configure the OpenAI API"""
         if settings.openai_api_key:
-            self.client = AsyncOpenAI(api_key=settings.openai_api_key)
+            # Retries are handled by upstream_policy
+            self.client = AsyncOpenAI(api_key=settings.openai_api_key, max_retries=0)
     
-    def _get_system_prompt(self) -> str:
-        """Get the system prompt for the AI assistant"""
-        return """You are OmniDev AI Assistant, a powerful and knowledgeable AI powered by OpenAI GPT-5 Mini.
+    async def _create_completion(self, client: AsyncOpenAI, server_key: bool = True, **kwargs):
+        """Create a chat completion; server-key calls go through the resilience policy"""
+        if not server_key:
+            return await client.chat.completions.create(**kwargs)
+        stream = bool(kwargs.get("stream"))
+        discard = (lambda response: response.close()) if stream else None
+        return await upstream_policy.call(
+            lambda: client.chat.completions.create(**kwargs),
+            discard=discard,
+            latency_key=(kwargs.get("model"), "stream" if stream else "full"),
+        )
+
+    def build_messages(
+        self,
+        message: str,
+        history: Optional[List[Dict]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, str]]:
+        """
+        Build the message list within the configured token budget
         
-You help users with:
-- Technical questions and coding assistance
-- Cloud computing concepts (AWS, GCP, Azure)
-- DevOps practices and tools
-- Web scraping and browser automation
-- General knowledge and research
-- Image analysis and vision tasks
+        Args:
+            message: User's message
+            history: Optional conversation history
+            metadata: Optional dict updated with prompt assembly stats
+            
+        Returns:
+            Messages for the chat completions API
+        """
+        # The system prompt is the static prefix; history and the new message follow
+        prompt = prompt_assembler.assemble(prompt_registry.get("assistant").static, message, history)
+        if metadata is not None:
+            metadata.update(prompt.metadata())
+        return prompt.messages
 
-Be concise, accurate, and friendly. Format responses with markdown when helpful.
-If you don't know something, say so honestly."""
+    def route(
+        self,
+        message: str,
+        history: Optional[List[Dict]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> ModelRoute:
+        """Pick the model tier for a chat request and note it in metadata"""
+        route = model_router.route(message, history)
+        if metadata is not None:
+            metadata.update(route.metadata())
+        return route
 
-    async def chat(self, message: str, history: Optional[List[Dict]] = None) -> str:
+    async def chat(
+        self,
+        message: str,
+        history: Optional[List[Dict]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> str:
         """
         Send a message to OpenAI and get a response
         
         Args:
             message: User's message
             history: Optional conversation history
+            metadata: Optional dict updated with prompt assembly stats
             
         Returns:
             AI response text
@@ -56,38 +101,30 @@ If you don't know something, say so honestly."""
         if not self.client:
             return "⚠️ OpenAI API not configured. Please add OPENAI_API_KEY to your .env file."
         
-        try:
-            # Build messages list
-            messages = [{"role": "system", "content": self._get_system_prompt()}]
-            
-            # Add conversation history if provided
-            if history:
-                for msg in history:
-                    role = "user" if msg.get("role") == "user" else "assistant"
-                    messages.append({
-                        "role": role,
-                        "content": msg.get("content", "")
-                    })
-            
-            # Add current message
-            messages.append({"role": "user", "content": message})
-            
-            # Get response from OpenAI
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_completion_tokens=8192,
-            )
-            
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            return f"❌ Error communicating with OpenAI: {str(e)}"
+        async with admission_controller.slot():
+            try:
+                messages = self.build_messages(message, history, metadata)
+                route = self.route(message, history, metadata)
+                
+                # Get response from OpenAI; only streams feed the router's
+                # time-to-first-token readings, a full completion's time is mostly length
+                response = await self._create_completion(
+                    self.client,
+                    messages=messages,
+                    **route.completion_options(),
+                )
+                record_usage("chat", response.usage, metadata)
+                
+                return response.choices[0].message.content
+                
+            except Exception as e:
+                return f"❌ Error communicating with OpenAI: {str(e)}"
     
     async def chat_stream(
         self, 
         message: str, 
-        history: Optional[List[Dict]] = None
+        history: Optional[List[Dict]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
     ) -> AsyncGenerator[str, None]:
         """
         Stream a response from OpenAI
@@ -95,6 +132,7 @@ If you don't know something, say so honestly."""
         Args:
             message: User's message
             history: Optional conversation history
+            metadata: Optional dict updated with prompt assembly stats
             
         Yields:
             Chunks of the AI response
@@ -103,49 +141,77 @@ If you don't know something, say so honestly."""
             yield "⚠️ OpenAI API not configured. Please add OPENAI_API_KEY to your .env file."
             return
         
-        try:
-            messages = [{"role": "system", "content": self._get_system_prompt()}]
-            
-            if history:
-                for msg in history:
-                    role = "user" if msg.get("role") == "user" else "assistant"
-                    messages.append({
-                        "role": role,
-                        "content": msg.get("content", "")
-                    })
-            
-            messages.append({"role": "user", "content": message})
-            
-            # Stream response from OpenAI
-            stream = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_completion_tokens=8192,
-                stream=True,
-            )
-            
-            async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
-                    
-        except Exception as e:
-            yield f"❌ Error: {str(e)}"
+        # Streams hold their slot until the last token; only 429s adjust the limit
+        async with admission_controller.slot(observe_latency=False):
+            try:
+                messages = self.build_messages(message, history, metadata)
+                route = self.route(message, history, metadata)
+                first_token = model_router.timer(route)
+                
+                # Stream response from OpenAI
+                stream = await self._create_completion(
+                    self.client,
+                    messages=messages,
+                    **route.completion_options(),
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                
+                # Closing the stream aborts the upstream request if the consumer stops early
+                async with stream:
+                    async for chunk in stream:
+                        # The final chunk carries usage and no choices
+                        if not chunk.choices:
+                            record_usage("chat_stream", chunk.usage, metadata)
+                        elif chunk.choices[0].delta.content:
+                            if first_token is not None:
+                                first_token()
+                                first_token = None
+                            yield chunk.choices[0].delta.content
+                        
+            except Exception as e:
+                yield f"❌ Error: {str(e)}"
     
+    def build_vision_messages(self, image: PreprocessedImage, prompt: str) -> List[Dict[str, Any]]:
+        """Static instructions first, the image (volatile) last"""
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image.data_url()
+                        }
+                    }
+                ]
+            }
+        ]
+
     async def analyze_image(
         self,
-        image_data: bytes,
+        image_data: Union[bytes, BinaryIO, PreprocessedImage],
         prompt: str = "Describe this image in detail.",
-        api_key: Optional[str] = None
+        api_key: Optional[str] = None,
+        task: str = "analyze",
+        response_format: Optional[Dict[str, Any]] = None,
     ) -> str:
         """
-        Analyze an image using OpenAI GPT-4o Vision
+        Analyze an image using OpenAI GPT-5 Mini Vision
         
         Args:
-            image_data: Image bytes
+            image_data: Image bytes or file, or an image already preprocessed for the task
             prompt: Analysis prompt
+            api_key: Optional user-provided OpenAI API key
+            task: "analyze", "describe", "objects" or "ocr"; sets the downscaling limit
+            response_format: Optional structured-output format (e.g. a JSON schema)
             
         Returns:
-            Image analysis text
+            Image analysis text, or JSON text when a response format is given
         """
         client = self.client
         if api_key:
@@ -153,43 +219,88 @@ If you don't know something, say so honestly."""
         if not client:
             return "⚠️ OpenAI API not configured."
         
-        try:
-            # Convert image bytes to base64
-            base64_image = base64.b64encode(image_data).decode('utf-8')
-            
-            # Determine image type (assume jpeg if unknown)
-            # You could add proper detection here
-            media_type = "image/jpeg"
+        # Decode, downscale and re-encode in a worker thread before taking an upstream slot
+        if isinstance(image_data, PreprocessedImage):
+            image = image_data
+        else:
+            try:
+                image = await image_preprocessor.prepare(image_data, task)
+            except ImageRejected as e:
+                return f"❌ {e}"
+        
+        # User-provided keys have their own upstream quota and skip admission
+        async with (nullcontext() if api_key else admission_controller.slot()):
+            try:
+                messages = self.build_vision_messages(image, prompt)
+                options = {"response_format": response_format} if response_format else {}
+                response = await self._create_completion(
+                    client,
+                    server_key=not api_key,
+                    model=self.vision_model,
+                    messages=messages,
+                    max_completion_tokens=4096,
+                    **options,
+                )
+                record_usage("vision", response.usage)
             
-            # Create message with image
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{media_type};base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ]
+                return response.choices[0].message.content
             
-            response = await client.chat.completions.create(
-                model=self.vision_model,
-                messages=messages,
-                max_completion_tokens=4096,
-            )
+            except Exception as e:
+                return f"❌ Error analyzing image: {str(e)}"
+
+    async def analyze_image_stream(
+        self,
+        image: PreprocessedImage,
+        prompt: str,
+        api_key: Optional[str] = None,
+        status: Optional[Dict[str, Any]] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream an image analysis from OpenAI GPT-5 Mini Vision
+        
+        Args:
+            image: Image already preprocessed for the task
+            prompt: Analysis prompt
+            api_key: Optional user-provided OpenAI API key
+            status: Optional dict; on failure the message is stored in
+                `status["error"]` instead of being yielded as a chunk
             
-            return response.choices[0].message.content
+        Yields:
+            Chunks of the analysis
+        """
+        client = AsyncOpenAI(api_key=api_key) if api_key else self.client
+        if not client:
+            if status is not None:
+                status["error"] = "⚠️ OpenAI API not configured."
+            else:
+                yield "⚠️ OpenAI API not configured."
+            return
+        
+        async with (nullcontext() if api_key else admission_controller.slot(observe_latency=False)):
+            try:
+                stream = await self._create_completion(
+                    client,
+                    server_key=not api_key,
+                    model=self.vision_model,
+                    messages=self.build_vision_messages(image, prompt),
+                    max_completion_tokens=4096,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                
+                async with stream:
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            record_usage("vision_stream", chunk.usage)
+                        elif chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
             
-        except Exception as e:
-            return f"❌ Error analyzing image: {str(e)}"
+            except Exception as e:
+                # Chunks already sent are a partial answer; report the failure out of band when asked to
+                if status is not None:
+                    status["error"] = f"❌ Error analyzing image: {str(e)}"
+                else:
+                    yield f"❌ Error analyzing image: {str(e)}"
 
 
 # Singleton instance
@@ -0,0 +1,293 @@
+"""
+OmniDev - Scrape Page Cache
+Content-addressed on-disk cache of scrape results with ETag/Last-Modified revalidation
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import get_settings
+from app.services.serialization import dumps, dumps_bytes
+from app.services.urls import canonicalize_url
+
+settings = get_settings()
+
+
+def default_cache_dir() -> str:
+    """Per-user cache location (XDG), not a shared and guessable path under /tmp"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "omnidev", "scrape-cache")
+
+
+def secure_directory(path: str) -> bool:
+    """
+    Create `path` private to this user, or check an existing one is safe to trust
+
+    Cached pages are served back verbatim, so a directory another user can
+    write to (or planted ahead of time) would let them forge scrape results.
+    Loose permissions on our own directory are tightened to 0700.
+
+    Returns:
+        False when the path is a symlink, not a directory, or owned by someone else
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        return False
+    getuid = getattr(os, "getuid", None)
+    if getuid is None:
+        return True
+    if info.st_uid != getuid():
+        return False
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return True
+
+
+@dataclass
+class CacheEntry:
+    """Index record of one cached scrape; the page body lives in a shared blob"""
+    key: str
+    url: str
+    blob: str
+    size: int
+    title: str
+    engine: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+    validated_at: float
+
+    @property
+    def revalidatable(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+
+class PageCache:
+    """
+    Disk cache of extracted HTML and text keyed by canonical URL plus extraction options.
+
+    Bodies are stored once per content hash, so identical pages reached through
+    different URLs or options share a blob. Entries younger than the caller's
+    `max_age` (default: the configured TTL) are served directly; older ones with
+    an ETag or Last-Modified can be revalidated with a conditional request and
+    kept when the origin answers 304. Least-recently-used entries are evicted
+    once the blobs exceed the size budget. Disk I/O runs in worker threads.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        enabled: Optional[bool] = None,
+    ):
+        self.directory = directory or settings.scraper_cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes or settings.scraper_cache_max_bytes
+        self.ttl = ttl_seconds if ttl_seconds is not None else settings.scraper_cache_ttl_seconds
+        self.enabled = settings.scraper_cache_enabled if enabled is None else enabled
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._blob_refs: Dict[str, int] = {}
+        self._blob_sizes: Dict[str, int] = {}
+        self.total_bytes = 0
+        self._load_lock = asyncio.Lock()
+        self._loaded = False
+        self.hits = 0
+        self.stale = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.error: Optional[str] = None
+
+    def key_for(self, url: str, options: Dict[str, Any]) -> Optional[str]:
+        canonical = canonicalize_url(url)
+        if canonical is None:
+            return None
+        material = canonical + "\n" + dumps({k: v for k, v in sorted(options.items()) if v is not None})
+        return hashlib.blake2b(material.encode(), digest_size=16).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, "entries", f"{key}.json")
+
+    def _blob_path(self, blob: str) -> str:
+        return os.path.join(self.directory, "blobs", blob[:2], f"{blob}.z")
+
+    def _load_index(self) -> None:
+        try:
+            trusted = secure_directory(self.directory)
+        except OSError as e:
+            trusted, self.error = False, str(e)
+        if not trusted:
+            self.enabled = False
+            self.error = self.error or f"{self.directory} is not a private directory owned by this user"
+            return
+        entries_dir = os.path.join(self.directory, "entries")
+        os.makedirs(entries_dir, exist_ok=True)
+        loaded = []
+        for name in os.listdir(entries_dir):
+            try:
+                with open(os.path.join(entries_dir, name), encoding="utf-8") as f:
+                    entry = CacheEntry(**json.load(f))
+                blob_size = os.path.getsize(self._blob_path(entry.blob))
+            except (OSError, ValueError, TypeError):
+                continue
+            loaded.append((entry, blob_size))
+        # Oldest validation first, so LRU order survives restarts approximately
+        for entry, blob_size in sorted(loaded, key=lambda item: item[0].validated_at):
+            self._entries[entry.key] = entry
+            self._blob_refs[entry.blob] = self._blob_refs.get(entry.blob, 0) + 1
+            if entry.blob not in self._blob_sizes:
+                self._blob_sizes[entry.blob] = blob_size
+                self.total_bytes += blob_size
+
+    async def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if not self._loaded:
+                await asyncio.to_thread(self._load_index)
+                self._loaded = True
+
+    def _write(self, path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename, so readers never see a half-written file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read_blob(self, blob: str) -> Dict[str, str]:
+        with open(self._blob_path(blob), "rb") as f:
+            return json.loads(zlib.decompress(f.read()))
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    async def get(self, key: str, max_age: Optional[float] = None) -> Optional[Tuple[CacheEntry, Dict[str, str], bool]]:
+        """
+        Look up a cached scrape
+
+        Args:
+            key: Cache key from `key_for`
+            max_age: Seconds an entry stays fresh without revalidation (default: the TTL)
+
+        Returns:
+            (entry, stored `html` and `text`, whether it is still fresh), or None
+        """
+        await self._ensure_loaded()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        try:
+            body = await asyncio.to_thread(self._read_blob, entry.blob)
+        except (OSError, ValueError, zlib.error):
+            await self.drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        fresh = time.time() - entry.validated_at < (self.ttl if max_age is None else max_age)
+        if fresh:
+            self.hits += 1
+        else:
+            self.stale += 1
+        return entry, body, fresh
+
+    async def put(
+        self,
+        key: str,
+        url: str,
+        title: str,
+        html: str,
+        text: str,
+        engine: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> Optional[CacheEntry]:
+        """Store a scrape result, sharing the body blob with identical content (None when disabled)"""
+        await self._ensure_loaded()
+        payload = dumps_bytes({"html": html, "text": text})
+        blob = hashlib.blake2b(payload, digest_size=20).hexdigest()
+        if not self.enabled:
+            return None
+        now = time.time()
+        entry = CacheEntry(key, url, blob, len(payload), title, engine, etag, last_modified, now, now)
+
+        if blob not in self._blob_sizes:
+            data = await asyncio.to_thread(zlib.compress, payload, 1)
+            await asyncio.to_thread(self._write, self._blob_path(blob), data)
+            # A concurrent put of the same body may have recorded it during the write
+            if blob not in self._blob_sizes:
+                self._blob_sizes[blob] = len(data)
+                self.total_bytes += len(data)
+        previous = self._entries.pop(key, None)
+        self._entries[key] = entry
+        self._blob_refs[blob] = self._blob_refs.get(blob, 0) + 1
+        if previous is not None:
+            await self._release_blob(previous.blob)
+        await asyncio.to_thread(self._write, self._entry_path(key), dumps_bytes(asdict(entry)))
+        self.stores += 1
+        await self._evict()
+        return entry
+
+    async def mark_revalidated(self, entry: CacheEntry) -> None:
+        """The origin confirmed the entry is unchanged (304); restart its freshness"""
+        entry.validated_at = time.time()
+        self.revalidated += 1
+        await asyncio.to_thread(self._write, self._entry_path(entry.key), dumps_bytes(asdict(entry)))
+
+    async def drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        await asyncio.to_thread(self._remove, self._entry_path(key))
+        await self._release_blob(entry.blob)
+
+    async def _release_blob(self, blob: str) -> None:
+        refs = self._blob_refs.get(blob, 0) - 1
+        if refs > 0:
+            self._blob_refs[blob] = refs
+            return
+        self._blob_refs.pop(blob, None)
+        self.total_bytes -= self._blob_sizes.pop(blob, 0)
+        await asyncio.to_thread(self._remove, self._blob_path(blob))
+
+    async def _evict(self) -> None:
+        while self._entries and self.total_bytes > self.max_bytes:
+            key = next(iter(self._entries))
+            await self.drop(key)
+            self.evictions += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale + self.misses
+        return {
+            "enabled": self.enabled,
+            "error": self.error,
+            "entries": len(self._entries),
+            "blobs": len(self._blob_sizes),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "stale": self.stale,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.revalidated) / lookups, 3) if lookups else 0.0,
+        }
+
+
+# Singleton instance
+page_cache = PageCache()
@@ -0,0 +1,174 @@
+"""
+OmniDev - Prompt Budget Service
+Assembles chat prompts within a token budget using cached per-message token counts
+"""
+
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.config import get_settings
+
+settings = get_settings()
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken is optional; fall back to a character heuristic
+    _ENCODING = None
+
+# Tokens the chat format adds around every message (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@dataclass
+class AssembledPrompt:
+    """Messages ready for the chat completions API plus budget accounting"""
+    messages: List[Dict[str, str]]
+    prompt_tokens: int
+    original_tokens: int
+    dropped_messages: int = 0
+    budget: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.prompt_tokens
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "original_prompt_tokens": self.original_tokens,
+            "tokens_saved": self.tokens_saved,
+            "dropped_messages": self.dropped_messages,
+            "token_budget": self.budget,
+        }
+
+
+@dataclass
+class TokenCounter:
+    """Counts tokens per message content, memoized by content hash"""
+    max_entries: int = 8192
+    _cache: "OrderedDict[bytes, int]" = field(default_factory=OrderedDict)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+
+        if _ENCODING is not None:
+            tokens = len(_ENCODING.encode(text))
+        else:
+            tokens = (len(text) + 3) // 4
+
+        self._cache[key] = tokens
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return tokens
+
+    def count_message(self, message: Dict[str, str]) -> int:
+        return self.count(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+class PromptAssembler:
+    """
+    Builds the message list for a chat request without exceeding a token budget.
+
+    The system prompt, the current user message and the most recent turns are
+    always kept. Older turns are dropped oldest-first until the prompt fits and
+    replaced by a short note so the model knows context was trimmed.
+    """
+
+    def __init__(
+        self,
+        budget: Optional[int] = None,
+        keep_recent: Optional[int] = None,
+        counter: Optional[TokenCounter] = None,
+    ):
+        self.budget = budget if budget is not None else settings.chat_history_token_budget
+        self.keep_recent = keep_recent if keep_recent is not None else settings.chat_history_keep_recent
+        self.counter = counter or TokenCounter()
+
+    @staticmethod
+    def _omission_note(dropped: int) -> Dict[str, str]:
+        return {
+            "role": "system",
+            "content": f"[{dropped} earlier messages omitted to fit the context window]",
+        }
+
+    def assemble(
+        self,
+        system_prompt: str,
+        message: str,
+        history: Optional[List[Dict]] = None,
+    ) -> AssembledPrompt:
+        """
+        Assemble messages for the chat completions API
+
+        Args:
+            system_prompt: System prompt placed first
+            message: Current user message placed last
+            history: Optional previous turns, oldest first
+
+        Returns:
+            AssembledPrompt with the messages and token accounting
+        """
+        count = self.counter.count_message
+        system = {"role": "system", "content": system_prompt}
+        current = {"role": "user", "content": message}
+
+        turns = []
+        for msg in history or []:
+            role = "user" if msg.get("role") == "user" else "assistant"
+            turns.append({"role": role, "content": msg.get("content", "")})
+
+        turn_tokens = [count(turn) for turn in turns]
+        fixed_tokens = count(system) + count(current)
+        original_tokens = fixed_tokens + sum(turn_tokens)
+
+        if original_tokens <= self.budget or not turns:
+            return AssembledPrompt(
+                messages=[system, *turns, current],
+                prompt_tokens=original_tokens,
+                original_tokens=original_tokens,
+                budget=self.budget,
+            )
+
+        # Room for the omission note is reserved up front (sized for the largest
+        # possible count), so adding it can't push the prompt over budget.
+        note_reserve = count(self._omission_note(len(turns)))
+
+        # Walk back from the newest turn; recent turns are kept unconditionally.
+        used = fixed_tokens
+        first_kept = len(turns)
+        for index in range(len(turns) - 1, -1, -1):
+            is_recent = len(turns) - index <= self.keep_recent
+            if not is_recent and used + note_reserve + turn_tokens[index] > self.budget:
+                break
+            used += turn_tokens[index]
+            first_kept = index
+
+        dropped = first_kept
+        messages = [system]
+        if dropped:
+            note = self._omission_note(dropped)
+            used += count(note)
+            messages.append(note)
+        messages.extend(turns[first_kept:])
+        messages.append(current)
+
+        return AssembledPrompt(
+            messages=messages,
+            prompt_tokens=used,
+            original_tokens=original_tokens,
+            dropped_messages=dropped,
+            budget=self.budget,
+        )
+
+
+# Singleton instance
+prompt_assembler = PromptAssembler()
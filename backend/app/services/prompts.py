@@ -0,0 +1,201 @@
+"""
+OmniDev - Prompt Templates
+Registry of prompt templates split into a static, cacheable prefix and a volatile suffix
+"""
+
+import hashlib
+import string
+import textwrap
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.metrics import record_prompt_cache
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """
+    A compiled prompt template
+
+    `static` never changes between requests and is always sent first, so the
+    provider's prefix cache can reuse it. `volatile` is a str.format template
+    for per-request values (user message, live context) and is sent last.
+    """
+    name: str
+    static: str
+    volatile: str = ""
+    fields: Tuple[str, ...] = field(default=())
+    prefix_hash: str = ""
+
+    def render(self, **values: Any) -> str:
+        """Fill in the volatile part"""
+        missing = [name for name in self.fields if name not in values]
+        if missing:
+            raise KeyError(f"Prompt '{self.name}' is missing values: {', '.join(missing)}")
+        return self.volatile.format_map(values)
+
+
+class PromptRegistry:
+    """Compiles templates once at registration and hands out the shared instances"""
+
+    def __init__(self):
+        self._templates: Dict[str, PromptTemplate] = {}
+
+    def register(self, name: str, static: str, volatile: str = "") -> PromptTemplate:
+        static = textwrap.dedent(static).strip()
+        volatile = textwrap.dedent(volatile).strip()
+        fields = tuple(
+            field_name for _, field_name, _, _ in string.Formatter().parse(volatile) if field_name
+        )
+        template = PromptTemplate(
+            name=name,
+            static=static,
+            volatile=volatile,
+            fields=fields,
+            prefix_hash=hashlib.blake2b(static.encode("utf-8"), digest_size=8).hexdigest(),
+        )
+        self._templates[name] = template
+        return template
+
+    def get(self, name: str) -> PromptTemplate:
+        return self._templates[name]
+
+    def list(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {"prefix_hash": template.prefix_hash, "prefix_chars": len(template.static), "fields": list(template.fields)}
+            for name, template in self._templates.items()
+        }
+
+
+def record_usage(route: str, usage: Any, metadata: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Record prompt and cached token counts from an OpenAI `usage` object
+
+    Args:
+        route: Label the counts are aggregated under (e.g. "chat", "devops")
+        usage: `response.usage`, or the usage of the final stream chunk; may be None
+        metadata: Optional dict that receives `cached_tokens`
+    """
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    record_prompt_cache(route, prompt_tokens, cached_tokens)
+    if metadata is not None:
+        metadata["cached_tokens"] = cached_tokens
+
+
+# Singleton instance
+prompt_registry = PromptRegistry()
+
+prompt_registry.register(
+    "assistant",
+    """
+    You are OmniDev AI Assistant, a powerful and knowledgeable AI powered by OpenAI GPT-5 Mini.
+
+    You help users with:
+    - Technical questions and coding assistance
+    - Cloud computing concepts (AWS, GCP, Azure)
+    - DevOps practices and tools
+    - Web scraping and browser automation
+    - General knowledge and research
+    - Image analysis and vision tasks
+
+    Be concise, accurate, and friendly. Format responses with markdown when helpful.
+    If you don't know something, say so honestly.
+    """,
+)
+
+prompt_registry.register(
+    "devops",
+    """
+    You are OmniDev DevOps Agent, an AI-powered cloud infrastructure assistant.
+
+    Your capabilities:
+    1. **EC2 Management**: List, launch, stop, start, terminate instances
+    2. **S3 Operations**: List buckets, manage objects
+    3. **Cost Analysis**: Estimate costs, find savings
+    4. **Security**: Check for vulnerabilities, audit permissions
+    5. **Troubleshooting**: Diagnose issues, suggest fixes
+
+    When the user asks you to perform an action:
+    1. Understand their intent
+    2. Use the available tools to execute the action
+    3. Provide clear, formatted results
+
+    Available AWS operations you can request:
+    - list_ec2_instances: Get all EC2 instances
+    - describe_ec2_instance(instance_id): Get details of specific instance
+    - launch_ec2_instance(ami_id, instance_type): Launch new instance
+    - stop_ec2_instance(instance_id): Stop an instance
+    - start_ec2_instance(instance_id): Start a stopped instance
+    - terminate_ec2_instance(instance_id): Terminate an instance
+    - list_s3_buckets: Get all S3 buckets
+    - list_s3_objects(bucket_name): List objects in a bucket
+    - get_cost_estimate: Get current month's estimated costs
+
+    Format your responses nicely with markdown. Use tables, bullet points, and code blocks when appropriate.
+    If credentials aren't configured, explain how to set them up.
+    Always confirm destructive actions before executing.
+
+    Each request gives you the current AWS context followed by the user's request. Based on both:
+    1. Explain what you understand they want
+    2. List any actions you would take
+    3. Provide the results or explain what steps are needed
+    """,
+    """
+    Current AWS Context:
+    {context}
+
+    User request: {request}
+    """,
+)
+
+prompt_registry.register(
+    "vision.analyze",
+    "Describe this image in detail. Include objects, colors, setting, and any text visible.",
+)
+
+prompt_registry.register(
+    "vision.describe",
+    """
+    Provide a comprehensive description of this image including:
+    1. Main subjects and objects
+    2. Colors and visual style
+    3. Setting and context
+    4. Any text visible
+    5. Overall mood or tone
+    """,
+)
+
+prompt_registry.register(
+    "vision.extract_text",
+    "Extract and transcribe ALL text visible in this image. "
+    "Format the text clearly, preserving structure where possible. "
+    "If no text is visible, say 'No text detected'.",
+)
+
+prompt_registry.register(
+    "vision.identify_objects",
+    """
+    Identify all objects in this image. Return as a JSON-formatted list with:
+    - object: name of the object
+    - confidence: high/medium/low
+    - location: general position (top-left, center, etc.)
+    """,
+)
+
+prompt_registry.register(
+    "vision.analyze_all",
+    """
+    Analyze this image and answer in JSON matching the response schema.
+    Fill in only the fields the schema contains:
+    - description: a comprehensive description covering main subjects and objects,
+      colors and visual style, setting and context, any visible text, and overall mood or tone
+    - text: ALL text visible in the image, transcribed with its structure preserved,
+      or an empty string if there is none
+    - objects: every object in the image with its name, a confidence of high/medium/low
+      and a general position (top-left, center, etc.)
+    """,
+)
@@ -0,0 +1,91 @@
+"""
+OmniDev - Page Readiness
+Decides when a loading page is ready to extract: DOM quiescence or the legacy networkidle wait
+"""
+
+from typing import Any, Optional, Tuple
+
+from app.config import get_settings
+from app.services.request_context import remaining_time
+
+settings = get_settings()
+
+WAIT_STRATEGIES = ("dom_stable", "networkidle")
+
+# Resolves once no DOM mutation has happened for quietMs, or at capMs regardless
+DOM_QUIET_SCRIPT = """
+([quietMs, capMs]) => new Promise((resolve) => {
+    let quietTimer = null;
+    let capTimer = null;
+    const observer = new MutationObserver(() => {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(() => done("quiet"), quietMs);
+    });
+    const done = (reason) => {
+        observer.disconnect();
+        clearTimeout(quietTimer);
+        clearTimeout(capTimer);
+        resolve(reason);
+    };
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    quietTimer = setTimeout(() => done("quiet"), quietMs);
+    capTimer = setTimeout(() => done("cap"), capMs);
+})
+"""
+
+
+def _timeout_ms(seconds: float) -> int:
+    # Never wait past the request deadline; 0 would mean no timeout to Playwright
+    return max(1, int(remaining_time(seconds) * 1000))
+
+
+async def load_page(
+    page: Any,
+    url: str,
+    strategy: Optional[str] = None,
+    wait_for_selector: Optional[str] = None,
+    wait_time_ms: int = 2000,
+    quiet_ms: Optional[int] = None,
+) -> Tuple[str, Any]:
+    """
+    Navigate to `url` and wait until the page is ready to extract
+
+    `dom_stable` returns at DOMContentLoaded plus either the selector appearing or
+    `quiet_ms` without DOM mutations, never later than the readiness cap.
+    `networkidle` is the previous behavior: wait for network idle, then for the
+    selector or a fixed `wait_time_ms`.
+
+    Args:
+        page: Playwright page
+        url: URL to load
+        strategy: "dom_stable" or "networkidle"; defaults to the configured strategy
+        wait_for_selector: CSS selector that marks the page as ready
+        wait_time_ms: Fixed settle time for `networkidle` without a selector
+        quiet_ms: DOM quiet period for `dom_stable`
+
+    Returns:
+        (what ended the wait: "selector", "quiet", "cap", "navigated" or "networkidle",
+        the main document's Playwright response or None)
+    """
+    strategy = strategy or settings.scraper_wait_strategy
+    cap_seconds = settings.scraper_readiness_cap_ms / 1000
+
+    if strategy == "networkidle":
+        response = await page.goto(url, wait_until="networkidle", timeout=_timeout_ms(30.0))
+        if wait_for_selector:
+            await page.wait_for_selector(wait_for_selector, timeout=_timeout_ms(10.0))
+            return "selector", response
+        await page.wait_for_timeout(wait_time_ms)
+        return "networkidle", response
+
+    response = await page.goto(url, wait_until="domcontentloaded", timeout=_timeout_ms(30.0))
+    if wait_for_selector:
+        await page.wait_for_selector(wait_for_selector, timeout=_timeout_ms(cap_seconds))
+        return "selector", response
+    quiet_ms = quiet_ms if quiet_ms is not None else settings.scraper_dom_quiet_ms
+    try:
+        return await page.evaluate(DOM_QUIET_SCRIPT, [quiet_ms, _timeout_ms(cap_seconds)]), response
+    except Exception:
+        # A client-side redirect replaced the document mid-wait; settle on the new one
+        await page.wait_for_load_state("domcontentloaded", timeout=_timeout_ms(cap_seconds))
+        return "navigated", response
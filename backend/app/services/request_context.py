@@ -0,0 +1,23 @@
+"""
+OmniDev - Request Context
+Context variables carrying per-request state into services
+"""
+
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+# Authenticated user for the current HTTP request or WebSocket connection
+current_user_id: ContextVar[Optional[str]] = ContextVar("current_user_id", default=None)
+
+# time.monotonic() value by which the current request must finish
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def remaining_time(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left before the request deadline, capped by `default` when both are set"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return default
+    remaining = max(0.0, deadline - time.monotonic())
+    return remaining if default is None else min(default, remaining)
@@ -0,0 +1,117 @@
+"""
+OmniDev - Scraper Resource Policy
+Blocks heavy and tracking requests during page loads via Playwright routing
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, FrozenSet, Iterable, Optional
+from urllib.parse import urlparse
+
+from app.config import get_settings
+
+settings = get_settings()
+
+# Playwright resource types that never affect extracted text
+VISUAL_TYPES = frozenset({"image", "media", "font", "stylesheet"})
+
+# Typical transfer sizes, used to estimate what blocking saved (the body is never downloaded)
+TYPICAL_BYTES = {
+    "image": 40_000,
+    "media": 500_000,
+    "font": 30_000,
+    "stylesheet": 20_000,
+    "script": 25_000,
+}
+DEFAULT_TYPICAL_BYTES = 5_000
+
+
+def _split(values: Optional[str]) -> FrozenSet[str]:
+    return frozenset(v.strip().lower() for v in (values or "").split(",") if v.strip())
+
+
+@dataclass(frozen=True)
+class ResourcePolicy:
+    """Which requests a page load may skip"""
+    block_types: FrozenSet[str] = frozenset()
+    block_domains: FrozenSet[str] = frozenset()
+
+    @classmethod
+    def default(cls) -> "ResourcePolicy":
+        return cls(_split(settings.scraper_block_resources), _split(settings.scraper_block_domains))
+
+    @classmethod
+    def resolve(
+        cls,
+        block_resources: Optional[Iterable[str]] = None,
+        block_domains: Optional[Iterable[str]] = None,
+        capture_screenshot: bool = False,
+    ) -> "ResourcePolicy":
+        """
+        Policy for one scrape
+
+        Args:
+            block_resources: Resource types to block instead of the default (empty blocks none)
+            block_domains: Hosts to block in addition to the default ad/tracker list
+            capture_screenshot: Let visual resources through so the screenshot renders
+
+        Returns:
+            The effective ResourcePolicy
+        """
+        default = cls.default()
+        types = default.block_types if block_resources is None else frozenset(t.lower() for t in block_resources)
+        domains = default.block_domains | frozenset(d.strip().lower() for d in block_domains or () if d.strip())
+        if capture_screenshot and settings.scraper_allow_images_for_screenshots:
+            types -= VISUAL_TYPES
+        return cls(types, domains)
+
+    def blocks_host(self, host: str) -> bool:
+        host = host.lower()
+        return any(host == domain or host.endswith("." + domain) for domain in self.block_domains)
+
+    def blocks(self, resource_type: str, url: str) -> bool:
+        if resource_type in self.block_types:
+            return True
+        return bool(self.block_domains) and self.blocks_host(urlparse(url).hostname or "")
+
+    @property
+    def active(self) -> bool:
+        return bool(self.block_types or self.block_domains)
+
+
+@dataclass
+class BlockStats:
+    """Requests a page load skipped and the bytes that probably saved"""
+    blocked: int = 0
+    bytes_saved: int = 0
+    by_type: dict = field(default_factory=dict)
+
+    def record(self, resource_type: str) -> None:
+        self.blocked += 1
+        self.bytes_saved += TYPICAL_BYTES.get(resource_type, DEFAULT_TYPICAL_BYTES)
+        self.by_type[resource_type] = self.by_type.get(resource_type, 0) + 1
+
+
+async def apply_resource_policy(page: Any, policy: ResourcePolicy) -> BlockStats:
+    """
+    Route every request of `page` through `policy`
+
+    The route stays installed until the page's routes are cleared (the browser
+    pool does this between leases).
+
+    Returns:
+        BlockStats that fill in as the page loads
+    """
+    stats = BlockStats()
+    if not policy.active:
+        return stats
+
+    async def handle(route):
+        request = route.request
+        if policy.blocks(request.resource_type, request.url):
+            stats.record(request.resource_type)
+            await route.abort("blockedbyclient")
+        else:
+            await route.continue_()
+
+    await page.route("**/*", handle)
+    return stats
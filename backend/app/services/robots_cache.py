@@ -0,0 +1,222 @@
+"""
+OmniDev - robots.txt Cache
+Per-host robots.txt rules fetched asynchronously, cached with LRU + TTL and Crawl-delay pacing
+"""
+
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+from urllib import robotparser
+from urllib.parse import urlparse
+
+import httpx
+
+from app.config import get_settings
+from app.services.request_context import remaining_time
+
+settings = get_settings()
+
+# RFC 9309 asks crawlers to parse at least 500 KiB; anything past that is ignored
+MAX_ROBOTS_BYTES = 512 * 1024
+
+_MAX_AGE = re.compile(r"max-age\s*=\s*(\d+)", re.IGNORECASE)
+
+
+@dataclass
+class RobotsRules:
+    """Parsed robots.txt of one host, or a stand-in when it could not be fetched"""
+    parser: robotparser.RobotFileParser
+    expires_at: float
+    status: str  # "ok", "missing", "forbidden" or "error"
+
+    def can_fetch(self, url: str, user_agent: str = "*") -> bool:
+        return self.parser.can_fetch(user_agent, url)
+
+    def crawl_delay(self, user_agent: str = "*") -> Optional[float]:
+        delay = self.parser.crawl_delay(user_agent)
+        return float(delay) if delay is not None else None
+
+
+def robots_key(url: str) -> Optional[str]:
+    """Cache key (scheme://host[:port]) of the site serving `url`"""
+    parsed = urlparse(url)
+    if not parsed.scheme or not parsed.netloc:
+        return None
+    return f"{parsed.scheme.lower()}://{parsed.netloc.lower()}"
+
+
+def cache_ttl(headers: httpx.Headers, default: float, minimum: float, maximum: float) -> float:
+    """Lifetime from Cache-Control max-age or Expires, clamped to [minimum, maximum]"""
+    cache_control = headers.get("cache-control", "")
+    ttl: Optional[float] = None
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        ttl = 0.0
+    elif match := _MAX_AGE.search(cache_control):
+        ttl = float(match.group(1))
+    elif expires := headers.get("expires"):
+        try:
+            ttl = parsedate_to_datetime(expires).timestamp() - time.time()
+        except (TypeError, ValueError):
+            ttl = 0.0
+    return min(maximum, max(minimum, default if ttl is None else ttl))
+
+
+class RobotsCache:
+    """
+    LRU + TTL cache of robots.txt rules keyed by scheme and host.
+
+    Concurrent lookups for a host that is not cached share a single fetch.
+    Failed fetches are cached for a short time so an unreachable site is not
+    asked again on every scrape. Rules follow the stdlib parser: a missing
+    robots.txt (4xx) allows everything, 401/403 and 5xx disallow everything,
+    and a network error allows everything, as before.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        client: Optional[httpx.AsyncClient] = None,
+    ):
+        self.max_entries = max_entries or settings.scraper_robots_cache_max_entries
+        self.default_ttl = settings.scraper_robots_default_ttl_seconds
+        self.min_ttl = settings.scraper_robots_min_ttl_seconds
+        self.max_ttl = settings.scraper_robots_max_ttl_seconds
+        self.error_ttl = settings.scraper_robots_error_ttl_seconds
+        self.max_crawl_delay = settings.scraper_max_crawl_delay_seconds
+        self._client = client
+        self._entries: "OrderedDict[str, RobotsRules]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._next_slot: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.fetch_errors = 0
+        self.evictions = 0
+        self.delayed = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=settings.scraper_robots_fetch_timeout_seconds,
+                follow_redirects=True,
+                headers={"User-Agent": "OmniDevBot/1.0 (+robots.txt)"},
+            )
+        return self._client
+
+    async def get(self, url: str) -> Optional[RobotsRules]:
+        """Rules for the host serving `url`, fetching them at most once per TTL"""
+        key = robots_key(url)
+        if key is None:
+            return None
+        rules = self._entries.get(key)
+        if rules is not None and rules.expires_at > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return rules
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.ensure_future(self._fetch(key))
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so a cancelled caller does not abort the fetch other callers share
+        return await asyncio.shield(future)
+
+    async def _fetch(self, key: str) -> RobotsRules:
+        parser = robotparser.RobotFileParser(f"{key}/robots.txt")
+        try:
+            response = await self._get_client().get(f"{key}/robots.txt")
+        except Exception:
+            # Network failures, but also hosts httpx cannot even build a request for
+            # (invalid IDNA labels, control characters) - the page fetch reports those
+            self.fetch_errors += 1
+            parser.allow_all = True
+            return self._store(key, RobotsRules(parser, time.monotonic() + self.error_ttl, "error"))
+
+        if response.status_code >= 500:
+            self.fetch_errors += 1
+            parser.disallow_all = True
+            return self._store(key, RobotsRules(parser, time.monotonic() + self.error_ttl, "error"))
+
+        if response.status_code in (401, 403):
+            parser.disallow_all = True
+            status = "forbidden"
+        elif response.status_code >= 400:
+            parser.allow_all = True
+            status = "missing"
+        else:
+            body = response.content[:MAX_ROBOTS_BYTES].decode("utf-8", errors="ignore")
+            parser.parse(body.splitlines())
+            status = "ok"
+        ttl = cache_ttl(response.headers, self.default_ttl, self.min_ttl, self.max_ttl)
+        return self._store(key, RobotsRules(parser, time.monotonic() + ttl, status))
+
+    def _store(self, key: str, rules: RobotsRules) -> RobotsRules:
+        self._entries[key] = rules
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return rules
+
+    async def can_fetch(self, url: str, user_agent: str = "*") -> bool:
+        rules = await self.get(url)
+        return rules is None or rules.can_fetch(url, user_agent)
+
+    async def wait_for_crawl_delay(self, url: str, user_agent: str = "*") -> float:
+        """
+        Space out requests to one host by its Crawl-delay
+
+        Each caller reserves the next free slot for the host, so concurrent
+        scrapes queue up instead of all firing at once. The wait is capped by
+        the configured maximum and the request deadline.
+
+        Returns:
+            Seconds waited
+        """
+        key = robots_key(url)
+        rules = self._entries.get(key) if key else None
+        delay = rules.crawl_delay(user_agent) if rules else None
+        if not delay:
+            return 0.0
+        delay = min(delay, self.max_crawl_delay)
+        now = time.monotonic()
+        if len(self._next_slot) > self.max_entries:
+            self._next_slot = {host: at for host, at in self._next_slot.items() if at > now}
+        slot = max(now, self._next_slot.get(key, 0.0))
+        self._next_slot[key] = slot + delay
+        wait = remaining_time(slot - now)
+        if wait > 0:
+            self.delayed += 1
+            await asyncio.sleep(wait)
+        return max(0.0, wait)
+
+    async def close(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hosts": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            "fetch_errors": self.fetch_errors,
+            "evictions": self.evictions,
+            "delayed": self.delayed,
+        }
+
+
+# Singleton instance
+robots_cache = RobotsCache()
@@ -5,13 +5,20 @@ Provides browser automation with Playwright for web scraping
 
 import asyncio
 import base64
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, List
 from urllib.parse import urlparse
-from urllib import robotparser
 from bs4 import BeautifulSoup
 from dataclasses import dataclass
 
 from app.config import get_settings
+from app.services.admission import AdmissionRejected
+from app.services.browser_pool import BrowserPool
+from app.services.http_engine import ENGINES, http_engine
+from app.services.page_cache import page_cache
+from app.services.readiness import WAIT_STRATEGIES, load_page
+from app.services.resource_policy import ResourcePolicy, apply_resource_policy
+from app.services.robots_cache import robots_cache
 
 settings = get_settings()
 
@@ -27,35 +34,57 @@ class ScrapeResult:
     error: Optional[str] = None
     engine: str = "playwright"
     load_time_ms: int = 0
+    blocked_requests: int = 0
+    bytes_saved: int = 0  # Estimated from typical sizes of the blocked resource types
+    ready_reason: Optional[str] = None  # What ended the readiness wait (browser engine only)
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    cache_status: Optional[str] = None  # "hit", "revalidated" or "miss" when the page cache was consulted
+    final_url: Optional[str] = None  # Where the page ended up after redirects; base for its relative links
 
 
 class ScraperService:
-    """Web scraping service with Playwright support"""
+    """Web scraping service with an HTTP engine and Playwright support"""
     
     def __init__(self):
         self._playwright = None
         self._browser = None
+        # Concurrent first requests must share one Chromium launch
+        self._init_lock = asyncio.Lock()
+        self.pool = BrowserPool(self._init_playwright)
     
     async def _init_playwright(self):
         """Initialize Playwright browser"""
-        if self._playwright is None:
-            try:
-                from playwright.async_api import async_playwright
-                self._playwright = await async_playwright().start()
-                self._browser = await self._playwright.chromium.launch(
-                    headless=True,
-                    args=[
-                        '--disable-blink-features=AutomationControlled',
-                        '--disable-dev-shm-usage',
-                        '--no-sandbox',
-                        '--disable-setuid-sandbox',
-                        '--disable-gpu',
-                    ]
-                )
-            except Exception as e:
-                raise RuntimeError(f"Failed to initialize Playwright: {e}")
+        if self._browser is not None:
+            return self._browser
+        async with self._init_lock:
+            if self._browser is None:
+                try:
+                    self._playwright, self._browser = await self._launch_browser()
+                except Exception as e:
+                    raise RuntimeError(f"Failed to initialize Playwright: {e}")
         return self._browser
     
+    async def _launch_browser(self):
+        """Start Playwright and launch headless Chromium"""
+        from playwright.async_api import async_playwright
+        playwright = await async_playwright().start()
+        try:
+            browser = await playwright.chromium.launch(
+                headless=True,
+                args=[
+                    '--disable-blink-features=AutomationControlled',
+                    '--disable-dev-shm-usage',
+                    '--no-sandbox',
+                    '--disable-setuid-sandbox',
+                    '--disable-gpu',
+                ]
+            )
+        except BaseException:
+            await playwright.stop()
+            raise
+        return playwright, browser
+    
     async def scrape(
         self,
         url: str,
@@ -63,23 +92,58 @@ class ScraperService:
         wait_time_ms: int = 2000,
         capture_screenshot: bool = False,
         extract_selector: Optional[str] = None,
+        block_resources: Optional[List[str]] = None,
+        block_domains: Optional[List[str]] = None,
+        engine: Optional[str] = None,
+        wait_strategy: Optional[str] = None,
+        quiet_ms: Optional[int] = None,
+        max_age: Optional[int] = None,
     ) -> ScrapeResult:
         """
-        Scrape a URL using Playwright
+        Scrape a URL over plain HTTP or with Playwright
         
         Args:
             url: URL to scrape
             wait_for_selector: CSS selector to wait for before scraping
-            wait_time_ms: Time to wait for page load in milliseconds
+            wait_time_ms: Fixed settle time after network idle (networkidle strategy only)
             capture_screenshot: Whether to capture a screenshot
             extract_selector: CSS selector to extract specific content
+            block_resources: Resource types to block instead of the configured default
+            block_domains: Hosts to block on top of the configured ad/tracker list
+            engine: "http", "browser" or "auto" (HTTP first, Playwright for JS-rendered
+                pages); defaults to the configured engine
+            wait_strategy: "dom_stable" (DOM quiet for `quiet_ms` or the selector appears)
+                or "networkidle" (the previous behavior); defaults to the configured strategy
+            quiet_ms: DOM quiet period for the dom_stable strategy
+            max_age: Seconds a cached copy may be served without revalidation
+                (default: the configured cache TTL, 0 always revalidates)
             
         Returns:
             ScrapeResult with scraped data
         """
-        import time
+        engine = engine or settings.scraper_default_engine
         parsed = urlparse(url)
         domain = parsed.netloc.lower()
+        if engine not in ENGINES:
+            return ScrapeResult(
+                success=False,
+                url=url,
+                title="",
+                html="",
+                text="",
+                error=f"Invalid engine. Allowed: {', '.join(ENGINES)}",
+                engine="playwright",
+            )
+        if wait_strategy is not None and wait_strategy not in WAIT_STRATEGIES:
+            return ScrapeResult(
+                success=False,
+                url=url,
+                title="",
+                html="",
+                text="",
+                error=f"Invalid wait_strategy. Allowed: {', '.join(WAIT_STRATEGIES)}",
+                engine="playwright",
+            )
         if not domain:
             return ScrapeResult(
                 success=False,
@@ -115,91 +179,144 @@ class ScraperService:
                     engine="playwright",
                 )
         if settings.scraper_respect_robots:
-            robots_url = f"{parsed.scheme}://{domain}/robots.txt"
-            rp = robotparser.RobotFileParser()
-            rp.set_url(robots_url)
-            try:
-                await asyncio.to_thread(rp.read)
-                if not rp.can_fetch("*", url):
+            if not await robots_cache.can_fetch(url):
+                return ScrapeResult(
+                    success=False,
+                    url=url,
+                    title="",
+                    html="",
+                    text="",
+                    error="Blocked by robots.txt",
+                    engine="playwright",
+                )
+        if engine == "http" and (capture_screenshot or wait_for_selector):
+            return ScrapeResult(
+                success=False,
+                url=url,
+                title="",
+                html="",
+                text="",
+                error="Screenshots and wait_for_selector need the browser engine",
+                engine="http",
+            )
+        start_time = time.time()
+        
+        policy = ResourcePolicy.resolve(block_resources, block_domains, capture_screenshot)
+        
+        # Screenshots are not cached; everything else is keyed by URL and every
+        # option that changes the extracted content, with defaults resolved
+        cache_key = None
+        if page_cache.enabled and not capture_screenshot:
+            cache_key = page_cache.key_for(url, {
+                "extract_selector": extract_selector,
+                "wait_for_selector": wait_for_selector,
+                "engine": engine,
+                "block_resources": sorted(policy.block_types),
+                "block_domains": sorted(policy.block_domains),
+                "wait_strategy": wait_strategy or settings.scraper_wait_strategy,
+                "quiet_ms": quiet_ms if quiet_ms is not None else settings.scraper_dom_quiet_ms,
+                "wait_time_ms": wait_time_ms,
+            })
+        if cache_key:
+            cached = await page_cache.get(cache_key, max_age)
+            if cached is not None:
+                entry, body, fresh = cached
+                status = "hit" if fresh else None
+                if not fresh and entry.revalidatable:
+                    if await http_engine.revalidate(url, entry.etag, entry.last_modified):
+                        await page_cache.mark_revalidated(entry)
+                        status = "revalidated"
+                if status:
                     return ScrapeResult(
-                        success=False,
+                        success=True,
                         url=url,
-                        title="",
-                        html="",
-                        text="",
-                        error="Blocked by robots.txt",
-                        engine="playwright",
+                        title=entry.title,
+                        html=body["html"],
+                        text=body["text"],
+                        engine=entry.engine,
+                        load_time_ms=int((time.time() - start_time) * 1000),
+                        etag=entry.etag,
+                        last_modified=entry.last_modified,
+                        cache_status=status,
+                        final_url=entry.url,
                     )
-            except Exception:
-                pass
-        start_time = time.time()
         
-        try:
-            browser = await self._init_playwright()
-            
-            # Create context with stealth settings
-            context = await browser.new_context(
-                viewport={'width': 1920, 'height': 1080},
-                user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                java_script_enabled=True,
-            )
-            
-            # Add stealth scripts
-            await context.add_init_script("""
-                Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-                Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4, 5]});
-                Object.defineProperty(navigator, 'languages', {get: () => ['en-US', 'en']});
-                window.chrome = {runtime: {}};
-            """)
-            
-            page = await context.new_page()
-            
-            # Navigate to URL
-            await page.goto(url, wait_until='networkidle', timeout=30000)
-            
-            # Wait for specific selector if provided
-            if wait_for_selector:
-                await page.wait_for_selector(wait_for_selector, timeout=10000)
-            else:
-                await page.wait_for_timeout(wait_time_ms)
-            
-            # Get page content
-            title = await page.title()
-            
-            if extract_selector:
-                element = await page.query_selector(extract_selector)
-                if element:
-                    html = await element.inner_html()
-                else:
-                    html = await page.content()
-            else:
-                html = await page.content()
-            
-            # Parse with BeautifulSoup
-            soup = BeautifulSoup(html, 'lxml')
-            text = soup.get_text(separator='\n', strip=True)
-            
-            # Capture screenshot if requested
-            screenshot_b64 = None
-            if capture_screenshot:
-                screenshot_bytes = await page.screenshot(full_page=False)
-                screenshot_b64 = base64.b64encode(screenshot_bytes).decode('utf-8')
-            
-            await context.close()
-            
-            load_time = int((time.time() - start_time) * 1000)
-            
-            return ScrapeResult(
-                success=True,
-                url=url,
-                title=title,
-                html=html,
-                text=text,
-                screenshot=screenshot_b64,
-                engine="playwright",
-                load_time_ms=load_time,
+        if settings.scraper_respect_robots:
+            await robots_cache.wait_for_crawl_delay(url)
+        result = await self._scrape_uncached(
+            url,
+            domain,
+            engine,
+            start_time,
+            wait_for_selector,
+            wait_time_ms,
+            capture_screenshot,
+            extract_selector,
+            policy,
+            wait_strategy,
+            quiet_ms,
+        )
+        if cache_key and result.success:
+            await page_cache.put(
+                cache_key,
+                result.final_url or url,
+                result.title,
+                result.html,
+                result.text,
+                result.engine,
+                result.etag,
+                result.last_modified,
             )
-            
+            result.cache_status = "miss"
+        return result
+    
+    async def _scrape_uncached(
+        self,
+        url: str,
+        domain: str,
+        engine: str,
+        start_time: float,
+        wait_for_selector: Optional[str],
+        wait_time_ms: int,
+        capture_screenshot: bool,
+        extract_selector: Optional[str],
+        policy: ResourcePolicy,
+        wait_strategy: Optional[str],
+        quiet_ms: Optional[int],
+    ) -> ScrapeResult:
+        """Fetch `url` with the chosen engine, escalating `auto` scrapes to Playwright"""
+        # Pages that need rendering anyway, and domains that needed it before, skip the HTTP attempt
+        try_http = engine == "http" or (
+            engine == "auto"
+            and not (capture_screenshot or wait_for_selector)
+            and http_engine.memory.get(domain) != "browser"
+        )
+        if try_http:
+            fields, reason = await http_engine.fetch(url, extract_selector)
+            if engine == "http" or reason is None:
+                if engine == "auto":
+                    http_engine.memory.remember(domain, "http")
+                return ScrapeResult(**fields)
+            http_engine.escalations += 1
+            http_engine.memory.remember(domain, "browser")
+        
+        try:
+            # A warm page from the pool: no context setup or init-script injection per scrape
+            async with self.pool.lease() as page:
+                return await self._scrape_page(
+                    page,
+                    url,
+                    start_time,
+                    wait_for_selector,
+                    wait_time_ms,
+                    capture_screenshot,
+                    extract_selector,
+                    policy,
+                    wait_strategy,
+                    quiet_ms,
+                )
+        except AdmissionRejected:
+            raise
         except Exception as e:
             return ScrapeResult(
                 success=False,
@@ -211,12 +328,76 @@ class ScraperService:
                 engine="playwright",
             )
     
+    async def _scrape_page(
+        self,
+        page,
+        url: str,
+        start_time: float,
+        wait_for_selector: Optional[str],
+        wait_time_ms: int,
+        capture_screenshot: bool,
+        extract_selector: Optional[str],
+        policy: ResourcePolicy,
+        wait_strategy: Optional[str] = None,
+        quiet_ms: Optional[int] = None,
+    ) -> ScrapeResult:
+        """Load `url` in a leased page and extract its content"""
+        blocked = await apply_resource_policy(page, policy)
+        
+        # Navigate and wait until the page is ready (DOM quiet, selector or network idle)
+        ready_reason, response = await load_page(page, url, wait_strategy, wait_for_selector, wait_time_ms, quiet_ms)
+        
+        # Get page content
+        title = await page.title()
+        
+        if extract_selector:
+            element = await page.query_selector(extract_selector)
+            if element:
+                html = await element.inner_html()
+            else:
+                html = await page.content()
+        else:
+            html = await page.content()
+        
+        # Parse with BeautifulSoup
+        soup = BeautifulSoup(html, 'lxml')
+        text = soup.get_text(separator='\n', strip=True)
+        
+        # Capture screenshot if requested
+        screenshot_b64 = None
+        if capture_screenshot:
+            screenshot_bytes = await page.screenshot(full_page=False)
+            screenshot_b64 = base64.b64encode(screenshot_bytes).decode('utf-8')
+        
+        load_time = int((time.time() - start_time) * 1000)
+        headers = response.headers if response is not None else {}
+        
+        return ScrapeResult(
+            success=True,
+            url=url,
+            title=title,
+            html=html,
+            text=text,
+            screenshot=screenshot_b64,
+            engine="playwright",
+            load_time_ms=load_time,
+            blocked_requests=blocked.blocked,
+            bytes_saved=blocked.bytes_saved,
+            ready_reason=ready_reason,
+            etag=headers.get("etag"),
+            last_modified=headers.get("last-modified"),
+            final_url=page.url or url,
+        )
+    
     async def take_screenshot(self, url: str) -> ScrapeResult:
         """Take a screenshot of a URL"""
         return await self.scrape(url=url, capture_screenshot=True)
     
     async def cleanup(self):
         """Cleanup browser resources"""
+        await self.pool.close()
+        await robots_cache.close()
+        await http_engine.close()
         if self._browser:
             await self._browser.close()
             self._browser = None
@@ -238,7 +419,11 @@ class ScraperService:
             "playwright": {
                 "available": playwright_available,
                 "browser_active": self._browser is not None,
-            }
+            },
+            "pool": self.pool.get_stats(),
+            "robots": robots_cache.get_stats(),
+            "http_engine": http_engine.get_stats(),
+            "page_cache": page_cache.get_stats(),
         }
 
 
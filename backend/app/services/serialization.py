@@ -0,0 +1,39 @@
+"""
+OmniDev - JSON Serialization
+Fast JSON encoding for API responses, NDJSON lines and WebSocket frames
+"""
+
+import json
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+
+
+def dumps_bytes(content: Any) -> bytes:
+    """
+    Encode content as compact UTF-8 JSON
+
+    Types the encoder does not know natively (Pydantic models, dataclasses on
+    the stdlib path, Decimal, ...) are passed through FastAPI's jsonable_encoder.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=jsonable_encoder, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(content: Any) -> str:
+    """Encode content as a compact JSON string, e.g. for a WebSocket text frame"""
+    return dumps_bytes(content).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
@@ -0,0 +1,243 @@
+"""
+OmniDev - Conversation Session Store
+Keeps chat history server-side so clients only send the newest message
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import get_settings
+
+settings = get_settings()
+
+# Turns are stored as (role flag, content) tuples instead of dicts
+_ROLE_FLAGS = {"user": 0, "assistant": 1}
+_ROLE_NAMES = ("user", "assistant")
+
+
+@dataclass
+class ConversationSession:
+    """An append-only conversation owned by a single user"""
+    session_id: str
+    user_id: str
+    turns: List[Tuple[int, str]] = field(default_factory=list)
+    size_bytes: int = 0
+    created_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    deleted: bool = False
+
+    def history(self) -> List[Dict[str, str]]:
+        """Return the turns in the chat history format used by OpenAIService"""
+        return [{"role": _ROLE_NAMES[flag], "content": content} for flag, content in self.turns]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "turns": len(self.turns),
+            "size_bytes": self.size_bytes,
+            "created_at": self.created_at,
+            "last_used": self.last_used,
+        }
+
+
+class SQLiteSessionPersistence:
+    """Optional durable tier; evicted sessions are reloaded from here on demand"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_sessions ("
+                "session_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_turns ("
+                "session_id TEXT NOT NULL, seq INTEGER NOT NULL, role INTEGER NOT NULL, "
+                "content TEXT NOT NULL, PRIMARY KEY (session_id, seq))"
+            )
+            self._conn.commit()
+
+    def create(self, session: ConversationSession) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO chat_sessions (session_id, user_id, created_at) VALUES (?, ?, ?)",
+                (session.session_id, session.user_id, session.created_at),
+            )
+            self._conn.commit()
+
+    def append(self, session_id: str, start_seq: int, turns: List[Tuple[int, str]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO chat_turns (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                [(session_id, start_seq + i, flag, content) for i, (flag, content) in enumerate(turns)],
+            )
+            self._conn.commit()
+
+    def exists(self, session_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM chat_sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+        return row is not None
+
+    def load(self, session_id: str) -> Optional[ConversationSession]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT user_id, created_at FROM chat_sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            turns = self._conn.execute(
+                "SELECT role, content FROM chat_turns WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            ).fetchall()
+        session = ConversationSession(session_id=session_id, user_id=row[0], created_at=row[1])
+        session.turns = [(flag, content) for flag, content in turns]
+        session.size_bytes = sum(len(content) for _, content in session.turns)
+        return session
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM chat_turns WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+
+class SessionStore:
+    """
+    In-memory LRU of conversation sessions with an idle timeout and a memory cap.
+
+    When a SQLite path is configured every turn is also written through to disk,
+    so sessions evicted from memory are restored transparently on the next access.
+    """
+
+    def __init__(
+        self,
+        max_sessions: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        idle_seconds: Optional[int] = None,
+        db_path: Optional[str] = None,
+    ):
+        self.max_sessions = max_sessions or settings.chat_session_max_sessions
+        self.max_bytes = max_bytes or settings.chat_session_max_bytes
+        self.idle_seconds = idle_seconds or settings.chat_session_idle_seconds
+        db_path = db_path if db_path is not None else settings.chat_session_db_path
+        self._persistence = SQLiteSessionPersistence(db_path) if db_path else None
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+        # One lock per session with appends or deletes in flight; dropped once none holds it
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    async def create(self, user_id: str) -> ConversationSession:
+        """Create an empty session for a user"""
+        session = ConversationSession(session_id=uuid.uuid4().hex, user_id=user_id)
+        if self._persistence:
+            await asyncio.to_thread(self._persistence.create, session)
+        self._insert(session)
+        return session
+
+    async def get(self, session_id: str, user_id: str) -> Optional[ConversationSession]:
+        """Return the session if it exists and belongs to the user"""
+        session = self._sessions.get(session_id)
+        if session is None and self._persistence:
+            session = await asyncio.to_thread(self._persistence.load, session_id)
+            if session is not None:
+                self._insert(session)
+        if session is None or session.user_id != user_id:
+            return None
+        session.last_used = time.time()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    async def append(self, session: ConversationSession, *turns: Tuple[str, str]) -> None:
+        """Append (role, content) turns to a session; a no-op once it has been deleted"""
+        compact = [(_ROLE_FLAGS.get(role, 1), content) for role, content in turns]
+        # Concurrent appends (e.g. multiplexed streams on one session) would
+        # otherwise read the same start seq before either write lands
+        async with self._lock_for(session.session_id):
+            # A reply that finishes after DELETE must not bring the session back
+            if session.deleted:
+                return
+            if self._persistence and session.session_id not in self._sessions:
+                # Evicted or deleted through another copy loaded from disk
+                if not await asyncio.to_thread(self._persistence.exists, session.session_id):
+                    return
+            if self._persistence:
+                await asyncio.to_thread(self._persistence.append, session.session_id, len(session.turns), compact)
+            added = sum(len(content) for _, content in compact)
+            session.turns.extend(compact)
+            session.size_bytes += added
+            session.last_used = time.time()
+            if session.session_id in self._sessions:
+                self._bytes += added
+                self._sessions.move_to_end(session.session_id)
+                self._evict()
+            else:
+                self._insert(session)
+
+    async def delete(self, session_id: str, user_id: str) -> bool:
+        """Delete a session owned by the user"""
+        session = await self.get(session_id, user_id)
+        if session is None:
+            return False
+        async with self._lock_for(session_id):
+            session.deleted = True
+            self._remove(session_id)
+            if self._persistence:
+                await asyncio.to_thread(self._persistence.delete, session_id)
+        return True
+
+    def _lock_for(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    def _insert(self, session: ConversationSession) -> None:
+        self._sessions[session.session_id] = session
+        self._bytes += session.size_bytes
+        self._evict()
+
+    def _remove(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.size_bytes
+
+    def _evict(self) -> None:
+        idle_cutoff = time.time() - self.idle_seconds
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            over_capacity = len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+            if not over_capacity and oldest.last_used >= idle_cutoff:
+                break
+            # Never evict the only (most recently used) session for size alone
+            if len(self._sessions) == 1 and oldest.last_used >= idle_cutoff:
+                break
+            self._remove(oldest_id)
+            self.evictions += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "persistent": self._persistence is not None,
+        }
+
+
+# Singleton instance
+session_store = SessionStore()
@@ -0,0 +1,211 @@
+"""
+OmniDev - Streaming Helpers
+Shared utilities for forwarding upstream token streams to HTTP and WebSocket clients
+"""
+
+import asyncio
+import contextlib
+import json
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional, TypeVar
+
+from app.services.serialization import dumps
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+def _start_pump(source: AsyncIterator[T]):
+    """Consume the source in a background task, delivering items through a queue"""
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for item in source:
+                queue.put_nowait(item)
+        except Exception as exc:
+            queue.put_nowait(_Failure(exc))
+        finally:
+            queue.put_nowait(_DONE)
+
+    return queue, asyncio.create_task(pump())
+
+
+async def _stop_pump(task: asyncio.Task, source: AsyncIterator[T]) -> None:
+    task.cancel()
+    with contextlib.suppress(BaseException):
+        await task
+    aclose = getattr(source, "aclose", None)
+    if aclose is not None:
+        with contextlib.suppress(Exception):
+            await aclose()
+
+
+async def stream_with_idle(
+    source: AsyncIterator[T],
+    idle_seconds: float,
+) -> AsyncGenerator[Optional[T], None]:
+    """
+    Re-yield items from an async iterator, yielding None after every idle period.
+
+    The source is consumed by a background task so waiting for the next item can
+    time out without cancelling the upstream read. Closing this generator cancels
+    that task and closes the source, which stops the upstream request.
+    """
+    queue, task = _start_pump(source)
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=idle_seconds)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+    finally:
+        await _stop_pump(task, source)
+
+
+async def coalesce_chunks(
+    source: AsyncIterator[str],
+    window_seconds: float,
+    max_bytes: int,
+    flush_first: bool = True,
+    stats: Optional[Dict[str, int]] = None,
+) -> AsyncGenerator[str, None]:
+    """
+    Batch small text chunks into fewer, larger ones.
+
+    Pending text is flushed when `window_seconds` have passed since the oldest
+    pending chunk arrived or once it reaches `max_bytes`. The first chunk is
+    flushed immediately by default so time-to-first-token is unchanged.
+    A window of 0 disables batching. If `stats` is given, its "chunks" and
+    "frames" counters are updated as the stream is consumed.
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("chunks", 0)
+    stats.setdefault("frames", 0)
+
+    if window_seconds <= 0:
+        try:
+            async for chunk in source:
+                stats["chunks"] += 1
+                stats["frames"] += 1
+                yield chunk
+        finally:
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        return
+
+    loop = asyncio.get_running_loop()
+    queue, task = _start_pump(source)
+    pending: List[str] = []
+    pending_bytes = 0
+    deadline = 0.0
+    first = flush_first
+    try:
+        while True:
+            timeout = max(0.0, deadline - loop.time()) if pending else None
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                stats["frames"] += 1
+                yield "".join(pending)
+                pending, pending_bytes = [], 0
+                continue
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.exc
+            stats["chunks"] += 1
+            if first:
+                first = False
+                stats["frames"] += 1
+                yield item
+                continue
+            if not pending:
+                deadline = loop.time() + window_seconds
+            pending.append(item)
+            pending_bytes += len(item.encode("utf-8"))
+            if pending_bytes >= max_bytes:
+                stats["frames"] += 1
+                yield "".join(pending)
+                pending, pending_bytes = [], 0
+        if pending:
+            stats["frames"] += 1
+            yield "".join(pending)
+    finally:
+        await _stop_pump(task, source)
+
+
+class JSONArrayItemParser:
+    """
+    Incremental parser that emits each object of a JSON array as soon as it closes.
+
+    Feed it text as it streams in; `feed` returns the objects completed by that
+    text. Any object nested directly inside an array counts, so a bare array, a
+    wrapper like `{"objects": [...]}` and Markdown code fences all work. Text
+    outside the JSON is ignored, and objects that fail to parse are skipped.
+    """
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._length = 0
+        self._stack: List[str] = []
+        self._starts: List[Optional[int]] = []
+        self._open_items = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> List[Any]:
+        items = []
+        for char in text:
+            position = self._length
+            self._buffer.append(char)
+            self._length += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = bool(self._stack)
+            elif char in "[{":
+                # Remember where outermost objects that sit directly inside an array begin
+                is_item = char == "{" and not self._open_items and bool(self._stack) and self._stack[-1] == "["
+                self._open_items += is_item
+                self._stack.append(char)
+                self._starts.append(position if is_item else None)
+            elif char in "]}" and self._stack:
+                self._stack.pop()
+                start = self._starts.pop()
+                if start is not None:
+                    self._open_items -= 1
+                    with contextlib.suppress(ValueError):
+                        items.append(json.loads("".join(self._buffer[start:])))
+                if not self._stack:
+                    self._buffer, self._length = [], 0
+        return items
+
+
+def format_sse(event: str, data: Any) -> str:
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {dumps(data)}\n\n"
+
+
+def sse_comment(text: str = "ping") -> str:
+    """Format an SSE comment line, used as a heartbeat that clients ignore"""
+    return f": {text}\n\n"
@@ -0,0 +1,280 @@
+"""
+OmniDev - Upstream Resilience
+Deadlines, jittered retries, hedged requests and a circuit breaker for OpenAI calls
+"""
+
+import asyncio
+import contextlib
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, TypeVar
+
+from app.config import get_settings
+from app.services.admission import admission_controller
+from app.services.request_context import remaining_time
+
+settings = get_settings()
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the upstream while the circuit breaker is open"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"OpenAI upstream is unavailable (circuit open), retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class UpstreamTimeout(Exception):
+    """Raised when a call does not finish before its deadline"""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Timeouts, connection errors, 429s and 5xx responses are worth retrying"""
+    if isinstance(exc, (asyncio.TimeoutError, UpstreamTimeout)):
+        return True
+    status_code = getattr(exc, "status_code", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    # openai.APIConnectionError / APITimeoutError carry no status code
+    return type(exc).__name__ in {"APIConnectionError", "APITimeoutError"}
+
+
+def _retry_after_hint(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures.
+    Open -> half-open after `reset_seconds`; a single probe call is let through
+    and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+
+    def allow(self) -> None:
+        if self.state == "closed":
+            return
+        elapsed = time.monotonic() - self.opened_at
+        if self.state == "open" and elapsed >= self.reset_seconds:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+        raise CircuitOpenError(max(1.0, self.reset_seconds - elapsed))
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+        self.state = "closed"
+
+    def release_probe(self) -> None:
+        """Let another probe through if this one was cancelled before finishing"""
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+        }
+
+
+class UpstreamPolicy:
+    """Runs upstream calls under a deadline with retries, optional hedging and a breaker"""
+
+    def __init__(self):
+        self.timeout = settings.openai_timeout_seconds
+        self.max_retries = settings.openai_max_retries
+        self.backoff_base = settings.openai_backoff_base_ms / 1000
+        self.backoff_max = settings.openai_backoff_max_ms / 1000
+        self.hedge_enabled = settings.openai_hedge_enabled
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.openai_breaker_failure_threshold,
+            reset_seconds=settings.openai_breaker_reset_seconds,
+        )
+        # Latency samples per call kind (e.g. model and stream/full); a stream
+        # returns at its response headers, a full completion after the last token
+        self._latencies: Dict[Hashable, Deque[float]] = {}
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def observe_latency(self, latency_key: Hashable, seconds: float) -> None:
+        samples = self._latencies.get(latency_key)
+        if samples is None:
+            samples = self._latencies[latency_key] = deque(maxlen=200)
+        samples.append(seconds)
+
+    def p95_latency(self, latency_key: Hashable = None) -> Optional[float]:
+        samples = self._latencies.get(latency_key, ())
+        # Need enough samples for the percentile to mean anything
+        if len(samples) < 20:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    async def call(
+        self,
+        factory: Callable[[], Awaitable[T]],
+        timeout: Optional[float] = None,
+        hedge: Optional[bool] = None,
+        discard: Optional[Callable[[T], Awaitable[Any]]] = None,
+        latency_key: Hashable = None,
+    ) -> T:
+        """
+        Call the upstream through the resilience policy
+
+        Args:
+            factory: Creates a fresh upstream awaitable for each attempt
+            timeout: Overall deadline in seconds across all attempts, further
+                capped by the request deadline when one is set
+            hedge: Send a second request if the first exceeds p95 latency
+            discard: Releases the result of a losing hedged attempt (e.g. closes a stream)
+            latency_key: Kind of call (e.g. model and whether it streams); hedging
+                compares against the p95 of earlier calls of the same kind
+
+        Returns:
+            The first successful result
+
+        Raises:
+            CircuitOpenError: While the breaker is open
+            UpstreamTimeout: If the deadline passes
+        """
+        self.breaker.allow()
+        deadline = time.monotonic() + remaining_time(timeout or self.timeout)
+        hedge = self.hedge_enabled if hedge is None else hedge
+        attempt = 0
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.breaker.record_failure()
+                raise UpstreamTimeout("OpenAI request exceeded its deadline")
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(
+                    self._attempt(factory, hedge, discard, latency_key),
+                    timeout=remaining,
+                )
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except Exception as exc:
+                if isinstance(exc, asyncio.TimeoutError):
+                    exc = UpstreamTimeout("OpenAI request exceeded its deadline")
+                admission_controller.observe_error(exc)
+                if not is_retryable(exc):
+                    # Client errors (bad request, auth) say nothing about upstream health
+                    self.breaker.record_success()
+                    raise exc
+                if attempt >= self.max_retries or isinstance(exc, UpstreamTimeout):
+                    self.breaker.record_failure()
+                    raise exc
+                delay = _retry_after_hint(exc)
+                if delay is None:
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if time.monotonic() + delay >= deadline:
+                    self.breaker.record_failure()
+                    raise exc
+                attempt += 1
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+
+            self.observe_latency(latency_key, time.monotonic() - start)
+            self.breaker.record_success()
+            return result
+
+    async def _attempt(
+        self,
+        factory: Callable[[], Awaitable[T]],
+        hedge: bool,
+        discard: Optional[Callable[[T], Awaitable[Any]]],
+        latency_key: Hashable = None,
+    ) -> T:
+        primary = asyncio.ensure_future(factory())
+        hedge_after = self.p95_latency(latency_key) if hedge else None
+        if hedge_after is None:
+            return await primary
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(primary), timeout=hedge_after)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            primary.cancel()
+            raise
+
+        self.hedges += 1
+        secondary = asyncio.ensure_future(factory())
+        pending = {primary, secondary}
+        winner: Optional[asyncio.Future] = None
+        error: Optional[BaseException] = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+                    elif discard is not None:
+                        # Both attempts finished together; release the extra result
+                        with contextlib.suppress(Exception):
+                            await discard(task.result())
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if winner is None:
+            raise error
+        if winner is secondary:
+            self.hedge_wins += 1
+        return winner.result()
+
+    def get_stats(self) -> Dict[str, Any]:
+        p95_ms = {}
+        for latency_key in self._latencies:
+            p95 = self.p95_latency(latency_key)
+            label = "/".join(str(part) for part in latency_key) if isinstance(latency_key, tuple) else str(latency_key)
+            p95_ms[label] = round(p95 * 1000, 1) if p95 is not None else None
+        return {
+            "circuit_breaker": self.breaker.snapshot(),
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p95_latency_ms": p95_ms,
+        }
+
+
+# Singleton instance
+upstream_policy = UpstreamPolicy()
@@ -0,0 +1,278 @@
+"""
+OmniDev - Vision Result Cache
+Reuses analyses of near-identical images, matched by perceptual hash
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, BinaryIO, Dict, List, Optional, Tuple, Union
+
+from app.config import get_settings
+from app.services.image_preprocess import ImageRejected, PreprocessedImage, image_preprocessor
+from app.services.openai_service import openai_service
+from app.services.request_context import current_user_id
+
+settings = get_settings()
+
+# (user scope, task, prompt digest, image variant): results are only shared within a scope
+Scope = Tuple[str, str, str, str]
+
+# Tasks whose answers depend on fine detail; they only reuse results for identical images
+EXACT_TASKS = {"ocr"}
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+@dataclass
+class _BKNode:
+    phash: int
+    live: bool = True
+    children: Dict[int, "_BKNode"] = field(default_factory=dict)
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance
+
+    Removal only marks a node dead; the owner rebuilds the tree once dead
+    nodes outnumber live ones.
+    """
+
+    def __init__(self):
+        self.root: Optional[_BKNode] = None
+        self.live = 0
+        self.dead = 0
+
+    def add(self, phash: int) -> None:
+        if self.root is None:
+            self.root = _BKNode(phash)
+            self.live += 1
+            return
+        node = self.root
+        while True:
+            distance = hamming(phash, node.phash)
+            if distance == 0:
+                if not node.live:
+                    node.live = True
+                    self.live += 1
+                    self.dead -= 1
+                return
+            child = node.children.get(distance)
+            if child is None:
+                node.children[distance] = _BKNode(phash)
+                self.live += 1
+                return
+            node = child
+
+    def remove(self, phash: int) -> None:
+        node = self.root
+        while node is not None:
+            distance = hamming(phash, node.phash)
+            if distance == 0:
+                if node.live:
+                    node.live = False
+                    self.live -= 1
+                    self.dead += 1
+                return
+            node = node.children.get(distance)
+
+    def search(self, phash: int, max_distance: int) -> List[Tuple[int, int]]:
+        """Return (distance, hash) for every live hash within `max_distance`"""
+        matches = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(phash, node.phash)
+            if distance <= max_distance and node.live:
+                matches.append((distance, node.phash))
+            for edge, child in node.children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return matches
+
+    def hashes(self) -> List[int]:
+        result, stack = [], [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            if node.live:
+                result.append(node.phash)
+            stack.extend(node.children.values())
+        return result
+
+
+class VisionCache:
+    """
+    LRU cache of vision results keyed by perceptual hash, task and prompt.
+
+    Lookups accept any cached image within `max_distance` bits of the upload,
+    so re-encoded or slightly resized copies hit. Entries are scoped per user
+    unless `vision_cache_shared` is set. dHash ignores overall colour, so the
+    image's quantised mean tone is part of the scope. OCR only reuses results
+    for identical images, because two documents with the same layout can
+    differ only in their text.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        max_distance: Optional[int] = None,
+    ):
+        self.enabled = settings.vision_cache_enabled
+        self.max_entries = max_entries or settings.vision_cache_max_entries
+        self.max_bytes = max_bytes or settings.vision_cache_max_bytes
+        self.max_distance = max_distance if max_distance is not None else settings.vision_cache_max_distance
+        self._entries: "OrderedDict[Tuple[Scope, int], str]" = OrderedDict()
+        self._trees: Dict[Scope, BKTree] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def scope(
+        self,
+        task: str,
+        prompt: str,
+        image: PreprocessedImage,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> Scope:
+        user_scope = "*" if settings.vision_cache_shared else (current_user_id.get() or "anonymous")
+        digest = hashlib.blake2b(prompt.encode("utf-8"), digest_size=8)
+        if response_format:
+            digest.update(json.dumps(response_format, sort_keys=True).encode("utf-8"))
+        variant = image.digest if task in EXACT_TASKS else str(image.tone)
+        return user_scope, task, digest.hexdigest(), variant
+
+    def get(self, scope: Scope, phash: int) -> Optional[str]:
+        tree = self._trees.get(scope)
+        limit = 0 if scope[1] in EXACT_TASKS else self.max_distance
+        matches = tree.search(phash, limit) if tree is not None else []
+        if not matches:
+            self.misses += 1
+            return None
+        _, nearest = min(matches)
+        key = (scope, nearest)
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key]
+
+    def put(self, scope: Scope, phash: int, result: str) -> None:
+        key = (scope, phash)
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.total_bytes -= len(previous)
+        self._entries[key] = result
+        self.total_bytes += len(result)
+        self._trees.setdefault(scope, BKTree()).add(phash)
+        while self._entries and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            (old_scope, old_hash), old_result = self._entries.popitem(last=False)
+            self.total_bytes -= len(old_result)
+            self.evictions += 1
+            self._forget(old_scope, old_hash)
+
+    def _forget(self, scope: Scope, phash: int) -> None:
+        tree = self._trees[scope]
+        tree.remove(phash)
+        if not tree.live:
+            del self._trees[scope]
+        elif tree.dead > tree.live:
+            rebuilt = BKTree()
+            for value in tree.hashes():
+                rebuilt.add(value)
+            self._trees[scope] = rebuilt
+
+    async def analyze(
+        self,
+        image_data: Union[bytes, BinaryIO],
+        prompt: str,
+        api_key: Optional[str] = None,
+        task: str = "analyze",
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[str, str]:
+        """
+        Analyze an image, answering from the cache when a near-identical one was seen
+
+        `response_format` requests structured output and is part of the cache key.
+
+        Returns:
+            (result text, cache status: "hit", "miss" or "bypass")
+        """
+        try:
+            image = await image_preprocessor.prepare(image_data, task)
+        except ImageRejected as e:
+            return f"❌ {e}", "bypass"
+        options = {"response_format": response_format} if response_format else {}
+        if not self.enabled or image.phash is None:
+            return await openai_service.analyze_image(image, prompt, api_key=api_key, **options), "bypass"
+
+        scope = self.scope(task, prompt, image, response_format)
+        cached = self.get(scope, image.phash)
+        if cached is not None:
+            return cached, "hit"
+        result = await openai_service.analyze_image(image, prompt, api_key=api_key, **options)
+        # Errors and configuration warnings are never cached
+        if not result.startswith(("❌", "⚠️")):
+            self.put(scope, image.phash, result)
+        return result, "miss"
+
+    async def analyze_stream(
+        self,
+        image_data: Union[bytes, BinaryIO],
+        prompt: str,
+        api_key: Optional[str] = None,
+        task: str = "analyze",
+        status: Optional[Dict[str, Any]] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream an analysis; a cache hit is yielded as a single chunk
+
+        `status["cache_status"]` is set to "hit", "miss" or "bypass". Failures,
+        including ones after part of the answer was streamed, are reported in
+        `status["error"]` rather than as chunks. A streamed result is cached
+        only once it has completed without error.
+        """
+        status = status if status is not None else {}
+        status["cache_status"] = "bypass"
+        try:
+            image = await image_preprocessor.prepare(image_data, task)
+        except ImageRejected as e:
+            status["error"] = f"❌ {e}"
+            return
+
+        scope = None
+        if self.enabled and image.phash is not None:
+            scope = self.scope(task, prompt, image)
+            cached = self.get(scope, image.phash)
+            if cached is not None:
+                status["cache_status"] = "hit"
+                yield cached
+                return
+            status["cache_status"] = "miss"
+
+        parts: List[str] = []
+        async for chunk in openai_service.analyze_image_stream(image, prompt, api_key=api_key, status=status):
+            parts.append(chunk)
+            yield chunk
+        result = "".join(parts)
+        if scope is not None and result and "error" not in status:
+            self.put(scope, image.phash, result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+# Singleton instance
+vision_cache = VisionCache()
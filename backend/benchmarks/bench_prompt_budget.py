@@ -0,0 +1,44 @@
+"""
+OmniDev - Prompt Budget Benchmark
+Times prompt assembly over a long history with cold and warm token-count caches
+
+Run from backend/: python benchmarks/bench_prompt_budget.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import prompt_budget
+from app.services.prompt_budget import PromptAssembler
+
+
+def make_history(turns: int, size: int = 400):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i} " + "x" * size}
+        for i in range(turns)
+    ]
+
+
+def bench(label: str, func, number: int) -> float:
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"  {label:<28} {seconds * 1e6:11.1f} µs")
+    return seconds
+
+
+def main() -> None:
+    print(f"Tokenizer: {'tiktoken' if prompt_budget._ENCODING is not None else 'character heuristic'}")
+    history = make_history(200)
+
+    print("\nAssemble 200 turns into a 2,000-token budget")
+    cold = bench("cold (fresh counter)", lambda: PromptAssembler(budget=2_000, keep_recent=4).assemble("system", "next", history), 20)
+    assembler = PromptAssembler(budget=2_000, keep_recent=4)
+    assembler.assemble("system", "warm", history)
+    warm = bench("warm (cached counts)", lambda: assembler.assemble("system", "next", history), 200)
+    print(f"  {'speedup':<28} {cold / warm:11.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+OmniDev - Serialization Benchmark
+Compares the previous and current encoding paths for large scrape payloads and WebSocket frames
+
+Run from backend/: python benchmarks/bench_serialization.py
+"""
+
+import base64
+import json
+import os
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.routers.scraper import ScrapeResponse, scrape_response
+from app.services import serialization
+from app.services.scraper_service import ScrapeResult
+
+
+def make_scrape_result(html_kb: int = 2048, screenshot_kb: int = 1024) -> ScrapeResult:
+    paragraph = "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit — “quoted” ünïcödé.</p>\n"
+    html = paragraph * (html_kb * 1024 // len(paragraph.encode("utf-8")))
+    return ScrapeResult(
+        success=True,
+        url="https://example.com/large",
+        title="Large page",
+        html=html,
+        text=html.replace("<p>", "").replace("</p>", ""),
+        screenshot=base64.b64encode(os.urandom(screenshot_kb * 1024)).decode("ascii"),
+        load_time_ms=1234,
+    )
+
+
+def before(result: ScrapeResult) -> bytes:
+    # response_model validation + jsonable_encoder + stdlib JSONResponse
+    model = ScrapeResponse(**vars(result))
+    validated = ScrapeResponse.model_validate(model.model_dump())
+    return JSONResponse(jsonable_encoder(validated.model_dump())).body
+
+
+def after(result: ScrapeResult) -> bytes:
+    return scrape_response(result).body
+
+
+def bench(label: str, func, number: int) -> float:
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"  {label:<28} {seconds * 1e6:11.1f} µs")
+    return seconds
+
+
+def main() -> None:
+    print(f"JSON encoder: {'orjson' if serialization.orjson else 'stdlib json'}")
+
+    result = make_scrape_result()
+    size_mb = len(after(result)) / 1024 / 1024
+    print(f"\nScrapeResponse ({size_mb:.1f} MB)")
+    old = bench("before (validate + encode)", lambda: before(result), 10)
+    new = bench("after (trusted, fast JSON)", lambda: after(result), 10)
+    print(f"  {'speedup':<28} {old / new:11.1f}x")
+
+    frame = {"type": "chunk", "stream_id": "default", "content": "Hello, world! " * 4}
+    print("\nWebSocket chunk frame")
+    old = bench("before (json.dumps)", lambda: json.dumps(frame), 100_000)
+    new = bench("after (serialization.dumps)", lambda: serialization.dumps(frame), 100_000)
+    print(f"  {'speedup':<28} {old / new:11.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+OmniDev - Vision Upload Memory Benchmark
+Peak memory of the old read-everything upload path versus the spooled preprocessing path
+
+Run from backend/: python benchmarks/bench_upload_memory.py
+Each path runs in a fresh interpreter so peak RSS readings do not interfere.
+"""
+
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+def make_upload(path: Path) -> None:
+    from PIL import Image
+
+    # Noise compresses poorly, so this lands near a 12 MB phone screenshot
+    size = (2400, 1800)
+    image = Image.merge("RGB", [Image.effect_noise(size, sigma) for sigma in (30, 50, 70)])
+    image.save(path, "PNG", compress_level=1)
+
+
+def run_old(path: Path) -> int:
+    import base64
+
+    with open(path, "rb") as upload:
+        image_data = upload.read()                               # await file.read()
+    encoded = base64.b64encode(image_data).decode("utf-8")       # base64 copy
+    body = json.dumps({"messages": [{"role": "user", "content": [
+        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded}"}},
+    ]}]})                                                       # request JSON copy
+    return len(body)
+
+
+def run_new(path: Path) -> int:
+    from app.services.image_preprocess import preprocess_image
+
+    # Starlette spools uploads above 1 MB to a temporary file
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spooled, open(path, "rb") as upload:
+        while chunk := upload.read(64 * 1024):
+            spooled.write(chunk)
+        image = preprocess_image(spooled, "describe")
+    body = json.dumps({"messages": [{"role": "user", "content": [
+        {"type": "image_url", "image_url": {"url": image.data_url()}},
+    ]}]})
+    return len(body)
+
+
+def measure(mode: str, path: Path) -> None:
+    # Import app code before the baseline so only the upload itself is measured
+    import app.services.image_preprocess  # noqa: F401
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    body_bytes = (run_old if mode == "old" else run_new)(path)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    print(json.dumps({"mode": mode, "body_bytes": body_bytes, "traced_peak": traced_peak, "rss_growth_kb": rss_growth}))
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "upload.png"
+        make_upload(path)
+        size_mb = path.stat().st_size / 1024 / 1024
+        print(f"Upload: {size_mb:.1f} MB PNG")
+        print(f"  {'path':<6} {'request body':>14} {'python peak':>13} {'peak RSS growth':>17}")
+        for mode in ("old", "new"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--measure", mode, str(path)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"  {mode:<6} {result['body_bytes'] / 1024 / 1024:11.1f} MB"
+                f" {result['traced_peak'] / 1024 / 1024:10.1f} MB"
+                f" {result['rss_growth_kb'] / 1024:14.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--measure":
+        measure(sys.argv[2], Path(sys.argv[3]))
+    else:
+        main()
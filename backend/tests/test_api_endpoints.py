@@ -10,14 +10,17 @@ os.environ["API_KEY_SALT"] = "test-salt"
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
+from app.config import get_settings
 from app.main import app
 from app.services.scraper_service import ScrapeResult, scraper_service
 from app.services.openai_service import openai_service
+from app.services.model_router import model_router
 from app.routers import location as location_router
 from app.services.auth_service import generate_api_key
 
 
 client = TestClient(app)
+settings = get_settings()
 
 
 def auth_headers(user_id: str = "user-1"):
@@ -81,6 +84,7 @@ def test_ai_status_and_chat():
     status_res = client.get("/api/ai/status", headers=auth_headers())
     assert status_res.status_code == 200
     assert status_res.json()["service"] == "OpenAI"
+    assert status_res.json()["models"] == model_router.active_models()
 
     chat_res = client.post("/api/ai/chat", json={"message": "Hello"}, headers=auth_headers())
     assert chat_res.status_code == 200
@@ -108,6 +112,187 @@ def test_vision_status_and_analyze(monkeypatch):
     assert analyze_res.json()["analysis"] == "ok"
 
 
+def test_vision_upload_limit_rejection_carries_cors_headers():
+    oversized = b"\0" * (settings.vision_max_upload_bytes + 1)
+    res = client.post(
+        "/api/vision/analyze",
+        files={"file": ("big.png", oversized, "image/png")},
+        headers={**auth_headers(), "Origin": "http://localhost:3000"},
+    )
+    assert res.status_code == 413
+    # Browsers can read the size-limit message instead of seeing an opaque CORS failure
+    assert res.headers["access-control-allow-origin"] == "http://localhost:3000"
+
+
+def test_vision_analyze_all_returns_typed_fields_from_one_call(monkeypatch):
+    import io
+    import json
+    from PIL import Image
+
+    calls = []
+
+    async def fake_analyze_image(image, prompt, api_key=None, response_format=None):
+        calls.append(response_format)
+        return json.dumps({
+            "description": "A red square",
+            "objects": [{"object": "square", "confidence": "high", "location": "center"}],
+        })
+
+    monkeypatch.setattr(openai_service, "analyze_image", fake_analyze_image)
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), "red").save(buffer, "PNG")
+    files = {"file": ("red.png", buffer.getvalue(), "image/png")}
+    headers = auth_headers("vision-user")
+
+    res = client.post(
+        "/api/vision/analyze-all",
+        files=files,
+        data={"tasks": "describe,identify_objects"},
+        headers=headers,
+    )
+    assert res.status_code == 200
+    body = res.json()
+    assert body["description"] == "A red square"
+    assert body["objects"][0]["confidence"] == "high"
+    assert body["text"] is None
+    assert body["tasks"] == ["describe", "identify_objects"]
+    assert len(calls) == 1
+    schema = calls[0]["json_schema"]["schema"]
+    assert schema["required"] == ["description", "objects"]
+
+    bad = client.post("/api/vision/analyze-all", files=files, data={"tasks": "describe,dance"}, headers=headers)
+    assert bad.status_code == 400
+
+
+def test_vision_batch_streams_results_and_dedupes_zip_members(monkeypatch):
+    import io
+    import json
+    import zipfile
+    from PIL import Image
+
+    prompts = []
+
+    async def fake_analyze_image(image, prompt, api_key=None):
+        prompts.append(prompt)
+        return f"text of {image.width}x{image.height}"
+
+    monkeypatch.setattr(openai_service, "analyze_image", fake_analyze_image)
+
+    def png(size, color):
+        buffer = io.BytesIO()
+        Image.new("RGB", size, color).save(buffer, "PNG")
+        return buffer.getvalue()
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("page-1.png", png((40, 30), "white"))
+        zf.writestr("page-2.png", png((50, 30), "black"))
+        zf.writestr("copy-of-page-1.png", png((40, 30), "white"))
+        zf.writestr("notes.txt", "not an image")
+
+    res = client.post(
+        "/api/vision/batch",
+        files={"files": ("pages.zip", archive.getvalue(), "application/zip")},
+        data={"task": "extract_text", "concurrency": "2"},
+        headers=auth_headers("batch-vision-user"),
+    )
+    assert res.status_code == 200
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    results = {line["filename"]: line for line in lines if line["type"] == "result"}
+    assert results["page-1.png"]["result"] == "text of 40x30"
+    assert results["page-2.png"]["status"] == "success"
+    assert results["copy-of-page-1.png"]["status"] == "duplicate"
+    assert results["copy-of-page-1.png"]["duplicate_of"] == results["page-1.png"]["index"]
+    assert lines[-1] == {"type": "summary", "images": 3, "success": 2, "error": 0, "duplicate": 1}
+    assert len(prompts) == 2
+
+
+def test_vision_batch_reports_copies_of_failed_images_as_errors(monkeypatch):
+    import io
+    import json
+    from PIL import Image
+
+    async def failing_analyze_image(image, prompt, api_key=None):
+        return "❌ Error analyzing image: upstream unavailable"
+
+    monkeypatch.setattr(openai_service, "analyze_image", failing_analyze_image)
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), "orange").save(buffer, "PNG")
+    image = buffer.getvalue()
+    res = client.post(
+        "/api/vision/batch",
+        files=[("files", ("scan.png", image, "image/png")), ("files", ("scan-copy.png", image, "image/png"))],
+        data={"task": "describe", "concurrency": "1"},
+        headers=auth_headers("batch-vision-failure"),
+    )
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    results = {line["filename"]: line for line in lines if line["type"] == "result"}
+    copy = results["scan-copy.png"]
+    assert copy["status"] == "error" and "result" not in copy
+    assert copy["error"] == results["scan.png"]["error"] and copy["duplicate_of"] == results["scan.png"]["index"]
+    assert lines[-1] == {"type": "summary", "images": 2, "success": 0, "error": 2, "duplicate": 0}
+
+
+def test_vision_identify_objects_sse_emits_each_object(monkeypatch):
+    import io
+    from PIL import Image
+
+    async def fake_analyze_image_stream(image, prompt, api_key=None, status=None):
+        yield '[{"object": "cup", "confidence": "high", '
+        yield '"location": "center"}, {"object": "pen",'
+        yield ' "confidence": "low", "location": "left"}]'
+
+    monkeypatch.setattr(openai_service, "analyze_image_stream", fake_analyze_image_stream)
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (24, 24), "green").save(buffer, "PNG")
+    files = {"file": ("green.png", buffer.getvalue(), "image/png")}
+
+    with client.stream("POST", "/api/vision/identify-objects/sse", files=files, headers=auth_headers("vision-sse-user")) as res:
+        assert res.status_code == 200
+        assert res.headers["content-type"].startswith("text/event-stream")
+        body = "".join(res.iter_text())
+
+    assert body.startswith(": stream-open")
+    assert 'event: object\ndata: {"index":0,"object":{"object":"cup","confidence":"high","location":"center"}}' in body
+    assert '"index":1' in body
+    assert body.count("event: chunk") == 3
+    assert body.rstrip().splitlines()[-1] == 'data: {"cache_status":"miss","objects":2}'
+
+
+def test_vision_sse_reports_mid_stream_failure_and_skips_cache(monkeypatch):
+    import io
+    from PIL import Image
+
+    calls = []
+
+    async def failing_analyze_image_stream(image, prompt, api_key=None, status=None):
+        calls.append(prompt)
+        yield "partial description"
+        status["error"] = "❌ Error analyzing image: connection reset"
+
+    monkeypatch.setattr(openai_service, "analyze_image_stream", failing_analyze_image_stream)
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (24, 24), "purple").save(buffer, "PNG")
+    files = {"file": ("purple.png", buffer.getvalue(), "image/png")}
+
+    bodies = []
+    for _ in range(2):
+        with client.stream("POST", "/api/vision/describe/sse", files=files, headers=auth_headers("vision-sse-fail")) as res:
+            bodies.append("".join(res.iter_text()))
+
+    for body in bodies:
+        assert 'event: chunk\ndata: {"content":"partial description"}' in body
+        assert "Error analyzing image" not in body.split("event: error")[0]
+        assert body.rstrip().splitlines()[-1] == 'data: {"content":"❌ Error analyzing image: connection reset"}'
+        assert "event: done" not in body
+    # The truncated answer was not cached, so the second request went upstream again
+    assert len(calls) == 2
+
+
 def test_scraper_endpoints(monkeypatch):
     async def fake_scrape(url, wait_time_ms=2000, capture_screenshot=False, extract_selector=None, wait_for_selector=None):
         return ScrapeResult(
@@ -146,6 +331,40 @@ def test_scraper_endpoints(monkeypatch):
     assert cleanup_res.json()["status"] == "success"
 
 
+def test_scraper_crawl_streams_pages_with_dedupe_and_filters(monkeypatch):
+    import json
+
+    site = {
+        "https://site.example/": '<a href="/a">A</a><a href="/b?utm_source=x">B</a><a href="/a#top">A again</a>'
+                                 '<a href="https://other.example/">Other</a><a href="/skip/1">Skip</a>',
+        "https://site.example/a": '<a href="/b">B</a><a href="c">C</a>',
+        "https://site.example/b": '<a href="/">Home</a>',
+        "https://site.example/c": '<a href="/d">D</a>',
+    }
+
+    async def fake_scrape(url, **options):
+        return ScrapeResult(success=True, url=url, title=url, html=site[url], text="", engine="http")
+
+    monkeypatch.setattr(scraper_service, "scrape", fake_scrape)
+
+    res = client.post(
+        "/api/scraper/crawl",
+        json={"seeds": ["https://SITE.example"], "max_depth": 2, "exclude": ["/skip/"], "per_host_delay_ms": 0},
+        headers=auth_headers("crawl-user"),
+    )
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    pages = {line["url"]: line for line in lines if line["type"] == "page"}
+    assert set(pages) == set(site)
+    assert pages["https://site.example/"]["depth"] == 0
+    assert pages["https://site.example/c"]["depth"] == 2
+    assert lines[-1] == {"type": "summary", "pages": 4, "success": 4, "error": 0, "filtered": 2, "unvisited": 0}
+
+    bad = client.post("/api/scraper/crawl", json={"seeds": ["https://site.example"], "include": ["("]}, headers=auth_headers("crawl-user"))
+    assert bad.status_code == 400
+
+
 def test_location_endpoints(monkeypatch):
     monkeypatch.setattr(location_router.geocoder, "ip", lambda *_args, **_kwargs: FakeGeoResult())
     monkeypatch.setattr(location_router.geocoder, "osm", lambda *_args, **_kwargs: FakeGeoResult())
@@ -220,3 +439,226 @@ def test_auth_api_key():
     api_key_res = client.post("/api/auth/api-key", headers={"Authorization": headers["Authorization"]})
     assert api_key_res.status_code == 200
     assert "api_key" in api_key_res.json()
+
+
+def test_ai_chat_with_server_side_session(monkeypatch):
+    seen_histories = []
+
+    async def fake_chat(message, history=None, metadata=None):
+        seen_histories.append(history)
+        return f"echo: {message}"
+
+    monkeypatch.setattr(openai_service, "chat", fake_chat)
+
+    session_res = client.post("/api/ai/sessions", headers=auth_headers())
+    assert session_res.status_code == 200
+    session_id = session_res.json()["session_id"]
+
+    first = client.post("/api/ai/chat", json={"message": "one", "session_id": session_id}, headers=auth_headers())
+    assert first.status_code == 200
+    assert first.json()["session_id"] == session_id
+
+    second = client.post("/api/ai/chat", json={"message": "two", "session_id": session_id}, headers=auth_headers())
+    assert second.status_code == 200
+    assert seen_histories[-1] == [
+        {"role": "user", "content": "one"},
+        {"role": "assistant", "content": "echo: one"},
+    ]
+
+    other_user = client.post("/api/ai/chat", json={"message": "x", "session_id": session_id}, headers=auth_headers("user-9"))
+    assert other_user.status_code == 404
+
+    get_res = client.get(f"/api/ai/sessions/{session_id}", headers=auth_headers())
+    assert get_res.json()["turns"] == 4
+
+    delete_res = client.delete(f"/api/ai/sessions/{session_id}", headers=auth_headers())
+    assert delete_res.status_code == 200
+
+
+def test_ai_chat_sse_streams_chunks(monkeypatch):
+    async def fake_chat_stream(message, history=None, metadata=None):
+        yield "Hel"
+        yield "lo"
+
+    monkeypatch.setattr(openai_service, "chat_stream", fake_chat_stream)
+
+    with client.stream("POST", "/api/ai/chat/sse", json={"message": "Hi"}, headers=auth_headers()) as res:
+        assert res.status_code == 200
+        assert res.headers["content-type"].startswith("text/event-stream")
+        body = "".join(res.iter_text())
+
+    assert 'event: chunk\ndata: {"content":"Hel"}' in body
+    assert 'data: {"content":"lo"}' in body
+    assert body.rstrip().splitlines()[-2] == "event: done"
+
+
+def ws_url(user_id: str = "user-1"):
+    headers = auth_headers(user_id)
+    token = headers["Authorization"].replace("Bearer ", "")
+    return f"/api/ai/chat/stream?token={token}&api_key={headers['X-API-Key']}"
+
+
+def test_ai_chat_websocket_coalesces_frames(monkeypatch):
+    async def fake_chat_stream(message, history=None, metadata=None):
+        for _ in range(20):
+            yield "ab"
+
+    monkeypatch.setattr(openai_service, "chat_stream", fake_chat_stream)
+
+    with client.websocket_connect(ws_url()) as ws:
+        ws.send_json({"type": "config", "coalesce_ms": 50, "coalesce_bytes": 1000})
+        config = ws.receive_json()
+        assert (config["type"], config["coalesce_ms"], config["coalesce_bytes"]) == ("config", 50, 1000)
+
+        ws.send_json({"message": "Hi"})
+        frames = []
+        while True:
+            frame = ws.receive_json()
+            if frame["type"] == "done":
+                break
+            frames.append(frame["content"])
+
+    assert "".join(frames) == "ab" * 20
+    assert len(frames) < 20
+    assert frame["metadata"]["frames"] == len(frames)
+
+
+def test_ai_chat_returns_429_with_retry_after_when_admission_rejects(monkeypatch):
+    from app.services.admission import AdmissionRejected
+
+    async def rejecting_chat(message, history=None, metadata=None):
+        raise AdmissionRejected(retry_after=7)
+
+    monkeypatch.setattr(openai_service, "chat", rejecting_chat)
+
+    res = client.post("/api/ai/chat", json={"message": "Hello"}, headers=auth_headers())
+    assert res.status_code == 429
+    assert res.headers["Retry-After"] == "7"
+
+
+def test_ai_chat_honours_request_deadline_header(monkeypatch):
+    import asyncio
+    from app.services import metrics
+
+    cancelled = []
+
+    async def slow_chat(message, history=None, metadata=None):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "too late"
+
+    monkeypatch.setattr(openai_service, "chat", slow_chat)
+
+    headers = {**auth_headers(), "X-Request-Timeout": "0.1"}
+    res = client.post("/api/ai/chat", json={"message": "Hello"}, headers=headers)
+    assert res.status_code == 504
+    assert cancelled == [True]
+    assert metrics.cancellation_counts["/api/ai/chat"]["deadline"] >= 1
+
+
+def test_ai_chat_batch_streams_ndjson_results(monkeypatch):
+    import json as jsonlib
+
+    async def fake_chat(message, history=None, metadata=None):
+        if metadata is not None:
+            metadata["prompt_tokens"] = 10
+        if message == "fail":
+            return "❌ Error communicating with OpenAI: boom"
+        return f"echo: {message}"
+
+    monkeypatch.setattr(openai_service, "chat", fake_chat)
+
+    body = {"items": [{"id": "a", "message": "one"}, {"id": "b", "message": "fail"}, {"message": "three"}], "concurrency": 2}
+    res = client.post("/api/ai/chat/batch", json=body, headers=auth_headers())
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+    lines = [jsonlib.loads(line) for line in res.text.splitlines()]
+    results = {line["id"]: line for line in lines if line["type"] == "result"}
+    assert results["a"]["status"] == "success" and results["a"]["response"] == "echo: one"
+    assert results["b"]["status"] == "error"
+    assert results["2"]["status"] == "success"
+    assert lines[-1]["type"] == "summary" and lines[-1]["success"] == 2 and lines[-1]["error"] == 1
+
+    ndjson = "\n".join(jsonlib.dumps({"id": str(i), "message": f"m{i}"}) for i in range(5))
+    budget_res = client.post(
+        "/api/ai/chat/batch?concurrency=1&token_budget=1",
+        content=ndjson,
+        headers={**auth_headers(), "Content-Type": "application/x-ndjson"},
+    )
+    lines = [jsonlib.loads(line) for line in budget_res.text.splitlines()]
+    assert lines[-1]["success"] == 1
+    assert lines[-1]["skipped"] == 4
+
+
+def test_ai_chat_websocket_multiplexes_and_cancels_streams(monkeypatch):
+    import asyncio
+
+    async def fake_chat_stream(message, history=None, metadata=None):
+        if message == "slow":
+            yield "start"
+            await asyncio.sleep(30)
+            yield "never"
+            return
+        for word in ("quick", " answer"):
+            yield word
+
+    monkeypatch.setattr(openai_service, "chat_stream", fake_chat_stream)
+
+    with client.websocket_connect(ws_url()) as ws:
+        ws.send_json({"type": "config", "coalesce_ms": 0})
+        ws.receive_json()
+
+        ws.send_json({"stream_id": "s1", "message": "slow"})
+        assert ws.receive_json() == {"type": "chunk", "stream_id": "s1", "content": "start"}
+
+        ws.send_json({"stream_id": "s2", "message": "fast"})
+        frames = []
+        while True:
+            frame = ws.receive_json()
+            frames.append(frame)
+            if frame["type"] == "done":
+                break
+        assert all(frame["stream_id"] == "s2" for frame in frames)
+        assert "".join(f["content"] for f in frames if f["type"] == "chunk") == "quick answer"
+
+        ws.send_json({"stream_id": "s1", "message": "again"})
+        assert ws.receive_json()["content"] == "Stream already running"
+
+        ws.send_json({"type": "cancel", "stream_id": "s1"})
+        assert ws.receive_json() == {"type": "cancelled", "stream_id": "s1"}
+
+
+def test_ai_chat_websocket_restart_after_cancel_keeps_new_stream_tracked(monkeypatch):
+    import asyncio
+    import time as timelib
+
+    async def fake_chat_stream(message, history=None, metadata=None):
+        try:
+            yield message
+            await asyncio.sleep(30)
+        finally:
+            # Closing the upstream takes a while after the cancel
+            await asyncio.sleep(0.2)
+
+    monkeypatch.setattr(openai_service, "chat_stream", fake_chat_stream)
+
+    with client.websocket_connect(ws_url()) as ws:
+        ws.send_json({"type": "config", "coalesce_ms": 0})
+        ws.receive_json()
+
+        ws.send_json({"message": "one"})
+        assert ws.receive_json() == {"type": "chunk", "stream_id": "default", "content": "one"}
+        ws.send_json({"type": "cancel"})
+        assert ws.receive_json() == {"type": "cancelled", "stream_id": "default"}
+
+        ws.send_json({"message": "two"})
+        assert ws.receive_json() == {"type": "chunk", "stream_id": "default", "content": "two"}
+        # Let "one" finish its cleanup; it must not untrack "two"
+        timelib.sleep(0.4)
+        ws.send_json({"message": "three"})
+        assert ws.receive_json()["content"] == "Stream already running"
+        ws.send_json({"type": "cancel"})
+        assert ws.receive_json() == {"type": "cancelled", "stream_id": "default"}
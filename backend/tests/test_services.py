@@ -0,0 +1,1372 @@
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+os.environ["SUPABASE_JWT_SECRET"] = "test-secret"
+os.environ["API_KEY_SALT"] = "test-salt"
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services.cancellation import RequestCancelled, run_cancellable
+from app.services.admission import AdmissionController, AdmissionRejected
+from app.services.image_preprocess import ImageRejected, preprocess_image
+from app.services.model_router import ModelRouter
+from app.services.prompt_budget import PromptAssembler
+from app.services.prompts import PromptRegistry, prompt_registry
+from app.services.serialization import dumps, dumps_bytes
+from app.services.session_store import SessionStore
+from app.services.streaming import JSONArrayItemParser, coalesce_chunks, stream_with_idle
+from app.services.upstream import CircuitBreaker, CircuitOpenError, UpstreamPolicy, UpstreamTimeout
+
+
+def make_history(turns: int, size: int = 400):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i} " + "x" * size}
+        for i in range(turns)
+    ]
+
+
+def test_prompt_assembler_keeps_everything_within_budget():
+    assembler = PromptAssembler(budget=10_000, keep_recent=2)
+    prompt = assembler.assemble("system", "hello", make_history(4, size=10))
+    assert [m["role"] for m in prompt.messages] == ["system", "user", "assistant", "user", "assistant", "user"]
+    assert prompt.tokens_saved == 0
+    assert prompt.dropped_messages == 0
+
+
+def test_prompt_assembler_drops_oldest_turns_over_budget():
+    assembler = PromptAssembler(budget=1_000, keep_recent=4)
+    history = make_history(200)
+    prompt = assembler.assemble("system", "latest question", history)
+
+    assert prompt.messages[0] == {"role": "system", "content": "system"}
+    assert prompt.messages[-1] == {"role": "user", "content": "latest question"}
+    assert prompt.messages[-2]["content"] == history[-1]["content"]
+    assert prompt.dropped_messages > 0
+    assert "omitted" in prompt.messages[1]["content"]
+    assert prompt.prompt_tokens <= 1_000
+    assert prompt.metadata()["tokens_saved"] == prompt.original_tokens - prompt.prompt_tokens > 0
+
+
+def test_prompt_assembler_counts_omission_note_within_budget():
+    history = make_history(200)
+    for budget in range(200, 1_200, 7):
+        prompt = PromptAssembler(budget=budget, keep_recent=1).assemble("system", "q", history)
+        assert prompt.dropped_messages > 0
+        assert prompt.prompt_tokens <= budget
+
+
+def test_prompt_assembler_always_keeps_recent_turns():
+    assembler = PromptAssembler(budget=10, keep_recent=3)
+    history = make_history(10)
+    prompt = assembler.assemble("system", "hi", history)
+    assert [m["content"] for m in prompt.messages[-4:-1]] == [m["content"] for m in history[-3:]]
+
+
+def test_prompt_assembler_reuses_cached_token_counts(monkeypatch):
+    from app.services import prompt_budget
+
+    encoded = []
+
+    class CountingEncoding:
+        def encode(self, text):
+            encoded.append(text)
+            return text.split()
+
+    monkeypatch.setattr(prompt_budget, "_ENCODING", CountingEncoding())
+    assembler = PromptAssembler(budget=2_000, keep_recent=4)
+    history = make_history(200)
+    assembler.assemble("system", "warm", history)
+    first_pass = len(encoded)
+
+    # Only the new user message is tokenized again; history and system prompt come from the cache
+    assembler.assemble("system", "next", history)
+    assert first_pass > 200
+    assert encoded[first_pass:] == ["next"]
+
+
+def test_session_store_evicts_lru_and_restores_from_sqlite(tmp_path):
+    store = SessionStore(max_sessions=2, max_bytes=1_000_000, idle_seconds=3600, db_path=str(tmp_path / "sessions.db"))
+
+    async def scenario():
+        first = await store.create("user-1")
+        await store.append(first, ("user", "hello"), ("assistant", "hi there"))
+        await store.create("user-1")
+        await store.create("user-1")
+        assert store.get_stats()["sessions"] == 2
+        assert store.evictions == 1
+
+        restored = await store.get(first.session_id, "user-1")
+        assert restored is not None
+        assert restored.history() == [
+            {"role": "user", "content": "hello"},
+            {"role": "assistant", "content": "hi there"},
+        ]
+        assert await store.get(first.session_id, "someone-else") is None
+
+    asyncio.run(scenario())
+
+
+def test_session_store_serializes_concurrent_appends(tmp_path):
+    store = SessionStore(db_path=str(tmp_path / "sessions.db"))
+
+    async def scenario():
+        session = await store.create("user-1")
+        await asyncio.gather(
+            store.append(session, ("user", "first"), ("assistant", "one")),
+            store.append(session, ("user", "second"), ("assistant", "two")),
+        )
+        return session
+
+    session = asyncio.run(scenario())
+    assert len(session.turns) == 4
+    restored = SessionStore(db_path=str(tmp_path / "sessions.db"))
+    reloaded = asyncio.run(restored.get(session.session_id, "user-1"))
+    assert reloaded.history() == session.history()
+
+
+def test_session_store_drops_replies_that_finish_after_delete(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    store = SessionStore(max_sessions=1, db_path=db_path)
+
+    async def scenario():
+        evicted = await store.create("user-1")
+        live = await store.create("user-1")  # evicts the first session from memory
+        # Streams still hold the original objects; DELETE of the evicted one loads its own copy
+        assert await store.delete(live.session_id, "user-1")
+        assert await store.delete(evicted.session_id, "user-1")
+        await store.append(live, ("user", "late"), ("assistant", "reply"))
+        await store.append(evicted, ("user", "late"), ("assistant", "reply"))
+        return live, evicted
+
+    live, evicted = asyncio.run(scenario())
+    reopened = SessionStore(db_path=db_path)
+    for session in (live, evicted):
+        assert asyncio.run(store.get(session.session_id, "user-1")) is None
+        assert asyncio.run(reopened.get(session.session_id, "user-1")) is None
+    assert reopened._persistence._conn.execute("SELECT COUNT(*) FROM chat_turns").fetchone()[0] == 0
+
+
+def test_session_store_enforces_memory_cap():
+    store = SessionStore(max_sessions=100, max_bytes=50, idle_seconds=3600, db_path="")
+
+    async def scenario():
+        old = await store.create("user-1")
+        await store.append(old, ("user", "x" * 40))
+        new = await store.create("user-1")
+        await store.append(new, ("user", "y" * 40))
+        assert await store.get(old.session_id, "user-1") is None
+        assert await store.get(new.session_id, "user-1") is not None
+
+    asyncio.run(scenario())
+
+
+def test_stream_with_idle_emits_heartbeats_and_closes_source():
+    closed = []
+
+    async def slow_source():
+        try:
+            yield "a"
+            await asyncio.sleep(0.05)
+            yield "b"
+            await asyncio.sleep(10)
+            yield "never"
+        finally:
+            closed.append(True)
+
+    async def scenario():
+        items = []
+        stream = stream_with_idle(slow_source(), idle_seconds=0.01)
+        async for item in stream:
+            items.append(item)
+            if item == "b":
+                break
+        await stream.aclose()
+        return items
+
+    items = asyncio.run(scenario())
+    assert items[0] == "a" and items[-1] == "b"
+    assert None in items
+    assert closed == [True]
+
+
+def test_coalesce_chunks_batches_by_time_and_size():
+    async def token_source():
+        for i in range(50):
+            yield "tok "
+            await asyncio.sleep(0.001)
+
+    async def scenario(window, max_bytes):
+        stats = {}
+        frames = [frame async for frame in coalesce_chunks(token_source(), window, max_bytes, stats=stats)]
+        return frames, stats
+
+    unbatched, unbatched_stats = asyncio.run(scenario(0, 1024))
+    assert len(unbatched) == 50
+    assert unbatched_stats == {"chunks": 50, "frames": 50}
+
+    batched, stats = asyncio.run(scenario(0.02, 1024))
+    assert "".join(batched) == "tok " * 50
+    assert batched[0] == "tok "
+    assert stats["chunks"] == 50
+    assert stats["frames"] == len(batched) < 20
+
+    by_size, _ = asyncio.run(scenario(10, 16))
+    assert all(len(frame) <= 16 for frame in by_size)
+    assert "".join(by_size) == "tok " * 50
+
+
+def test_json_array_item_parser_emits_top_level_objects_as_they_close():
+    text = (
+        'Here you go:\n```json\n{"objects": [{"object": "cat", "location": "says \\"}\\""}, '
+        '{"object": "dog", "tags": [1, {"x": 2}]}]}\n```'
+    )
+    parser = JSONArrayItemParser()
+    emitted = []
+    for i in range(0, len(text), 3):
+        emitted.append(parser.feed(text[i:i + 3]))
+
+    items = [item for batch in emitted for item in batch]
+    assert items == [
+        {"object": "cat", "location": 'says "}"'},
+        {"object": "dog", "tags": [1, {"x": 2}]},
+    ]
+    # The first object arrives before the stream is finished
+    assert emitted.index([items[0]]) < len(emitted) - 5
+    assert JSONArrayItemParser().feed('[{"a": 1}, {"b": }, {"c": 3}]') == [{"a": 1}, {"c": 3}]
+
+
+
+def test_admission_controller_is_fair_across_users():
+    controller = AdmissionController(
+        initial_limit=1, min_limit=1, max_limit=1, max_queue=100,
+        max_queue_per_user=100, latency_target_ms=10_000, queue_timeout_seconds=5,
+    )
+    order = []
+
+    async def call(user):
+        async with controller.slot(user):
+            order.append(user)
+            await asyncio.sleep(0.001)
+
+    async def scenario():
+        blocker = asyncio.Event()
+
+        async def hold():
+            async with controller.slot("holder"):
+                await blocker.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(call("heavy")) for _ in range(6)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(call("light")))
+        await asyncio.sleep(0)
+        blocker.set()
+        await asyncio.gather(holder, *tasks)
+
+    asyncio.run(scenario())
+    # The light user's single request is served right after the heavy user's first
+    assert order.index("light") == 1
+
+
+def test_admission_controller_rejects_when_queue_full_and_backs_off_on_429():
+    controller = AdmissionController(
+        initial_limit=4, min_limit=1, max_limit=8, max_queue=0,
+        max_queue_per_user=0, latency_target_ms=1_000, queue_timeout_seconds=1,
+    )
+
+    class Throttled(Exception):
+        status_code = 429
+
+    async def scenario():
+        held = [controller.slot("u") for _ in range(4)]
+        for ctx in held:
+            await ctx.__aenter__()
+        try:
+            async with controller.slot("u"):
+                pass
+        except AdmissionRejected as exc:
+            assert exc.retry_after >= 1
+        else:
+            raise AssertionError("expected rejection")
+        for ctx in held:
+            await ctx.__aexit__(None, None, None)
+
+    asyncio.run(scenario())
+    assert controller.rejected == 1
+
+    before = controller.limit
+    controller.observe_error(Throttled())
+    assert controller.limit == before / 2
+    assert controller.throttled == 1
+
+
+class FakeStatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def make_policy(**overrides):
+    policy = UpstreamPolicy()
+    policy.backoff_base = 0.001
+    policy.backoff_max = 0.002
+    policy.hedge_enabled = False
+    policy.breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+    for key, value in overrides.items():
+        setattr(policy, key, value)
+    return policy
+
+
+def test_upstream_policy_retries_retryable_errors():
+    policy = make_policy(max_retries=2)
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise FakeStatusError(503)
+        return "ok"
+
+    assert asyncio.run(policy.call(flaky)) == "ok"
+    assert len(calls) == 3
+    assert policy.retries == 2
+    assert policy.breaker.state == "closed"
+
+
+def test_upstream_policy_does_not_retry_client_errors():
+    policy = make_policy(max_retries=3)
+    calls = []
+
+    async def bad_request():
+        calls.append(1)
+        raise FakeStatusError(400)
+
+    try:
+        asyncio.run(policy.call(bad_request))
+    except FakeStatusError:
+        pass
+    else:
+        raise AssertionError("expected the client error to propagate")
+    assert len(calls) == 1
+
+
+def test_upstream_policy_opens_circuit_and_fails_fast():
+    policy = make_policy(max_retries=0)
+    calls = []
+
+    async def down():
+        calls.append(1)
+        raise FakeStatusError(502)
+
+    for _ in range(2):
+        try:
+            asyncio.run(policy.call(down))
+        except FakeStatusError:
+            pass
+    assert policy.breaker.state == "open"
+
+    try:
+        asyncio.run(policy.call(down))
+    except CircuitOpenError as exc:
+        assert exc.retry_after > 0
+    else:
+        raise AssertionError("expected the circuit to be open")
+    assert len(calls) == 2
+    assert policy.get_stats()["circuit_breaker"]["state"] == "open"
+
+
+def test_upstream_policy_hedges_against_latency_of_the_same_call_kind():
+    policy = make_policy(hedge_enabled=True)
+    # Streams return at their headers; they must not set the bar for full completions
+    for _ in range(50):
+        policy.observe_latency(("gpt-5-mini", "stream"), 0.001)
+        policy.observe_latency(("gpt-5-mini", "full"), 1.0)
+    calls = []
+
+    async def full_completion():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    assert asyncio.run(policy.call(full_completion, latency_key=("gpt-5-mini", "full"))) == "done"
+    assert len(calls) == 1 and policy.hedges == 0
+    assert policy.get_stats()["p95_latency_ms"]["gpt-5-mini/stream"] == 1.0
+
+
+def test_upstream_policy_hedges_slow_requests():
+    policy = make_policy(hedge_enabled=True)
+    for _ in range(50):
+        policy.observe_latency(None, 0.01)
+    calls = []
+
+    async def sometimes_slow():
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(5)
+            return "slow"
+        return "fast"
+
+    start = time.perf_counter()
+    assert asyncio.run(policy.call(sometimes_slow, timeout=10)) == "fast"
+    assert time.perf_counter() - start < 1
+    assert policy.hedges == 1 and policy.hedge_wins == 1
+
+
+def test_upstream_policy_enforces_deadline():
+    policy = make_policy(max_retries=0)
+
+    async def hang():
+        await asyncio.sleep(5)
+
+    try:
+        asyncio.run(policy.call(hang, timeout=0.05))
+    except UpstreamTimeout:
+        pass
+    else:
+        raise AssertionError("expected a deadline timeout")
+
+
+class DisconnectingRequest:
+    """Minimal stand-in for a Starlette request whose client goes away"""
+
+    class url:
+        path = "/api/test/disconnect"
+
+    def __init__(self, after: float):
+        self.after = after
+
+    async def receive(self):
+        await asyncio.sleep(self.after)
+        return {"type": "http.disconnect"}
+
+
+def test_run_cancellable_stops_work_when_client_disconnects():
+    stopped = []
+
+    async def work():
+        try:
+            await asyncio.sleep(5)
+        finally:
+            stopped.append(True)
+
+    async def scenario():
+        # The first call completes and primes the typical duration for the route
+        assert await run_cancellable(DisconnectingRequest(5), asyncio.sleep(0.01, "ok")) == "ok"
+        await run_cancellable(DisconnectingRequest(0.02), work())
+
+    start = time.perf_counter()
+    try:
+        asyncio.run(scenario())
+    except RequestCancelled as exc:
+        assert exc.reason == "disconnect"
+    else:
+        raise AssertionError("expected the request to be cancelled")
+    assert time.perf_counter() - start < 1
+    assert stopped == [True]
+
+
+def test_model_router_classifies_by_length_history_and_keywords():
+    router = ModelRouter()
+    assert router.route("hi there").tier == "fast"
+    assert router.route("Please debug this function for me").tier == "capable"
+    assert router.route("x" * 5000).tier == "capable"
+    assert router.route("What's the weather like in Mumbai today?", make_history(20, 10)).tier == "capable"
+    assert router.route("Tell me about the history of the printing press " * 6).tier == "cheap"
+    assert router.route("Which SQL joins exist?").tier == "capable"
+    for message in ("what is my zip code?", "decode this base64", "explain unicode", "scan a barcode", "mysqldump flags"):
+        assert router.route(message).tier == "fast", message
+
+    route = router.route("hi")
+    assert route.max_completion_tokens < router.max_tokens["capable"]
+    assert route.metadata()["model"] == router.models["fast"]
+    assert route.completion_options()["reasoning_effort"] == "minimal"
+    assert "reasoning_effort" not in router.route("Please debug this function for me").completion_options()
+
+
+def test_model_router_prefers_tier_meeting_latency_target():
+    router = ModelRouter(latency_target_ms=1000)
+    message = "Refactor this code"
+    assert router.route(message).tier == "capable"
+
+    router.observe(router.models["capable"], 5.0)
+    route = router.route(message)
+    assert route.tier == "cheap" and route.reason == "latency target"
+
+    # Nothing quicker meets the target either: keep the classified tier
+    router.observe(router.models["cheap"], 5.0)
+    router.observe(router.models["fast"], 5.0)
+    assert router.route(message).tier == "capable"
+    assert router.get_stats()["downgraded"] == 1
+
+
+def test_model_router_probes_downgraded_tiers_after_readings_expire(monkeypatch):
+    import app.services.model_router as model_router_module
+
+    now = [1000.0]
+    monkeypatch.setattr(model_router_module.time, "monotonic", lambda: now[0])
+    router = ModelRouter(latency_target_ms=1000, latency_ttl_seconds=60)
+    message = "Refactor this code"
+
+    router.observe(router.models["capable"], 5.0)
+    assert router.route(message).tier == "cheap"
+
+    # The slow reading expires, so the next request probes the capable model again
+    now[0] += 61
+    assert router.route(message).tier == "capable"
+    router.observe(router.models["capable"], 0.5)
+    assert router.route(message).tier == "capable"
+
+
+def test_model_router_disabled_keeps_the_baseline_model():
+    router = ModelRouter()
+    router.enabled = False
+    route = router.route("Refactor this code")
+    assert route.model == "gpt-5-mini" and route.max_completion_tokens == 8192
+
+
+def test_serialization_is_compact_and_handles_non_native_types():
+    from datetime import datetime
+    from pydantic import BaseModel
+
+    class Item(BaseModel):
+        name: str
+
+    payload = {"when": datetime(2024, 1, 2, 3, 4, 5), "item": Item(name="x"), "text": "ünïcödé"}
+    decoded = json.loads(dumps_bytes(payload))
+    assert decoded == {"when": "2024-01-02T03:04:05", "item": {"name": "x"}, "text": "ünïcödé"}
+    assert dumps({"a": 1}) == '{"a":1}'
+
+
+def test_prompt_registry_compiles_static_prefix_and_volatile_suffix():
+    registry = PromptRegistry()
+    template = registry.register("t", """
+        Static instructions.
+    """, "Context: {context}\nRequest: {request}")
+    assert template.static == "Static instructions."
+    assert template.fields == ("context", "request")
+    assert template.render(context="{}", request="list {things}") == "Context: {}\nRequest: list {things}"
+    assert registry.get("t") is template
+    try:
+        template.render(context="{}")
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("expected missing values to be reported")
+
+    devops = prompt_registry.get("devops")
+    assert "Current AWS Context" not in devops.static
+    assert devops.render(context="{}", request="hi").endswith("User request: hi")
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+def test_chat_stream_records_cached_tokens_from_final_usage_chunk():
+    from app.services import metrics
+    from app.services.openai_service import OpenAIService
+
+    def delta(text):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+
+    usage = SimpleNamespace(prompt_tokens=2000, prompt_tokens_details=SimpleNamespace(cached_tokens=1536))
+    requests = []
+
+    async def create(**kwargs):
+        requests.append(kwargs)
+        return FakeStream([delta("Hi"), delta(" there"), SimpleNamespace(choices=[], usage=usage)])
+
+    service = OpenAIService()
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    metadata = {}
+
+    async def collect():
+        return [chunk async for chunk in service.chat_stream("Hello", None, metadata)]
+
+    before = metrics.prompt_cache_counts["chat_stream"]["cached_tokens"]
+    assert asyncio.run(collect()) == ["Hi", " there"]
+    assert requests[0]["stream_options"] == {"include_usage": True}
+    assert requests[0]["messages"][0]["content"] == prompt_registry.get("assistant").static
+    assert metadata["cached_tokens"] == 1536
+    assert metrics.prompt_cache_counts["chat_stream"]["cached_tokens"] == before + 1536
+
+
+def make_image_bytes(size, image_format="PNG", orientation=None):
+    import io
+    from PIL import Image
+
+    image = Image.merge("RGB", [Image.effect_noise(size, sigma) for sigma in (20, 40, 60)])
+    buffer = io.BytesIO()
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        image.save(buffer, image_format, exif=exif)
+    else:
+        image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def test_preprocess_image_downscales_by_task_and_reencodes():
+    original = make_image_bytes((3000, 1000))
+
+    described = preprocess_image(original, "describe")
+    assert described.source_format == "PNG"
+    assert described.media_type == "image/webp"
+    assert max(described.width, described.height) == 1536
+    assert described.bytes_saved > 0
+    assert described.data_url().startswith("data:image/webp;base64,")
+
+    ocr = preprocess_image(original, "ocr")
+    assert max(ocr.width, ocr.height) == 2048
+
+
+def test_preprocess_image_applies_exif_orientation_and_never_grows_uploads():
+    rotated = preprocess_image(make_image_bytes((40, 20), "JPEG", orientation=6))
+    assert (rotated.width, rotated.height) == (20, 40)
+
+    # Unchanged images are never sent larger than they arrived
+    noisy_jpeg = make_image_bytes((64, 64), "JPEG")
+    kept = preprocess_image(noisy_jpeg)
+    assert len(kept.data) <= len(noisy_jpeg)
+    assert kept.media_type == ("image/jpeg" if kept.data == noisy_jpeg else "image/webp")
+
+    try:
+        preprocess_image(b"not an image")
+    except ImageRejected:
+        pass
+    else:
+        raise AssertionError("expected non-images to be rejected")
+
+
+def test_bk_tree_finds_hashes_within_distance():
+    from app.services.vision_cache import BKTree
+
+    tree = BKTree()
+    for value in (0b0000, 0b0001, 0b0111, 0b1111_0000):
+        tree.add(value)
+    assert sorted(tree.search(0b0000, 1)) == [(0, 0b0000), (1, 0b0001)]
+    tree.remove(0b0001)
+    assert tree.search(0b0000, 1) == [(0, 0b0000)]
+    assert sorted(h for _, h in tree.search(0b0011, 8)) == [0b0000, 0b0111, 0b1111_0000]
+
+
+def test_vision_cache_hits_near_duplicates_and_evicts_lru(monkeypatch):
+    import io
+    from PIL import Image
+    from app.services.openai_service import openai_service
+    from app.services.vision_cache import VisionCache
+
+    calls = []
+
+    async def fake_analyze_image(image, prompt, api_key=None):
+        calls.append(prompt)
+        return f"analysis {len(calls)}"
+
+    monkeypatch.setattr(openai_service, "analyze_image", fake_analyze_image)
+
+    gradient = Image.linear_gradient("L").resize((400, 300)).convert("RGB")
+    original, resized = io.BytesIO(), io.BytesIO()
+    gradient.save(original, "PNG")
+    gradient.resize((380, 285)).save(resized, "JPEG", quality=70)
+    other = make_image_bytes((400, 300))
+
+    cache = VisionCache(max_entries=2)
+
+    async def scenario():
+        return [
+            await cache.analyze(original.getvalue(), "describe"),
+            await cache.analyze(resized.getvalue(), "describe"),
+            await cache.analyze(resized.getvalue(), "a different prompt"),
+            await cache.analyze(other, "describe"),
+            await cache.analyze(original.getvalue(), "describe"),
+        ]
+
+    results = asyncio.run(scenario())
+    assert results[0] == ("analysis 1", "miss")
+    assert results[1] == ("analysis 1", "hit")
+    assert results[2] == ("analysis 2", "miss")
+    assert results[3] == ("analysis 3", "miss")
+    # The first entry was least recently used and has been evicted
+    assert results[4] == ("analysis 4", "miss")
+    assert cache.get_stats()["evictions"] >= 1
+
+
+def test_preprocess_image_reads_from_spooled_file():
+    import tempfile
+
+    original = make_image_bytes((3000, 1000), "JPEG")
+    with tempfile.SpooledTemporaryFile(max_size=1024) as spooled:
+        spooled.write(original)
+        result = preprocess_image(spooled, "describe")
+    assert result.original_bytes == len(original)
+    assert max(result.width, result.height) == 1536
+    assert base64.b64decode(result.base64_data) == result.data
+
+
+def test_upload_limit_rejects_declared_and_streamed_oversized_bodies():
+    from fastapi import FastAPI, Request
+    from fastapi.testclient import TestClient
+    from app.middleware.upload_limit import UploadLimitMiddleware
+
+    app = FastAPI()
+    app.add_middleware(UploadLimitMiddleware, limits={"/upload": 1024})
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        return {"size": len(await request.body())}
+
+    @app.post("/other")
+    async def other(request: Request):
+        return {"size": len(await request.body())}
+
+    client = TestClient(app)
+    assert client.post("/upload", content=b"x" * 1000).json() == {"size": 1000}
+    assert client.post("/upload", content=b"x" * 2000).status_code == 413
+    assert client.post("/other", content=b"x" * 2000).status_code == 200
+
+    def chunks():
+        for _ in range(8):
+            yield b"x" * 512
+
+    streamed = client.post("/upload", content=chunks())
+    assert streamed.status_code == 413
+
+
+class FakePage:
+    def __init__(self, context):
+        self.context = context
+        self.url = "about:blank"
+
+    async def goto(self, url, **kwargs):
+        self.url = url
+        for handler in self.context.handlers:
+            handler(SimpleNamespace(resource_type="document", url=url))
+
+    async def unroute_all(self, **kwargs):
+        pass
+
+    async def close(self):
+        self.context.pages.remove(self)
+
+
+class FakeCDPSession:
+    def __init__(self, context):
+        self.context = context
+
+    async def send(self, method, params):
+        self.context.cleared.append((method, params["origin"], params["storageTypes"]))
+
+    async def detach(self):
+        pass
+
+
+class FakeContext:
+    def __init__(self):
+        self.pages = []
+        self.handlers = []
+        self.cleared = []
+        self.scripts = 0
+        self.cookies_cleared = 0
+        self.permissions_cleared = 0
+        self.closed = False
+
+    def on(self, event, handler):
+        if event == "request":
+            self.handlers.append(handler)
+
+    async def add_init_script(self, script):
+        self.scripts += 1
+
+    async def new_cdp_session(self, page):
+        return FakeCDPSession(self)
+
+    async def clear_permissions(self):
+        self.permissions_cleared += 1
+
+    async def new_page(self):
+        page = FakePage(self)
+        self.pages.append(page)
+        return page
+
+    async def unroute_all(self, **kwargs):
+        pass
+
+    async def clear_cookies(self):
+        self.cookies_cleared += 1
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.contexts = []
+
+    async def new_context(self, **kwargs):
+        await asyncio.sleep(0.01)
+        self.contexts.append(FakeContext())
+        return self.contexts[-1]
+
+
+def test_browser_pool_reuses_warm_contexts_and_caps_concurrency():
+    from app.services.browser_pool import BrowserPool
+
+    browser = FakeBrowser()
+
+    async def get_browser():
+        return browser
+
+    pool = BrowserPool(get_browser, size=2, queue_timeout_seconds=5, max_uses=3)
+    active = []
+    peak = []
+
+    async def scrape(n):
+        async with pool.lease() as page:
+            active.append(n)
+            peak.append(len(active))
+            await page.goto(f"https://example.com/{n}")
+            await asyncio.sleep(0.01)
+            active.remove(n)
+
+    async def run():
+        await asyncio.gather(*(scrape(n) for n in range(6)))
+
+    asyncio.run(run())
+    assert max(peak) == 2
+    # Six leases of three uses each over two contexts: both wear out once, none are replaced yet
+    assert pool.created == 2 and pool.recycled == 2
+    assert all(context.scripts == 1 for context in browser.contexts)
+    stats = pool.get_stats()
+    assert stats["leases"] == 6 and stats["in_use"] == 0 and stats["utilization"] == 0
+
+
+def test_browser_pool_clears_storage_of_visited_origins_between_leases():
+    from app.services.browser_pool import BrowserPool
+
+    browser = FakeBrowser()
+
+    async def get_browser():
+        return browser
+
+    pool = BrowserPool(get_browser, size=1, queue_timeout_seconds=5)
+
+    async def run():
+        async with pool.lease() as page:
+            await page.goto("https://shop.example/cart")
+            await page.goto("https://shop.example/checkout")
+            await page.goto("https://login.example:8443/")
+        async with pool.lease() as second:
+            return page, second
+
+    first, second = asyncio.run(run())
+    context = browser.contexts[0]
+    # A fresh tab drops sessionStorage; every visited origin's storage is wiped once
+    assert second is not first and len(context.pages) == 1
+    assert sorted(context.cleared) == [
+        ("Storage.clearDataForOrigin", "https://login.example:8443", "all"),
+        ("Storage.clearDataForOrigin", "https://shop.example", "all"),
+    ]
+    assert context.cookies_cleared == 2 and context.permissions_cleared == 2
+    assert pool.created == 1 and pool.recycled == 0
+
+
+def test_browser_pool_rejects_after_queue_timeout_and_replaces_failed_contexts():
+    from app.services.browser_pool import BrowserPool
+
+    browser = FakeBrowser()
+
+    async def get_browser():
+        return browser
+
+    pool = BrowserPool(get_browser, size=1, queue_timeout_seconds=0.05)
+
+    async def run():
+        async with pool.lease():
+            try:
+                async with pool.lease():
+                    pass
+            except AdmissionRejected as exc:
+                assert exc.retry_after >= 1
+            else:
+                raise AssertionError("expected the pool to reject the second lease")
+        try:
+            async with pool.lease():
+                raise RuntimeError("navigation failed")
+        except RuntimeError:
+            pass
+        async with pool.lease() as page:
+            assert page.context is browser.contexts[-1]
+
+    asyncio.run(run())
+    assert pool.rejected == 1
+    assert browser.contexts[0].closed and len(browser.contexts) == 2
+    assert browser.contexts[0].cookies_cleared == 1
+
+
+def test_scraper_launches_one_browser_for_concurrent_first_requests():
+    from app.services.scraper_service import ScraperService
+
+    launches = []
+
+    async def launch_browser():
+        launches.append(True)
+        await asyncio.sleep(0.01)
+        return object(), FakeBrowser()
+
+    service = ScraperService()
+    service._launch_browser = launch_browser
+
+    async def run():
+        return await asyncio.gather(*(service._init_playwright() for _ in range(5)))
+
+    browsers = asyncio.run(run())
+    assert len(launches) == 1
+    assert all(browser is browsers[0] for browser in browsers)
+
+
+def test_robots_cache_coalesces_fetches_and_caches_failures():
+    import httpx
+    from app.services.robots_cache import RobotsCache
+
+    fetched = []
+
+    async def handler(request):
+        fetched.append(request.url.host)
+        await asyncio.sleep(0.01)
+        if request.url.host == "down.example":
+            raise httpx.ConnectError("unreachable", request=request)
+        return httpx.Response(
+            200,
+            text="User-agent: *\nDisallow: /private\nCrawl-delay: 5\n",
+            headers={"Cache-Control": "max-age=600"},
+        )
+
+    async def run():
+        cache = RobotsCache(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        cache.max_crawl_delay = 0.05
+        allowed = await asyncio.gather(*(cache.can_fetch(f"https://site.example/page/{n}") for n in range(5)))
+        assert all(allowed)
+        assert not await cache.can_fetch("https://site.example/private/x")
+        assert await cache.can_fetch("https://down.example/")
+        assert await cache.can_fetch("https://down.example/again")
+
+        start = time.perf_counter()
+        waits = [await cache.wait_for_crawl_delay("https://site.example/a") for _ in range(3)]
+        assert waits[0] == 0 and time.perf_counter() - start >= 0.09
+        await cache.close()
+        return cache.get_stats()
+
+    stats = asyncio.run(run())
+    assert fetched == ["site.example", "down.example"]
+    assert stats["misses"] == 2 and stats["coalesced"] == 4
+    assert stats["fetch_errors"] == 1 and stats["delayed"] == 2
+
+
+def test_robots_cache_allows_urls_httpx_cannot_request():
+    import httpx
+    from app.services.robots_cache import RobotsCache
+
+    async def handler(request):
+        return httpx.Response(404)
+
+    async def run():
+        cache = RobotsCache(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        results = [await cache.can_fetch(url) for url in ("http://xn--/page", "http://bad\x00host/page")]
+        await cache.close()
+        return results, cache.get_stats()
+
+    results, stats = asyncio.run(run())
+    assert results == [True, True]
+    assert stats["fetch_errors"] == 2
+
+
+def test_resource_policy_blocks_heavy_and_tracker_requests():
+    from app.services.resource_policy import ResourcePolicy, apply_resource_policy
+
+    class FakeRoute:
+        def __init__(self, resource_type, url):
+            self.request = type("Request", (), {"resource_type": resource_type, "url": url})()
+            self.outcome = None
+
+        async def abort(self, reason):
+            self.outcome = reason
+
+        async def continue_(self):
+            self.outcome = "continued"
+
+    class RoutedPage:
+        async def route(self, pattern, handler):
+            self.handler = handler
+
+    policy = ResourcePolicy.resolve(block_domains=["cdn.ads.test"])
+    assert policy.blocks("image", "https://example.com/logo.png")
+    assert policy.blocks("script", "https://www.google-analytics.com/analytics.js")
+    assert policy.blocks("xhr", "https://eu.cdn.ads.test/pixel")
+    assert not policy.blocks("document", "https://example.com/")
+    assert not ResourcePolicy.resolve(capture_screenshot=True).blocks("image", "https://example.com/logo.png")
+    assert not ResourcePolicy.resolve(block_resources=[]).blocks("image", "https://example.com/logo.png")
+
+    async def run():
+        page = RoutedPage()
+        stats = await apply_resource_policy(page, policy)
+        routes = [
+            FakeRoute("document", "https://example.com/"),
+            FakeRoute("image", "https://example.com/a.jpg"),
+            FakeRoute("font", "https://example.com/f.woff2"),
+            FakeRoute("script", "https://example.com/app.js"),
+        ]
+        for route in routes:
+            await page.handler(route)
+        return stats, [route.outcome for route in routes]
+
+    stats, outcomes = asyncio.run(run())
+    assert outcomes == ["continued", "blockedbyclient", "blockedbyclient", "continued"]
+    assert stats.blocked == 2 and stats.bytes_saved > 0
+    assert stats.by_type == {"image": 1, "font": 1}
+
+
+def test_auto_engine_uses_http_for_static_pages_and_remembers_escalations(monkeypatch):
+    import importlib
+    import httpx
+    from app.services.browser_pool import BrowserPool
+    from app.services.http_engine import HttpEngine
+    from app.services.page_cache import PageCache
+    from app.services.scraper_service import ScrapeResult, ScraperService
+
+    scraper_module = importlib.import_module("app.services.scraper_service")
+    article = "<p>" + "Static article text. " * 20 + "</p>"
+    pages = {
+        "static.example": f"<html><head><title>Static</title></head><body><main>{article}</main></body></html>",
+        "spa.example": '<html><body><div id="root"></div><noscript>Enable JavaScript</noscript></body></html>',
+    }
+    fetched = []
+
+    async def handler(request):
+        fetched.append(request.url.host)
+        return httpx.Response(200, text=pages[request.url.host], headers={"Content-Type": "text/html; charset=utf-8"})
+
+    engine = HttpEngine(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(scraper_module, "http_engine", engine)
+    monkeypatch.setattr(scraper_module, "page_cache", PageCache(enabled=False))
+
+    async def allow_all(url):
+        return True
+
+    monkeypatch.setattr(scraper_module.robots_cache, "can_fetch", allow_all)
+
+    rendered = []
+
+    async def fake_scrape_page(page, url, *args):
+        rendered.append(url)
+        return ScrapeResult(success=True, url=url, title="SPA", html="<div>app</div>", text="app")
+
+    async def get_browser():
+        return FakeBrowser()
+
+    service = ScraperService()
+    service.pool = BrowserPool(get_browser, size=1)
+    monkeypatch.setattr(service, "_scrape_page", fake_scrape_page)
+
+    async def run():
+        static = await service.scrape("https://static.example/post", engine="auto", extract_selector="main")
+        first = await service.scrape("https://spa.example/", engine="auto")
+        second = await service.scrape("https://spa.example/other", engine="auto")
+        forced = await service.scrape("https://spa.example/", engine="http")
+        return static, first, second, forced
+
+    static, first, second, forced = asyncio.run(run())
+    assert static.engine == "http" and static.title == "Static"
+    assert static.html.startswith("<p>Static article text.")
+    assert first.engine == second.engine == "playwright"
+    assert forced.engine == "http" and forced.success
+    # The SPA domain is fetched over HTTP once, then goes straight to the browser
+    assert fetched == ["static.example", "spa.example", "spa.example"]
+    assert rendered == ["https://spa.example/", "https://spa.example/other"]
+    assert engine.get_stats()["escalations"] == 1
+    assert engine.memory.get("spa.example") == "browser"
+
+
+def test_load_page_waits_for_dom_quiet_or_falls_back_to_networkidle():
+    from app.services.readiness import DOM_QUIET_SCRIPT, load_page
+
+    class ReadinessPage:
+        def __init__(self):
+            self.calls = []
+
+        async def goto(self, url, wait_until=None, timeout=None):
+            self.calls.append(("goto", wait_until))
+
+        async def evaluate(self, script, args):
+            self.calls.append(("evaluate", script == DOM_QUIET_SCRIPT, args[0]))
+            return "quiet"
+
+        async def wait_for_selector(self, selector, timeout=None):
+            self.calls.append(("selector", selector))
+
+        async def wait_for_timeout(self, ms):
+            self.calls.append(("sleep", ms))
+
+    async def run():
+        stable, legacy, selector = ReadinessPage(), ReadinessPage(), ReadinessPage()
+        reasons = (
+            await load_page(stable, "https://example.com", "dom_stable", quiet_ms=300),
+            await load_page(legacy, "https://example.com", "networkidle", wait_time_ms=2000),
+            await load_page(selector, "https://example.com", "dom_stable", wait_for_selector="#content"),
+        )
+        return reasons, stable.calls, legacy.calls, selector.calls
+
+    reasons, stable, legacy, selector = asyncio.run(run())
+    assert [reason for reason, _ in reasons] == ["quiet", "networkidle", "selector"]
+    assert stable == [("goto", "domcontentloaded"), ("evaluate", True, 300)]
+    assert legacy == [("goto", "networkidle"), ("sleep", 2000)]
+    assert selector == [("goto", "domcontentloaded"), ("selector", "#content")]
+
+
+def test_canonicalize_url_dedupes_equivalent_spellings():
+    from app.services.crawler import extract_links
+    from app.services.urls import canonicalize_url
+
+    same = {
+        canonicalize_url("HTTPS://Example.COM:443"),
+        canonicalize_url("https://example.com/#section"),
+        canonicalize_url("/", "https://example.com/docs/"),
+        canonicalize_url("https://example.com/?utm_source=news&fbclid=abc"),
+    }
+    assert same == {"https://example.com/"}
+    assert canonicalize_url("https://example.com/p?b=2&a=1") == "https://example.com/p?a=1&b=2"
+    assert canonicalize_url("http://example.com:8080/x") == "http://example.com:8080/x"
+    assert canonicalize_url("mailto:someone@example.com") is None
+
+    html = '<base href="/docs/"><a href="intro">Intro</a><a href="/logo.png">Logo</a><a rel="nofollow" href="/login">Login</a>'
+    assert extract_links(html, "https://example.com/") == ["https://example.com/docs/intro"]
+
+
+def test_page_cache_serves_fresh_copies_and_revalidates_stale_ones(monkeypatch, tmp_path):
+    import importlib
+    import httpx
+    from app.services.http_engine import HttpEngine
+    from app.services.page_cache import PageCache
+    from app.services.scraper_service import ScraperService
+
+    scraper_module = importlib.import_module("app.services.scraper_service")
+    article = "<p>" + "Cached article text. " * 20 + "</p>"
+    requests = []
+
+    async def handler(request):
+        requests.append(request.headers.get("if-none-match"))
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(
+            200,
+            text=f"<html><head><title>Post</title></head><body>{article}</body></html>",
+            headers={"Content-Type": "text/html", "ETag": '"v1"'},
+        )
+
+    cache = PageCache(directory=str(tmp_path), ttl_seconds=60, enabled=True)
+    monkeypatch.setattr(scraper_module, "page_cache", cache)
+    monkeypatch.setattr(scraper_module, "http_engine", HttpEngine(client=httpx.AsyncClient(transport=httpx.MockTransport(handler))))
+
+    async def allow_all(url):
+        return True
+
+    monkeypatch.setattr(scraper_module.robots_cache, "can_fetch", allow_all)
+    service = ScraperService()
+
+    async def run():
+        miss = await service.scrape("https://example.com/post?utm_source=feed", engine="http")
+        hit = await service.scrape("https://example.com/post", engine="http")
+        revalidated = await service.scrape("https://example.com/post", engine="http", max_age=0)
+        return miss, hit, revalidated
+
+    miss, hit, revalidated = asyncio.run(run())
+    assert [miss.cache_status, hit.cache_status, revalidated.cache_status] == ["miss", "hit", "revalidated"]
+    assert hit.text == revalidated.text == miss.text and hit.title == "Post"
+    # One full fetch, then a conditional request that never re-downloaded the body
+    assert requests == [None, '"v1"']
+    assert cache.get_stats()["revalidated"] == 1
+
+    async def option_variants():
+        default = await service.scrape("https://example.com/post", engine="http")
+        explicit = await service.scrape("https://example.com/post", engine="http", wait_strategy="dom_stable")
+        variants = [
+            await service.scrape("https://example.com/post", engine="http", **options)
+            for options in (
+                {"block_resources": ["script"]},
+                {"block_domains": ["cdn.example"]},
+                {"wait_strategy": "networkidle"},
+                {"quiet_ms": 50},
+                {"wait_time_ms": 500},
+            )
+        ]
+        return default, explicit, variants
+
+    default, explicit, variants = asyncio.run(option_variants())
+    # Spelling out a default shares the entry; options that change content get their own
+    assert default.cache_status == explicit.cache_status == "hit"
+    assert [result.cache_status for result in variants] == ["miss"] * 5
+
+    async def dedupe_and_evict():
+        small = PageCache(directory=str(tmp_path / "small"), max_bytes=400, enabled=True)
+        first = await small.put(small.key_for("https://a.example/", {}), "https://a.example/", "A", "<p>same</p>", "same", "http")
+        second = await small.put(small.key_for("https://b.example/", {}), "https://b.example/", "B", "<p>same</p>", "same", "http")
+        shared = small.get_stats()["blobs"]
+        big = "".join(f"{n:x}" for n in range(300))
+        await small.put(small.key_for("https://c.example/", {}), "https://c.example/", "C", big, big, "http")
+        return first, second, shared, small.get_stats(), await small.get(first.key)
+
+    first, second, shared, stats, evicted = asyncio.run(dedupe_and_evict())
+    assert first.blob == second.blob and shared == 1
+    assert stats["evictions"] == 2 and stats["entries"] == 1 and evicted is None
+
+
+def test_page_cache_counts_a_blob_stored_concurrently_once(tmp_path):
+    from app.services.page_cache import PageCache
+
+    async def run():
+        cache = PageCache(directory=str(tmp_path / "cache"), enabled=True)
+        urls = [f"https://site.example/{n}" for n in range(4)]
+        await asyncio.gather(*(cache.put(cache.key_for(url, {}), url, "T", "<p>same</p>", "same", "http") for url in urls))
+        return cache
+
+    cache = asyncio.run(run())
+    blob_files = list((tmp_path / "cache" / "blobs").rglob("*.z"))
+    assert len(blob_files) == 1
+    assert cache.get_stats()["bytes"] == blob_files[0].stat().st_size
+
+
+def test_page_cache_only_trusts_a_private_directory(monkeypatch, tmp_path):
+    import os
+    import stat
+    from app.services import page_cache as page_cache_module
+    from app.services.page_cache import PageCache
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg"))
+    assert PageCache().directory == str(tmp_path / "xdg" / "omnidev" / "scrape-cache")
+
+    async def store(cache):
+        url = "https://site.example/"
+        await cache.put(cache.key_for(url, {}), url, "T", "<p>x</p>", "x", "http")
+        return cache.get_stats()
+
+    loose = tmp_path / "loose"
+    loose.mkdir(mode=0o777)
+    os.chmod(loose, 0o777)
+    stats = asyncio.run(store(PageCache(directory=str(loose), enabled=True)))
+    assert stats["enabled"] and stats["entries"] == 1
+    assert stat.S_IMODE(loose.stat().st_mode) == 0o700
+
+    planted = tmp_path / "planted"
+    planted.symlink_to(loose)
+    stats = asyncio.run(store(PageCache(directory=str(planted), enabled=True)))
+    assert not stats["enabled"] and stats["entries"] == 0 and stats["error"]
+
+    monkeypatch.setattr(page_cache_module.os, "getuid", lambda: os.stat(loose).st_uid + 1)
+    foreign = tmp_path / "foreign"
+    foreign.mkdir()
+    stats = asyncio.run(store(PageCache(directory=str(foreign), enabled=True)))
+    assert not stats["enabled"] and not (foreign / "entries").exists()
+
+
+def test_crawler_keeps_per_host_limits_while_other_hosts_proceed(monkeypatch):
+    import importlib
+    from app.services.crawler import CrawlService
+    from app.services.scraper_service import ScrapeResult
+
+    crawler_module = importlib.import_module("app.services.crawler")
+    hub = "".join(f'<a href="/p{n}">p{n}</a>' for n in range(300))
+    active = {}
+    peak = {}
+    order = []
+
+    async def fake_scrape(url, **options):
+        host = url.split("/")[2]
+        active[host] = active.get(host, 0) + 1
+        peak[host] = max(peak.get(host, 0), active[host])
+        order.append(url)
+        await asyncio.sleep(0.001)
+        active[host] -= 1
+        html = hub if url == "https://busy.example/" else '<a href="/next">next</a>'
+        return ScrapeResult(success=True, url=url, title="", html=html, text="")
+
+    monkeypatch.setattr(crawler_module.scraper_service, "scrape", fake_scrape)
+
+    async def run():
+        lines = []
+        async for line in CrawlService().run(
+            ["https://busy.example/", "https://quiet.example/"],
+            max_depth=1,
+            max_pages=100,
+            concurrency=4,
+            per_host_concurrency=1,
+            per_host_delay_ms=0,
+        ):
+            lines.append(line)
+        return lines
+
+    lines = asyncio.run(run())
+    assert peak == {"busy.example": 1, "quiet.example": 1}
+    # The quiet host is not starved behind the busy host's 300 queued links
+    assert order.index("https://quiet.example/next") < 10
+    # Two seeds, 300 hub links and quiet.example/next were queued
+    assert lines[-1]["pages"] == 100 and lines[-1]["unvisited"] == 303 - 100
+
+
+def test_crawler_resolves_links_against_the_redirected_url(monkeypatch):
+    import importlib
+    import httpx
+    from app.services.crawler import CrawlService
+    from app.services.http_engine import HttpEngine
+    from app.services.scraper_service import ScrapeResult
+
+    async def handler(request):
+        if request.url.path == "/docs":
+            return httpx.Response(301, headers={"Location": "/docs/"})
+        return httpx.Response(200, html="<title>Docs</title><p>" + "text " * 100 + "</p>")
+
+    async def fetch():
+        engine = HttpEngine(client=httpx.AsyncClient(transport=httpx.MockTransport(handler), follow_redirects=True))
+        fields, _ = await engine.fetch("https://site.example/docs")
+        await engine.close()
+        return fields
+
+    assert asyncio.run(fetch())["final_url"] == "https://site.example/docs/"
+
+    crawler_module = importlib.import_module("app.services.crawler")
+    scraped = []
+
+    async def fake_scrape(url, **options):
+        scraped.append(url)
+        if url == "https://site.example/docs":
+            html = '<a href="intro">intro</a><a href="/docs/">self</a>'
+            return ScrapeResult(success=True, url=url, title="", html=html, text="", final_url="https://site.example/docs/")
+        return ScrapeResult(success=True, url=url, title="", html="", text="")
+
+    monkeypatch.setattr(crawler_module.scraper_service, "scrape", fake_scrape)
+
+    async def run():
+        return [line async for line in CrawlService().run(["https://site.example/docs"], max_depth=1, max_pages=10)]
+
+    asyncio.run(run())
+    # "intro" is relative to /docs/, and the redirect target is not crawled a second time
+    assert scraped == ["https://site.example/docs", "https://site.example/docs/intro"]